@@ -1,8 +1,25 @@
 import gc
-from inverse import Registers, Inverse
+from inverse import Registers, Inverse, LazyInverse
+
+# Keep calibration tables on flash and read rows on demand,
+# rather than loading them into RAM.  Needs the .bin tables.
+LAZY_CAL = False
+
+# Prefer the compiled binary calibration tables, they load with a
+# single read.  Fall back to the text tables if a binary one is
+# missing or fails its CRC check.
+def load_cal(name):
+  if LAZY_CAL:
+    cal = LazyInverse(name+'.bin')
+  else:
+    cal = Inverse(name+'.bin')
+  if not cal.initialized:
+    gc.collect()
+    cal = Inverse(name+'.dat')
+  return cal
 
 gc.collect()
-cal1 = Inverse('data/invert-sn0-r1-cal.dat')
+cal1 = load_cal('data/invert-sn0-r1-cal')
 gc.collect()
-cal2 = Inverse('data/invert-sn0-r2-cal.dat')
+cal2 = load_cal('data/invert-sn0-r2-cal')
 gc.collect()
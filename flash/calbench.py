@@ -0,0 +1,24 @@
+# Calibration table load benchmark, run on the Tiny 2040:
+#   import calbench
+# Reports load time and heap used by the text and binary
+# calibration tables, see host/calcompile.py
+
+import gc
+import utime
+from inverse import Inverse
+
+def measure(fname):
+  gc.collect()
+  free0 = gc.mem_free()
+  t0 = utime.ticks_us()
+  cal = Inverse(fname)
+  t1 = utime.ticks_us()
+  gc.collect()
+  free1 = gc.mem_free()
+  print('{:28s} {:6s} {:8d} us {:6d} bytes'.format(
+        fname, str(cal.initialized), utime.ticks_diff(t1, t0), free0-free1))
+  return cal
+
+for name in ('data/invert-sn0-r1-cal', 'data/invert-sn0-r2-cal'):
+  measure(name+'.dat')
+  measure(name+'.bin')
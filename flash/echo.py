@@ -1,14 +1,84 @@
+""" Serial link benchmarks, the device side of host/serial_bench.py.
+
+Typing 'a' answers a line of 100 characters, the original round trip
+test.  Command lines start the throughput modes, raw bytes through
+sys.stdin.buffer and sys.stdout.buffer, at most CHUNK_MAX at a time:
+
+  ECHO size count     reads size bytes and writes them back, count times
+  SINK total chunk    reads and discards total bytes, chunk at a time
+  SOURCE total chunk  writes total bytes of digits, chunk at a time
+
+Each ends with the line "MODE size-or-total us", the time the device
+took, or "! line" for a bad command.  0x03 does not interrupt a mode.
+"""
+
 import time
 import sys
 import select
+import micropython
+
+CHUNK_MAX = 4096
+buf = bytearray(CHUNK_MAX)
+
+def readfull(mv):
+  n = 0
+  while n < len(mv):
+    n += sys.stdin.buffer.readinto(mv[n:])
+
+def echo(size, count):
+  mv = memoryview(buf)[:size]
+  for i in range(count):
+    readfull(mv)
+    sys.stdout.buffer.write(mv)
+
+def sink(total, chunk):
+  mv = memoryview(buf)
+  while total > 0:
+    n = min(chunk, total)
+    readfull(mv[:n])
+    total -= n
+
+def source(total, chunk):
+  for i in range(chunk):
+    buf[i] = 0x30 + i % 10
+  mv = memoryview(buf)
+  while total > 0:
+    n = min(chunk, total)
+    sys.stdout.buffer.write(mv[:n])
+    total -= n
+
+# mode -> (function, which argument is bounded by CHUNK_MAX)
+MODES = {'ECHO': (echo, 0), 'SINK': (sink, 1), 'SOURCE': (source, 1)}
+
+def command(words):
+  try:
+    mode, bounded = MODES[words[0]]
+    args = [int(w) for w in words[1:]]
+    if len(args) != 2 or min(args) < 1 or args[bounded] > CHUNK_MAX:
+      raise ValueError(words)
+  except (KeyError, IndexError, ValueError):
+    print('!', ' '.join(words))
+    return
+  micropython.kbd_intr(-1)
+  t0 = time.ticks_us()
+  try:
+    mode(*args)
+  finally:
+    micropython.kbd_intr(3)
+  print(words[0], args[0], time.ticks_diff(time.ticks_us(), t0))
 
 def run():
   print('running...')
-  while True:        
-    while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:        
+  line = ''
+  while True:
+    while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
       ch = sys.stdin.read(1)
       # print(hex(ord(ch)))
-      if (ch == 'a'):
+      if ch == 'a' and not line:
         # 100 characters
         print( 'a'*100 )
-
+      elif ch == '\n':
+        command(line.split())
+        line = ''
+      elif ch >= ' ':
+        line += ch
@@ -37,6 +37,9 @@ class Digipot:
     self.cmds = [0x080] * self.nchans
     for ch in range(self.nchans):
       self.cmds[ch] += ch << 8
+    # dirty marks channels whose command has changed since it was
+    # last sent, all are sent the first time
+    self.dirty = [True] * self.nchans
     # rwa and rwb stores the digipot resistances
     self.rwa = [0] * self.nchans
     self.rwb = [0] * self.nchans
@@ -84,7 +87,9 @@ class Digipot:
       command = chan << 8
       command += (values[chan] & 0xff)
       self.vals[chan] = values[chan]
-      self.cmds[chan] = command
+      if command != self.cmds[chan]:
+        self.cmds[chan] = command
+        self.dirty[chan] = True
     self.ohms() # update the resistances
     # temporary, show combined
     # print( self.Rcombine()[0], self.vals )
@@ -164,6 +169,10 @@ class Digipot:
 
 class Digichain:
 
+  # SPI clock rates tried by tune(), the AD8403 is specified to 10 MHz
+  RATES = ( 100_000, 200_000, 500_000, 1_000_000, 2_000_000,
+            5_000_000, 10_000_000, 20_000_000 )
+
   def __init__(self, spi=0, baudrate=100_000, digipots=[],
               pin_ss = 5, pin_shdn = 27, pin_rst = 26,
               firstbit = SPI.MSB, polarity = 0, phase = 1,
@@ -173,6 +182,7 @@ class Digichain:
     self.digipots = digipots
     self.npots = len(digipots)
 
+    self.baudrate = baudrate
     self.spi = SPI(spi, baudrate=baudrate, 
                   # firstbit = firstbit,
                   # polarity=polarity, phase=phase, 
@@ -212,6 +222,32 @@ class Digichain:
     
     self.verbose = True
 
+    # each frame is a whole number of bytes, with the
+    # remaining bits to discard on loopback at the front
+    self.nbits = self.npots * 10
+    self.nbytes = (self.nbits + 7 ) // 8
+    self.nremainder = 8*self.nbytes - self.nbits 
+    self.dummy = bytes(b'\x55')*self.nbytes
+
+    # verify each frame with the next one, see send()
+    self.pipelined = True
+
+    # line up the digipots' changes to latch together, see schedule()
+    self.atomic = True
+
+    # frames sent and skipped by send(), and SPI transfers
+    self.nsent = 0
+    self.nskipped = 0
+    self.nxfers = 0
+
+    # frames failing their loopback check are resent up to
+    # retries times, counting mismatches, resends, and frames
+    # still failing after all the retries
+    self.retries = 2
+    self.nerrors = 0
+    self.nretries = 0
+    self.nfailed = 0
+
     self.operate()
     self.select()
     self.reset()
@@ -220,42 +256,201 @@ class Digichain:
   def status(self):
     print( 'select:', self.ss.value(), 
            'shutdown:', self.shdn.value(), 
-           'reset:', self.rst.value() 
+           'reset:', self.rst.value(),
+           'sent:', self.nsent,
+           'skipped:', self.nskipped,
+           'xfers:', self.nxfers,
+           'baudrate:', self.baudrate,
+           'errors:', self.nerrors,
+           'retries:', self.nretries,
+           'failed:', self.nfailed
          )
     
-  def send( self, channels=None ):
-    """send values to specified channel(s), all digipots in chain."""
-    
-    errs = []
-    checks = []
-    for c in self.digipots[0].get_channel_list(channels):      
-      # build the combined command word
-      command = 0
-      for dp in self.digipots:
-        command  =  command << 10
-        command += (dp.cmds[c] & 0x3ff)
-      # calculate it's size in bytes a big integer
-      # note remaining bits to discard on loopback
-      nbits = self.npots * 10
-      nbytes = (nbits + 7 ) // 8
-      nremainder = 8*nbytes - nbits 
-      xbuff = bytearray( command.to_bytes(nbytes, 'big'))
-      rbuff = bytearray(bytes(b'\xaa')*nbytes)
-      self.spi.write_readinto( xbuff, rbuff )
+  def command(self, c):
+    """Builds the combined command word of channel c, all digipots."""
+    return self.frame( [c] * self.npots )
+
+  def frame(self, chans):
+    """Builds the combined command word of channel chans[i] on
+    digipot i, each digipot can take a different channel."""
+    command = 0
+    for dp, c in zip(self.digipots, chans):
+      command  =  command << 10
+      command += (dp.cmds[c] & 0x3ff)
+    return command
+
+  def schedule(self, clist, force=False):
+    """Frames for an atomic send, as lists of one channel per digipot.
+
+    Each digipot's dirty channels in clist go out in the last frames,
+    so every digipot that changes takes its final value on the same
+    /CS edge.  Digipots with fewer dirty channels are padded at the
+    front by rewriting a clean channel with its unchanged value."""
+    dirty = [ [ c for c in clist if force or dp.dirty[c] ]
+              for dp in self.digipots ]
+    nframes = max( [ len(d) for d in dirty ] )
+    columns = []
+    for dp, d in zip(self.digipots, dirty):
+      clean = [ c for c in range(dp.nchans) if c not in d ]
+      columns.append( clean[:1] * (nframes - len(d)) + d )
+    return [ [ col[k] for col in columns ] for k in range(nframes) ]
+
+  def shift(self, xbuff):
+    """Shifts one frame through the chain, returns what came out."""
+    rbuff = bytearray(self.nbytes)
+    self.spi.write_readinto( xbuff, rbuff )
+    self.nxfers += 1
+    #print('XMT:', binascii.hexlify(xbuff), 'RCV:', binascii.hexlify(rbuff))
+    return int.from_bytes( rbuff, 'big') >> self.nremainder
+
+  def shift_each(self, commands):
+    """Two transfers per frame: the command, then a dummy frame
+    to shift it back out for checking."""
+    loopbacks = []
+    for command in commands:
+      self.shift( command.to_bytes(self.nbytes, 'big') )
       self.unselect()
       self.select()
-      #print('1. XMT:', binascii.hexlify(xbuff), 'RCV:', binascii.hexlify(rbuff))
-      xbuff = bytearray(bytes(b'\x55')*nbytes)
-      rbuff = bytearray(nbytes)
-      self.spi.write_readinto( xbuff, rbuff )
-      loopback = int.from_bytes( rbuff, 'big') >> nremainder
-      #print('2. XMT:', binascii.hexlify(xbuff), 'RCV:', binascii.hexlify(rbuff))
-      #print('3. CMD:', hex(command), 'LOOPBACK:', hex(loopback) )
-      mismatch = command != loopback
-      checks.append( [ hex(command), hex(loopback) ] )
-      #checks.append( [ mismatch, self.cmd_parse(command), self.cmd_parse(loopback) ] )
-
-    return any( [ c[0] for c in checks ] ), checks
+      loopbacks.append( self.shift( self.dummy ) )
+    return loopbacks
+
+  def shift_pipelined(self, commands):
+    """One transfer per frame plus one dummy frame in all: each
+    command frame shifts out the previous one for checking."""
+    loopbacks = []
+    first = True
+    for command in commands:
+      loopback = self.shift( command.to_bytes(self.nbytes, 'big') )
+      if not first:
+        loopbacks.append( loopback )
+      first = False
+      self.unselect()
+      self.select()
+    if commands:
+      loopbacks.append( self.shift( self.dummy ) )
+    return loopbacks
+
+  def send( self, channels=None, force=False, pipelined=None,
+            atomic=None ):
+    """send values to specified channel(s), all digipots in chain.
+
+    Each frame carries one channel for every digipot, and is only
+    sent if that channel is dirty on some digipot, unless force is set.
+    If atomic, frames pair up each digipot's own dirty channels instead,
+    see schedule(), so all the digipots settle together.
+    Frames failing their loopback check are resent, up to self.retries
+    times, and their channels stay dirty if they never pass.
+    pipelined and atomic override self.pipelined and self.atomic.
+    Returns errs, True if any frame still fails, and checks, the
+    [command, loopback] pair of every frame shifted, resends included."""
+
+    if pipelined is None:
+      pipelined = self.pipelined
+    if atomic is None:
+      atomic = self.atomic
+    clist = []
+    for c in self.digipots[0].get_channel_list(channels):      
+      if not force and not any( [ dp.dirty[c] for dp in self.digipots ] ):
+        self.nskipped += 1
+      else:
+        clist.append(c)
+
+    if atomic and clist:
+      slots = self.schedule(clist, force)
+    else:
+      slots = [ [c] * self.npots for c in clist ]
+    checks = []
+    failed = []
+    tries = 0
+    while slots:
+      commands = [ self.frame(chans) for chans in slots ]
+      if pipelined:
+        loopbacks = self.shift_pipelined(commands)
+      else:
+        loopbacks = self.shift_each(commands)
+      failed = []
+      for chans, command, loopback in zip(slots, commands, loopbacks):
+        #print('CMD:', hex(command), 'LOOPBACK:', hex(loopback) )
+        mismatch = command != loopback
+        checks.append( [ hex(command), hex(loopback) ] )
+        #checks.append( [ mismatch, self.cmd_parse(command), self.cmd_parse(loopback) ] )
+        self.nsent += 1
+        if mismatch:
+          # a garbled frame may have hit any digipot, resend all of it
+          self.nerrors += 1
+          failed.append(chans)
+          for dp, c in zip(self.digipots, chans):
+            dp.dirty[c] = True
+        else:
+          for dp, c in zip(self.digipots, chans):
+            dp.dirty[c] = False
+      if not failed or tries >= self.retries:
+        break
+      tries += 1
+      self.nretries += len(failed)
+      if atomic:
+        # resend whatever is still dirty, lined up again
+        slots = self.schedule(clist, force=False)
+      else:
+        slots = failed
+
+    self.nfailed += len(failed)
+    return len(failed) > 0, checks
+
+  def set_baudrate(self, baudrate):
+    self.spi.init(baudrate=baudrate)
+    self.baudrate = baudrate
+
+  def loopback_test(self, nframes=64):
+    """Shifts test patterns through the chain, returns the number
+    of frames that did not come back intact.
+
+    /CS is not toggled, so nothing reaches the wiper registers."""
+    mask = (1 << self.nbits) - 1
+    fixed = ( 0, mask, 0x55555555 & mask, 0xaaaaaaaa & mask )
+    x = 0x2f5a3
+    expect = None
+    errors = 0
+    for k in range(nframes+1):
+      if k < len(fixed):
+        pattern = fixed[k]
+      else:
+        # xorshift, for a spread of bit patterns
+        x ^= (x << 7) & 0xffffffff
+        x ^= x >> 9
+        x ^= (x << 8) & 0xffffffff
+        pattern = x & mask
+      loopback = self.shift( pattern.to_bytes(self.nbytes, 'big') )
+      if expect is not None and loopback != expect:
+        errors += 1
+      expect = pattern
+    return errors
+
+  def tune(self, rates=None, nframes=64, margin=0.5):
+    """Finds the fastest SPI clock the chain loops back cleanly.
+
+    Steps up through rates until a loopback test fails, then settles
+    on the fastest clean rate at or below margin times the fastest
+    clean rate seen, keeping a safety margin.
+    Returns the chosen baudrate and a list of (rate, errors)."""
+    if rates is None:
+      rates = self.RATES
+    results = []
+    clean = []
+    for rate in rates:
+      self.set_baudrate(rate)
+      errors = self.loopback_test(nframes)
+      results.append( (rate, errors) )
+      if errors:
+        break
+      clean.append(rate)
+    if not clean:
+      rate = rates[0]
+    else:
+      safe = [ r for r in clean if r <= clean[-1] * margin ]
+      rate = safe[-1] if safe else clean[0]
+    self.set_baudrate(rate)
+    return rate, results
 
   def select(self):
     self.ss.value(True)
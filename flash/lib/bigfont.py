@@ -0,0 +1,72 @@
+# Large font for the OLED, pre-rasterized on the host by host/mkfont.py
+#
+# Glyphs are stored as MONO_VLSB columns, page by page, the same layout
+# as the SSD1306 framebuffer, so drawing a glyph at a page boundary is
+# one slice copy per page straight into the display buffer.
+
+import struct
+
+MAGIC = b'TRCF'
+VERSION = 1
+HEADER = '<4sBBB' # magic, version, height in pixels, number of glyphs
+HEADER_SIZE = struct.calcsize(HEADER)
+GLYPH = '<BBH'    # character code, width, offset into the bitmaps
+GLYPH_SIZE = struct.calcsize(GLYPH)
+
+class Font:
+
+  def __init__(self, fname=None):
+    self.initialized = False
+    self.height = 0
+    self.pages = 0
+    self.glyphs = {} # character --> (width, offset)
+    self.bitmaps = bytearray()
+    if fname is not None:
+      self.load(fname)
+
+  def load(self, fname):
+    try:
+      with open(fname, 'rb') as fin:
+        magic, version, height, nglyphs = \
+            struct.unpack(HEADER, fin.read(HEADER_SIZE))
+        if magic != MAGIC or version != VERSION:
+          return
+        self.height = height
+        self.pages = height // 8
+        table = fin.read(GLYPH_SIZE*nglyphs)
+        size = 0
+        for k in range(nglyphs):
+          code, width, offset = struct.unpack_from(GLYPH, table, GLYPH_SIZE*k)
+          self.glyphs[chr(code)] = (width, offset)
+          size = max(size, offset + width*self.pages)
+        self.bitmaps = bytearray(size)
+        self.initialized = fin.readinto(self.bitmaps) == size
+    except OSError as error:
+      self.initialized = False
+
+  def width(self, s):
+    """Width of s in pixels, unknown characters are skipped."""
+    w = 0
+    for ch in s:
+      if ch in self.glyphs:
+        w += self.glyphs[ch][0]
+    return w
+
+  def text(self, fb, s, x, page):
+    """Draws s into framebuffer fb at column x, starting on page
+    (text row of 8 pixels), clipped at the right edge.
+    Returns the column following the text."""
+    buf = fb.buffer
+    bm = memoryview(self.bitmaps)
+    fbw = fb.width
+    for ch in s:
+      if x >= fbw: break
+      if ch not in self.glyphs: continue
+      width, offset = self.glyphs[ch]
+      w = min(width, fbw - x)
+      for p in range(self.pages):
+        dst = (page + p)*fbw + x
+        src = offset + p*width
+        buf[dst:dst+w] = bm[src:src+w]
+      x += width
+    return x
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+import struct
+import binascii
+
+# Binary framed protocol, an alternative to the text commands for hosts
+# sending many setpoints.  Entered with the "B" command at the prompt,
+# left with OP_EXIT.  This module is shared by the TraceR and the host
+# (see test-echo.py), both build and check frames with it.
+#
+# Every frame, in either direction:
+#   SYNC, length, payload (length bytes), crc32 of length and payload
+# Requests carry opcode, sequence number, arguments.
+# Replies carry opcode|REPLY, the same sequence number, status, data.
+#
+# Arguments and data, little endian:
+#   OP_SET_OHMS     <Bf   target, ohms         -> no data
+#   OP_SET_COUNTS   <BB   target, counts       -> no data
+#   OP_SET_RELAY    <BB   target, 0=open 1=shunt -> no data
+#   OP_GET_STATE    none                       -> STATE per resistor
+#   OP_SET_TEMP     <Bf   target, temperature C, on its sensor curve
+#                         -> no data, ST_UNVERIFIED if no curve selected
+#                         or the temperature is off it
+#   OP_BATCH        B     count, then count of [opcode, arguments]
+#                         all written to the digipots at once -> no data
+#   OP_EXIT         none                       -> no data, back to text
+# target is 1 or 2, or 0 for both, each then takes the same value.
+#
+# Waveforms, see wave.py, when the TraceR registers them:
+#   OP_WAVE_BEGIN   <BHHI target, capacity (steps in the ring, at most
+#                         MAX_CAPACITY), tick_us, length (steps, 0=endless)
+#                         -> no data, ST_BAD_ARGS if the ring does not fit
+#   OP_WAVE_DATA    <I    first step, then WAVE_STEP per step
+#                         -> no data, ST_FULL if the ring has no room yet
+#   OP_WAVE_PLAY    <BH   1=wait for a trigger, loops (0=forever) -> no data
+#   OP_WAVE_TRIGGER none                       -> no data
+#   OP_WAVE_STOP    none                       -> no data
+#   OP_WAVE_STATE   none                       -> WAVE_STATE
+#   OP_WAVE_SAVE    <B    slot, resident waveforms only
+#                         -> no data, ST_FULL if the flash has no room
+#   OP_WAVE_LOAD    <B    slot                 -> no data
+SYNC = 0xa5
+FRAME = '<BB'     # sync, payload length
+CRC = '<I'
+CRC_SIZE = struct.calcsize(CRC)
+REQUEST = '<BB'   # opcode, sequence number
+REPLY_HEAD = '<BBB' # opcode|REPLY, sequence number, status
+REPLY = 0x80
+STATE = '<BBff'   # counts, relay, ohms actual, ohms error (nan if unknown)
+WAVE_STEP = '<fH' # ohms, dwell in ticks
+WAVE_STATE = '<BIIIII' # state, position, steps loaded, loops played,
+                       # underruns, errors
+WAVE_STATES = ('idle', 'armed', 'playing', 'done')
+
+OP_SET_OHMS = 0x01
+OP_SET_COUNTS = 0x02
+OP_SET_RELAY = 0x03
+OP_GET_STATE = 0x04
+OP_BATCH = 0x05
+OP_SET_TEMP = 0x06
+OP_WAVE_BEGIN = 0x10
+OP_WAVE_DATA = 0x11
+OP_WAVE_PLAY = 0x12
+OP_WAVE_TRIGGER = 0x13
+OP_WAVE_STOP = 0x14
+OP_WAVE_STATE = 0x15
+OP_WAVE_SAVE = 0x16
+OP_WAVE_LOAD = 0x17
+OP_EXIT = 0x7f
+
+ARGS = { OP_SET_OHMS: '<Bf', OP_SET_COUNTS: '<BB', OP_SET_RELAY: '<BB',
+         OP_GET_STATE: '', OP_BATCH: '<B', OP_SET_TEMP: '<Bf', OP_EXIT: '',
+         OP_WAVE_BEGIN: '<BHHI', OP_WAVE_DATA: '<I', OP_WAVE_PLAY: '<BH',
+         OP_WAVE_TRIGGER: '', OP_WAVE_STOP: '', OP_WAVE_STATE: '',
+         OP_WAVE_SAVE: '<B', OP_WAVE_LOAD: '<B' }
+
+# most steps one OP_WAVE_DATA frame holds, its length is one byte
+WAVE_CHUNK = (255 - struct.calcsize(REQUEST) - struct.calcsize('<I')) \
+             // struct.calcsize(WAVE_STEP)
+
+# allowed values of the set opcodes
+LIMITS = { OP_SET_OHMS: (0, 300), OP_SET_COUNTS: (0, 255),
+           OP_SET_RELAY: (0, 1), OP_SET_TEMP: (-273, 1000) }
+
+ST_OK = 0
+ST_BAD_CRC = 1
+ST_BAD_OPCODE = 2
+ST_BAD_ARGS = 3
+ST_UNVERIFIED = 4 # digipot write failed its loopback check
+ST_FULL = 5       # waveform ring full, send again once it has played on,
+                  # or no room in flash to save it
+
+MAX_CAPACITY = 2048 # waveform ring steps, about 62 KB with four channels
+
+# bad arguments raise struct.error in CPython, ValueError in MicroPython
+try:
+  StructError = struct.error
+except AttributeError:
+  StructError = ValueError
+
+def frame(payload):
+  """Wraps payload in a frame."""
+  head = struct.pack(FRAME, SYNC, len(payload))
+  crc = binascii.crc32(head[1:] + payload) & 0xffffffff
+  return head + payload + struct.pack(CRC, crc)
+
+def check(length, body):
+  """Returns the payload of a frame, given its length byte and the
+  rest of it after that, or None if its crc does not match."""
+  payload = body[:length]
+  crc, = struct.unpack(CRC, body[length:length+CRC_SIZE])
+  if binascii.crc32(bytes([length]) + payload) & 0xffffffff != crc:
+    return None
+  return payload
+
+def request(opcode, seq, *args):
+  """Builds a request frame."""
+  return frame(struct.pack(REQUEST, opcode, seq & 0xff)
+               + struct.pack(ARGS[opcode], *args))
+
+def batch(seq, commands):
+  """Builds an OP_BATCH frame from a list of (opcode, args...)."""
+  payload = struct.pack(REQUEST, OP_BATCH, seq & 0xff)
+  payload += struct.pack(ARGS[OP_BATCH], len(commands))
+  for command in commands:
+    payload += bytes([command[0]]) + struct.pack(ARGS[command[0]],
+                                                 *command[1:])
+  return frame(payload)
+
+def wave_data(seq, first, steps):
+  """Builds an OP_WAVE_DATA frame from a list of (ohms, dwell)."""
+  payload = struct.pack(REQUEST, OP_WAVE_DATA, seq & 0xff)
+  payload += struct.pack(ARGS[OP_WAVE_DATA], first)
+  for ohms, dwell in steps:
+    payload += struct.pack(WAVE_STEP, ohms, dwell)
+  return frame(payload)
+
+def wave_steps(args):
+  """Unpacks OP_WAVE_DATA arguments into first and (ohms, dwell) list."""
+  head = struct.calcsize(ARGS[OP_WAVE_DATA])
+  size = struct.calcsize(WAVE_STEP)
+  if (len(args) - head) % size:
+    raise ValueError(len(args))
+  first, = struct.unpack(ARGS[OP_WAVE_DATA], args[:head])
+  return first, [ struct.unpack(WAVE_STEP, args[k:k+size])
+                  for k in range(head, len(args), size) ]
+
+def reply(payload):
+  """Splits a reply payload into opcode, seq, status and data."""
+  opcode, seq, status = struct.unpack(REPLY_HEAD, payload[:3])
+  return opcode & ~REPLY, seq, status, payload[3:]
+
+def states(data):
+  """Unpacks OP_GET_STATE data into a list of STATE tuples."""
+  size = struct.calcsize(STATE)
+  return [ struct.unpack(STATE, data[k:k+size])
+           for k in range(0, len(data), size) ]
+
+class Protocol:
+  # The TraceR end: handlers for the set opcodes only stage their
+  # values, as in commands.Parser, and commit() then sends them all,
+  # so a whole batch goes out in one SPI transaction.
+  def __init__(self, set_ohms, set_counts, set_relay, get_state,
+               commit=None, targets=(1, 2), set_temp=None):
+    # a setter of None leaves its opcode out, e.g. ohms if uncalibrated
+    setters = { OP_SET_OHMS: set_ohms, OP_SET_COUNTS: set_counts,
+                OP_SET_RELAY: set_relay, OP_SET_TEMP: set_temp }
+    self.setters = { op: f for op, f in setters.items() if f is not None }
+    self.get_state = get_state # returns [ STATE tuple per target ]
+    self.commit = commit       # returns True on errors
+    self.targets = targets
+    self.handlers = {}
+    self.running = False
+    self.nframes = 0
+    self.nerrors = 0
+
+  def register(self, opcode, handler):
+    """Serves opcode with handler(args), which returns (status, data),
+    and raises ValueError on bad arguments, e.g. the waveform opcodes."""
+    self.handlers[opcode] = handler
+
+  def validate(self, opcode, args):
+    """Unpacks and checks one set command's arguments,
+    returns (opcode, targets, value), raises ValueError if bad."""
+    if opcode not in self.setters:
+      raise ValueError(opcode)
+    target, value = struct.unpack(ARGS[opcode], args)
+    lo, hi = LIMITS[opcode]
+    if not lo <= value <= hi:
+      raise ValueError(value)
+    if target == 0:
+      return opcode, self.targets, value
+    if target in self.targets:
+      return opcode, (target,), value
+    raise ValueError(target)
+
+  def stage(self, commands):
+    """Stages validated set commands, then commits them together.
+    Returns the reply status."""
+    for opcode, targets, value in commands:
+      for t in targets:
+        self.setters[opcode](t, value)
+    if self.commit is not None and self.commit():
+      return ST_UNVERIFIED
+    return ST_OK
+
+  def execute(self, payload):
+    """Carries out one request payload, returns the reply payload."""
+    opcode, seq = struct.unpack(REQUEST, payload[:2])
+    args = payload[2:]
+    status = ST_OK
+    data = b''
+    try:
+      if opcode in self.setters:
+        status = self.stage([self.validate(opcode, args)])
+      elif opcode == OP_BATCH:
+        # check every command before staging any of them
+        commands = []
+        k = 1
+        for i in range(args[0]):
+          op = args[k]
+          if op not in self.setters:
+            raise ValueError(op)
+          size = struct.calcsize(ARGS[op])
+          commands.append(self.validate(op, args[k+1:k+1+size]))
+          k += 1 + size
+        if k != len(args):
+          raise ValueError(k)
+        status = self.stage(commands)
+      elif opcode == OP_GET_STATE:
+        for state in self.get_state():
+          data += struct.pack(STATE, *state)
+      elif opcode in self.handlers:
+        status, data = self.handlers[opcode](args)
+      elif opcode == OP_EXIT:
+        self.running = False
+      else:
+        status = ST_BAD_OPCODE
+    except (ValueError, IndexError, StructError):
+      status = ST_BAD_ARGS
+    if status != ST_OK:
+      self.nerrors += 1
+    self.nframes += 1
+    return struct.pack(REPLY_HEAD, opcode | REPLY, seq, status) + data
+
+  def receive(self, length, body):
+    """Checks and carries out one request frame, given its length
+    byte and the rest of it, returns the reply frame."""
+    payload = check(length, body)
+    if payload is None or length < 2:
+      self.nerrors += 1
+      return frame(struct.pack(REPLY_HEAD, REPLY, 0, ST_BAD_CRC))
+    return frame(self.execute(payload))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Table-driven parser for the serial command protocol, see help.txt.
+#
+# A line holds one or more commands separated by ';', each of the form
+#   <cmd>[r#][op][val]
+# Every command letter is registered with the handlers that carry it
+# out, so adding a command is one register() call.  A line is parsed
+# completely before anything is done, a bad command rejects the whole
+# line.  Set handlers only stage their values, commit() then applies
+# all of them at once, so R1=100;R2=50 is a single SPI transaction.
+# Leaving out the target addresses all of them: R=100,50 sets both
+# resistors, one comma separated value each, and R? shows both.
+
+def integer(lo, hi):
+  """Value parser for whole numbers from lo to hi."""
+  def parse(text):
+    if not text.isdigit():
+      raise ValueError(text)
+    val = int(text)
+    if val < lo or val > hi:
+      raise ValueError(text)
+    return val
+  return parse
+
+def decimal(lo, hi):
+  """Value parser for decimal numbers from lo to hi, digits and
+  at most one decimal point, after a minus sign if lo is negative."""
+  def parse(text):
+    digits = text.replace('.', '', 1)
+    if lo < 0 and digits[:1] == '-':
+      digits = digits[1:]
+    if not digits.isdigit():
+      raise ValueError(text)
+    val = float(text)
+    if val < lo or val > hi:
+      raise ValueError(text)
+    return val
+  return parse
+
+class Command:
+  def __init__(self, name, show, set=None, value=None, targets=''):
+    self.name = name
+    self.show = show       # show(target), returns a list of reply lines
+    self.set = set         # set(target, value), stages the new value
+    self.value = value     # value(text), parses and checks a set value
+    self.targets = targets # allowed target digits, '' for none
+
+class Parser:
+  def __init__(self, commit=None):
+    self.registry = {}
+    self.commit = commit # applies staged values, returns True on errors
+    self.nlines = 0
+    self.ncommands = 0
+    self.nerrors = 0
+
+  def register(self, name, show, set=None, value=None, targets=''):
+    """Adds command name, a single letter, '' is the empty line."""
+    self.registry[name] = Command(name, show, set, value, targets)
+
+  def parse_command(self, text):
+    """Returns (command, target, op, value) for one command,
+    raises ValueError if it is not a valid one."""
+    command = self.registry.get(text[:1])
+    if command is None:
+      raise ValueError(text)
+    rest = text[1:]
+    target = None
+    if rest[:1] and rest[0] in command.targets:
+      target = rest[0]
+      rest = rest[1:]
+    elif command.targets and rest[:1] not in ('', '=', '?'):
+      raise ValueError(text)
+    if rest[:1] == '=':
+      if command.set is None:
+        raise ValueError(text)
+      if target is not None or not command.targets:
+        return command, target, '=', command.value(rest[1:])
+      values = rest[1:].split(',')
+      if len(values) != len(command.targets):
+        raise ValueError(text)
+      return command, target, '=', [command.value(v) for v in values]
+    if rest in ('', '?'):
+      return command, target, '?', None
+    raise ValueError(text)
+
+  def parse(self, line):
+    """Splits line into its commands, see parse_command()."""
+    texts = [text.strip() for text in line.upper().split(';')]
+    if len(texts) > 1:
+      texts = [text for text in texts if text]
+    return [self.parse_command(text) for text in texts]
+
+  def targets(self, command, target, value):
+    """(target, value) pairs a command applies to, all of its
+    targets, each with its own value, if none was given."""
+    if target is not None or not command.targets:
+      return [(target, value)]
+    if value is None:
+      value = [None] * len(command.targets)
+    return list(zip(command.targets, value))
+
+  def execute(self, line):
+    """Parses and carries out one line.
+    Returns errs, True if commit() reported a failure,
+    and replies, the reply lines of every command in order.
+    Raises ValueError, having done nothing, if any command is bad."""
+    self.nlines += 1
+    try:
+      commands = self.parse(line)
+    except ValueError:
+      self.nerrors += 1
+      raise
+    staged = False
+    for command, target, op, value in commands:
+      if op == '=':
+        for t, v in self.targets(command, target, value):
+          command.set(t, v)
+        staged = True
+    errs = False
+    if staged and self.commit is not None:
+      errs = self.commit()
+    replies = []
+    for command, target, op, value in commands:
+      for t, v in self.targets(command, target, value):
+        replies += command.show(t)
+    self.ncommands += len(commands)
+    return errs, replies
@@ -0,0 +1,161 @@
+import sys
+import uasyncio
+import uselect
+
+# Console input and output, for main.py's console
+#
+# Input drains everything waiting on the USB serial port into a ring
+# buffer each time it polls, rather than reading and handling one
+# character per pass of the console loop, and frames lines on the
+# ring.  Once the ring is full, reading stops and the host waits, USB
+# flow control, unless the ring holds no complete line: that line is
+# too long for it and is dropped up to its end, counted in noverruns,
+# and readline() returns OVERRUN for it, which no command parses.
+#
+# print() on the USB serial port pushes each call out as USB packets of
+# its own, so echoing every typed character and printing every reply
+# line separately costs several packets per command.  Output instead
+# collects the text in one preallocated buffer, cooked as print() does
+# it ("\n" goes out as "\r\n"), and writes it raw with a single call
+# when flush() is called, once the console has no more input to handle,
+# or when the buffer fills.
+#
+# echo says whether typed characters are echoed back, the E command
+# turns it off for host programs, which have no use for it.
+
+OVERRUN = '\x00' # the line that did not fit in the ring, see Input
+
+class Input:
+  def __init__(self, size=1024, stream=None, out=None):
+    self.stream = stream if stream is not None else sys.stdin.buffer
+    self.reader = uasyncio.StreamReader(self.stream)
+    self.poller = uselect.poll()
+    self.poller.register(self.stream, uselect.POLLIN)
+    self.ring = bytearray(size)
+    self.one = bytearray(1)
+    self.head = 0       # first byte not taken yet
+    self.count = 0      # bytes in the ring
+    self.scanned = 0    # of them, known to hold no newline
+    self.echoed = 0     # of them, echoed to out
+    self.skipping = False # dropping the rest of an overlong line
+    self.out = out      # Output to echo lines to, if out.echo
+    self.nbytes = 0
+    self.nlines = 0
+    self.noverruns = 0
+
+  def drain(self):
+    """Moves the input waiting on the stream into the ring, as much
+    as fits, returns the number of bytes moved."""
+    ring, one = self.ring, self.one
+    size = len(ring)
+    n = 0
+    while self.count < size and self.poller.poll(0):
+      self.stream.readinto(one)
+      ring[(self.head + self.count) % size] = one[0]
+      self.count += 1
+      n += 1
+    self.nbytes += n
+    return n
+
+  async def fill(self):
+    """Waits for input, unless some is waiting, then drains it."""
+    if self.count < len(self.ring) and not self.poller.poll(0):
+      byte = await self.reader.read(1)
+      self.ring[(self.head + self.count) % len(self.ring)] = byte[0]
+      self.count += 1
+      self.nbytes += 1
+    self.drain()
+
+  def raw(self, i, j):
+    """Bytes i to j of the ring, counted from head."""
+    size = len(self.ring)
+    first = (self.head + i) % size
+    last = first + j - i
+    if last <= size:
+      return bytes(self.ring[first:last])
+    return bytes(self.ring[first:]) + bytes(self.ring[:last - size])
+
+  def text(self, i, j):
+    """Bytes i to j as console text: printable, upper case."""
+    data = self.raw(i, j)
+    if data and (min(data) < 0x20 or max(data) > 0x7e):
+      data = bytes(c for c in data if 0x20 <= c < 0x7f)
+    return data.decode().upper()
+
+  def discard(self, n):
+    self.head = (self.head + n) % len(self.ring)
+    self.count -= n
+    self.scanned = max(0, self.scanned - n)
+    self.echoed = max(0, self.echoed - n)
+
+  def readline(self):
+    """Takes the next complete line out of the ring, as text without
+    its newline, None if there is none yet.  Echoes what it has not
+    echoed yet of the line, or of the partial line there is."""
+    ring = self.ring
+    size = len(ring)
+    i = self.scanned
+    while i < self.count and ring[(self.head + i) % size] != 0x0a:
+      i += 1
+    self.scanned = i
+    if self.skipping:
+      if i == self.count:
+        self.discard(i)
+        return None
+      self.discard(i + 1)
+      self.skipping = False
+      return OVERRUN
+    out = self.out
+    if out is not None and out.echo and self.echoed < i:
+      out.write(self.text(self.echoed, i))
+      self.echoed = i
+    if i == self.count:
+      if i == size: # no room left for the end of the line
+        self.noverruns += 1
+        self.skipping = True
+        self.discard(i)
+      return None
+    line = self.text(0, i)
+    self.discard(i + 1)
+    self.nlines += 1
+    return line
+
+  async def readexactly(self, n):
+    """n bytes as they came, for the binary protocol, at most the
+    size of the ring."""
+    while self.count < n:
+      await self.fill()
+    data = self.raw(0, n)
+    self.discard(n)
+    return data
+
+class Output:
+  def __init__(self, size=512, stream=None):
+    self.buf = bytearray(size)
+    self.mv = memoryview(self.buf)
+    self.n = 0
+    self.stream = stream if stream is not None else sys.stdout.buffer
+    self.echo = True
+    self.nwrites = 0 # stream writes, for profiling
+
+  def write(self, text):
+    data = text.encode()
+    if b'\n' in data:
+      data = data.replace(b'\n', b'\r\n')
+    n = len(data)
+    if self.n + n > len(self.buf):
+      self.flush()
+      if n > len(self.buf):
+        self.send(data)
+        return
+    self.mv[self.n:self.n+n] = data
+    self.n += n
+
+  def flush(self):
+    if self.n:
+      self.send(self.mv[:self.n])
+      self.n = 0
+
+  def send(self, data):
+    self.stream.write(data)
+    self.nwrites += 1
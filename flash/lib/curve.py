@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import struct
+import binascii
+from inverse import Registers
+
+# Sensor curves: temperature to register tables, for emulating
+# thermistors and RTDs with the T command.
+#
+# host/curvegen.py builds a table for one resistor from its calibration,
+# on a dense temperature grid, so setting a temperature is one offset
+# calculation and one Digichain.send(), with no curve maths on the
+# TraceR.  The file is HEADER followed by npts fixed-width records of
+# RECORD, and loads with a single readinto(), like the .bin
+# calibration tables of inverse.py.  Record k is for tbeg + k*tstep.
+MAGIC = b'TRCT'
+VERSION = 1
+HEADER = '<4sBBH8s4s12sfffI' # magic, version, reclen, npts, serno, resno,
+                             # curve name, tbeg, tend, tstep,
+                             # crc32 of the records
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD = '<BBBBHH'           # regs[0-3], rnom and ract in centiohms
+RECORD_SIZE = struct.calcsize(RECORD)
+CENTI = 100.0
+
+class Curve:
+  def __init__(self, fname=None):
+    self.initialized = False
+    self.serno = None
+    self.resno = None
+    self.name = None
+    self.tbeg = None
+    self.tend = None
+    self.tstep = None
+    self.npts = None
+    self.recs = bytearray()
+    if fname is not None:
+      self.load(fname)
+
+  def allocate(self, npts):
+    """Preallocates npts zeroed records."""
+    self.npts = npts
+    self.recs = bytearray(RECORD_SIZE*npts)
+
+  def load(self, fname):
+    """Loads a table written by host/curvegen.py."""
+    self.initialized = False
+    try:
+      with open(fname, 'rb') as fin:
+        crc = self.parse_header(fin.read(HEADER_SIZE))
+        if crc is None:
+          return
+        self.allocate(self.npts)
+        nread = fin.readinto(self.recs)
+        self.initialized = nread == len(self.recs) and \
+                           binascii.crc32(self.recs) & 0xffffffff == crc
+    except OSError as error:
+      self.initialized = False
+
+  def parse_header(self, header):
+    """Sets the table description from a header.
+
+    Returns the records CRC, or None if the header is not usable."""
+    if len(header) != HEADER_SIZE:
+      return None
+    magic, version, reclen, npts, serno, resno, name, tbeg, tend, tstep, \
+        crc = struct.unpack(HEADER, header)
+    if magic != MAGIC or version != VERSION or reclen != RECORD_SIZE:
+      return None
+    self.serno = str(serno.rstrip(b'\x00'), 'ascii')
+    self.resno = str(resno.rstrip(b'\x00'), 'ascii')
+    self.name = str(name.rstrip(b'\x00'), 'ascii')
+    self.tbeg = tbeg
+    self.tend = tend
+    self.tstep = tstep
+    self.npts = npts
+    return crc
+
+  def header(self, crc=0):
+    """Returns the file header describing this table."""
+    return struct.pack(HEADER, MAGIC, VERSION, RECORD_SIZE, self.npts,
+                       self.serno.encode(), self.resno.encode(),
+                       self.name.encode(), self.tbeg, self.tend,
+                       self.tstep, crc)
+
+  def set_row(self, k, regs):
+    """Stores Registers regs as record k."""
+    struct.pack_into(RECORD, self.recs, RECORD_SIZE*k,
+                     regs.regs[0], regs.regs[1], regs.regs[2], regs.regs[3],
+                     int(regs.rnom*CENTI + 0.5), int(regs.ract*CENTI + 0.5))
+
+  def slot(self, temp):
+    """Grid slot nearest to temp, clamped to the table."""
+    k = int((temp - self.tbeg) / self.tstep + 0.5)
+    if k < 0:
+      return 0
+    if k >= self.npts:
+      return self.npts - 1
+    return k
+
+  def covers(self, temp):
+    """True if temp is on the table, or within half a step of it."""
+    k = (temp - self.tbeg) / self.tstep + 0.5
+    return 0 <= k < self.npts
+
+  def row(self, k):
+    """Returns a Registers view of one record."""
+    r0, r1, r2, r3, rnom, ract = \
+        struct.unpack_from(RECORD, self.recs, RECORD_SIZE*k)
+    rnom /= CENTI
+    ract /= CENTI
+    return Registers(rnom, ract, rnom - ract, [ r0, r1, r2, r3 ])
+
+  def lookup(self, temp):
+    """Registers for the temperature nearest to temp in the table."""
+    return self.row(self.slot(temp))
+
+  def temperature(self, temp):
+    """The table temperature lookup(temp) is for."""
+    return self.tbeg + self.slot(temp) * self.tstep
@@ -1,6 +1,39 @@
 #!/usr/bin/env python
 
 import sys
+import struct
+import binascii
+from array import array
+try:
+  from utime import ticks_us, ticks_diff
+except ImportError:
+  # running on the host, not the Tiny 2040
+  from time import perf_counter_ns
+  def ticks_us():
+    return perf_counter_ns() // 1000
+  def ticks_diff(t1, t0):
+    return t1 - t0
+
+# Calibration tables can be loaded from either of two formats:
+#
+# Text (.dat), tab separated, as produced by the calibration bench:
+#   five header lines (serial number, resistor number, rbeg, rend, nres)
+#   then one row per nominal resistance:
+#     Rnominal, Registers[1-4], Ractual, Rerror
+#
+# Binary (.bin), as produced by host/calcompile.py:
+#   HEADER, followed by nres fixed-width records of RECORD
+#   Records sit on a dense grid, record k is for rnom = rbeg + k*rstep,
+#   so a lookup is pure offset arithmetic.  Grid points with no
+#   calibration data have rnom set to NOCAL.
+MAGIC = b'TRCB'
+VERSION = 1
+HEADER = '<4sBBH8s4sfffI' # magic, version, reclen, nres, serno, resno,
+                          # rbeg, rend, rstep, crc32 of the records
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD = '<fffBBBB'       # rnom, ract, rerr, regs[0-3]
+RECORD_SIZE = struct.calcsize(RECORD)
+NOCAL = -1.0
 
 class Registers:
   def __init__( self, rnom, ract, rerr, regs ):
@@ -24,49 +57,118 @@ class Registers:
                rerr=self.rerr )
 
 class Inverse:
-  def __init__(self, fname=None):
+  # The table is kept in RAM exactly as it is laid out in the binary
+  # file: one packed bytearray of fixed-width records on a dense grid
+  # from rbeg to rend.  The text loader packs rows into the same grid.
+  # lookup() is then a single offset calculation, and builds a
+  # Registers view of just the record that was asked for.
+  def __init__(self, fname=None, rstep=1.0):
     self.initialized = False
-    self.regs=[]
     self.serno = None
     self.resno = None
     self.rbeg = None
     self.rend = None
+    self.rstep = rstep # grid step of text tables, binary ones carry it
     self.nres = None
+    self.recs = bytearray()
     if fname is not None:
       self.load(fname)
 
+  def allocate(self, nres):
+    """Preallocates nres records, all marked as uncalibrated."""
+    self.nres = nres
+    self.recs = bytearray(RECORD_SIZE*nres)
+    for k in range(nres):
+      struct.pack_into(RECORD, self.recs, RECORD_SIZE*k,
+                       NOCAL, 0.0, 0.0, 0, 0, 0, 0)
+
   def load(self, fname):
+    """Loads a binary table if fname has the binary header, else text."""
     try:
-      with open(fname, 'r') as fin:
-        npoints=0
-        for line in fin:
-          row = line.strip().split('\t')
-          #print(type(row), len(row), row)
-          if row[0][0] == '#': continue
-          if self.serno is None:
-            self.serno = row[0]
-          elif self.resno is None:
-            self.resno = row[0]
-          elif self.rbeg is None:
-            self.rbeg = float(row[0])
-          elif self.rend is None:
-            self.rend = float(row[0])
-          elif self.nres is None:
-            self.nres = int(row[0])
-          else:
-            rnom = float(row[0])
-            regs=[]
-            regs.append( int(row[1]) )
-            regs.append( int(row[2]) )
-            regs.append( int(row[3]) )
-            regs.append( int(row[4]) )
-            ract = float(row[5])
-            rerr = float(row[6])
-            self.regs.append(Registers(rnom, ract, rerr, regs))
-      self.initialized = True
+      with open(fname, 'rb') as fin:
+        header = fin.read(HEADER_SIZE)
+        if len(header) == HEADER_SIZE and header[:4] == MAGIC:
+          self.load_bin(fin, header)
+          return
+      self.load_text(fname)
     except OSError as error:
       self.initialized = False
 
+  def parse_header(self, header):
+    """Sets the table description from a binary header.
+
+    Returns the records CRC, or None if the header is not usable."""
+    magic, version, reclen, nres, serno, resno, rbeg, rend, rstep, crc = \
+        struct.unpack(HEADER, header)
+    if magic != MAGIC or version != VERSION or reclen != RECORD_SIZE:
+      return None
+    self.serno = str(serno.rstrip(b'\x00'), 'ascii')
+    self.resno = str(resno.rstrip(b'\x00'), 'ascii')
+    self.rbeg = rbeg
+    self.rend = rend
+    self.rstep = rstep
+    self.nres = nres
+    return crc
+
+  def load_bin(self, fin, header):
+    crc = self.parse_header(header)
+    if crc is None:
+      self.initialized = False
+      return
+    self.recs = bytearray(RECORD_SIZE*self.nres)
+    nread = fin.readinto(self.recs)
+    self.initialized = nread == len(self.recs) and \
+                       binascii.crc32(self.recs) & 0xffffffff == crc
+
+  def load_text(self, fname):
+    with open(fname, 'r') as fin:
+      for line in fin:
+        row = line.strip().split('\t')
+        #print(type(row), len(row), row)
+        if row[0][0] == '#': continue
+        if self.serno is None:
+          self.serno = row[0]
+        elif self.resno is None:
+          self.resno = row[0]
+        elif self.rbeg is None:
+          self.rbeg = float(row[0])
+        elif self.rend is None:
+          self.rend = float(row[0])
+        elif self.nres is None:
+          # nres counts the rows in the file, the grid
+          # only needs to span rbeg to rend
+          self.allocate(self.slot(self.rend) + 1)
+        else:
+          # rows that fall off the grid (such as the 0 ohm row)
+          # can never be returned by lookup(), so are not stored
+          k = self.slot(float(row[0]))
+          if k < 0 or k >= self.nres or not self.is_empty(k): continue
+          struct.pack_into(RECORD, self.recs, RECORD_SIZE*k,
+                           float(row[0]), float(row[5]), float(row[6]),
+                           int(row[1]), int(row[2]), int(row[3]), int(row[4]))
+    self.initialized = True
+
+  def header(self, crc=0):
+    """Returns the binary file header describing this table."""
+    return struct.pack(HEADER, MAGIC, VERSION, RECORD_SIZE, self.nres,
+                       self.serno.encode(), self.resno.encode(),
+                       self.rbeg, self.rend, self.rstep, crc)
+
+  def slot(self, rnom):
+    """Grid slot nearest to rnom, may be out of range."""
+    return int((rnom - self.rbeg) / self.rstep + 0.5)
+
+  def is_empty(self, k):
+    return struct.unpack_from('<f', self.recs, RECORD_SIZE*k)[0] == NOCAL
+
+  def row(self, k):
+    """Returns a Registers view of one record, None if uncalibrated."""
+    rnom, ract, rerr, r0, r1, r2, r3 = \
+        struct.unpack_from(RECORD, self.recs, RECORD_SIZE*k)
+    if rnom == NOCAL:
+      return None
+    return Registers(rnom, ract, rerr, [ r0, r1, r2, r3 ])
+
   def print_header( self ):
     print('{serno}\t# serial number'.format(serno=self.serno))
     print('{resno}\t# resistor number'.format(resno=self.resno))
@@ -76,25 +178,181 @@ class Inverse:
 
   def print_regs( self ):
     print('# Rnominal, Registers[1-4], Ractual, Rerror')
-    for reg in self.regs:
-      print(reg, file=fp)
+    for k in range(self.nres):
+      regs = self.row(k)
+      if regs is not None:
+        print(regs)
 
   def print_all( self ):
-    self.print_header(fp)
-    self.print_regs(fp)
+    self.print_header()
+    self.print_regs()
 
   def lookup( self, rnom ):
-    irnom = int(rnom+0.5)
-    if irnom < int(self.rbeg):
-      return self.regs[1]
-    if irnom > int(self.rend):
-      return self.regs[-1]
-    match = False
-    for regs in self.regs:
-      if irnom == int(regs.rnom):
-        match = True
-        break
-    if match:
-      return regs
+    k = self.slot(rnom)
+    if k < 0:
+      k = 0
+    if k >= self.nres:
+      k = self.nres - 1
+    return self.row(k)
+
+class LazyInverse(Inverse):
+  # Binary tables only.  Instead of loading all records, the table
+  # file is kept open and lookup() seeks to and reads the one record
+  # it needs, with a small LRU cache of recently used rows in front.
+  # Heap use depends on the cache size, not on the table size, so
+  # dense tables (say 0.1 ohm steps) cost no more RAM than coarse ones.
+  def __init__(self, fname=None, ncache=8):
+    self.fin = None
+    self.rec = bytearray(RECORD_SIZE)
+    self.ncache = ncache
+    self.cache = {}  # slot --> Registers, or None if uncalibrated
+    self.lru = []    # cached slots, least recently used first
+    self.hits = 0
+    self.reads = 0
+    super().__init__(fname)
+
+  def load(self, fname):
+    """Opens a binary table and verifies it, without loading records."""
+    self.close()
+    self.initialized = False
+    try:
+      self.fin = open(fname, 'rb')
+      crc = self.parse_header(self.fin.read(HEADER_SIZE))
+      if crc is None:
+        self.close()
+        return
+      # CRC the records in record sized pieces, to keep heap flat
+      check = 0
+      for k in range(self.nres):
+        if self.fin.readinto(self.rec) != RECORD_SIZE:
+          self.close()
+          return
+        check = binascii.crc32(self.rec, check)
+      self.initialized = check & 0xffffffff == crc
+    except OSError as error:
+      self.close()
+
+  def close(self):
+    if self.fin is not None:
+      self.fin.close()
+      self.fin = None
+    self.cache = {}
+    self.lru = []
+
+  def row(self, k):
+    """Returns a Registers view of one record, None if uncalibrated."""
+    if k in self.cache:
+      self.hits += 1
+      self.lru.remove(k)
+      self.lru.append(k)
+      return self.cache[k]
+    self.reads += 1
+    self.fin.seek(HEADER_SIZE + RECORD_SIZE*k)
+    self.fin.readinto(self.rec)
+    rnom, ract, rerr, r0, r1, r2, r3 = struct.unpack(RECORD, self.rec)
+    if rnom == NOCAL:
+      regs = None
     else:
-      return None
+      regs = Registers(rnom, ract, rerr, [ r0, r1, r2, r3 ])
+    if len(self.lru) >= self.ncache:
+      del self.cache[self.lru.pop(0)]
+    self.cache[k] = regs
+    self.lru.append(k)
+    return regs
+
+class Solver:
+  # Finds the wiper counts whose parallel combination comes closest
+  # to any resistance, not only the whole ohms in the calibration table.
+  # Works in conductance, with a 256 entry table of 1/R(counts) for
+  # each channel, from the Digipot Rtotal/Rwiper model or measured
+  # curves.  The channels are chosen greedily, each aiming at an equal
+  # share of the conductance still needed, then the last two channels
+  # are refined by a local search until the time budget runs out.
+  # When a calibration table is given, the model is scaled to match
+  # the calibrated resistance of the nearest table row.
+  NCOUNTS = 256
+  RMIN = 0.001  # keeps conductances finite for a zero ohm wiper
+  SPAN = 8      # counts either side searched by the refinement
+
+  def __init__(self, rtotal=1000, rwiper=50, nchans=4, cal=None,
+               budget_us=1000):
+    self.nchans = nchans
+    self.cal = cal
+    self.budget_us = budget_us
+    self.g = [ self.model(rtotal, rwiper) for chan in range(nchans) ]
+
+  def model(self, rtotal, rwiper):
+    """Conductance vs counts, Rwb as calculated by Digipot.ohms()."""
+    g = array('f', bytearray(4*self.NCOUNTS))
+    for c in range(self.NCOUNTS):
+      g[c] = 1.0 / max(rwiper + rtotal * c / 256.0, self.RMIN)
+    return g
+
+  def set_curve(self, chan, ohms):
+    """Replaces a channel's model by measured ohms vs counts."""
+    for c in range(self.NCOUNTS):
+      self.g[chan][c] = 1.0 / max(ohms[c], self.RMIN)
+
+  def nearest(self, g, want):
+    """Counts whose conductance is closest to want, g is decreasing."""
+    lo = 0
+    hi = self.NCOUNTS - 1
+    while hi - lo > 1:
+      mid = (lo + hi) >> 1
+      if g[mid] > want: lo = mid
+      else: hi = mid
+    if g[lo] - want <= want - g[hi]: return lo
+    return hi
+
+  def rpar(self, regs):
+    """Modelled resistance of the channels in parallel."""
+    gsum = 0.0
+    for chan in range(self.nchans):
+      gsum += self.g[chan][regs[chan]]
+    return 1.0 / gsum
+
+  def solve(self, rnom):
+    """Returns Registers with the best counts for rnom ohms."""
+    t0 = ticks_us()
+    scale = 1.0
+    if self.cal is not None:
+      regs = self.cal.lookup(rnom)
+      if regs is not None:
+        scale = regs.ract / self.rpar(regs.regs)
+    n = self.nchans
+    gwant = scale / max(rnom, self.RMIN)
+    counts = [0] * n
+    grem = gwant
+    for chan in range(n-1):
+      c = self.nearest(self.g[chan], grem / (n - chan))
+      counts[chan] = c
+      grem -= self.g[chan][c]
+    counts[n-1] = self.nearest(self.g[n-1], grem)
+    best = counts[:]
+    gbest = gwant - grem + self.g[n-1][counts[n-1]]
+    # local search: step the next to last channel outwards,
+    # re-solving the last one exactly for each step
+    gbase = gwant - grem - self.g[n-2][counts[n-2]]
+    gp = self.g[n-2]
+    gl = self.g[n-1]
+    for d in range(1, self.SPAN+1):
+      if ticks_diff(ticks_us(), t0) > self.budget_us: break
+      for c in (counts[n-2] - d, counts[n-2] + d):
+        if c < 0 or c >= self.NCOUNTS: continue
+        g = gbase + gp[c]
+        cl = self.nearest(gl, gwant - g)
+        g += gl[cl]
+        if abs(1.0/g - 1.0/gwant) < abs(1.0/gbest - 1.0/gwant):
+          gbest = g
+          best[n-2] = c
+          best[n-1] = cl
+    ract = scale / gbest
+    return Registers(rnom, ract, rnom - ract, best)
+
+  def lookup(self, rnom):
+    """Calibrated row for whole ohms when available, else solve()."""
+    if self.cal is not None and rnom == int(rnom):
+      regs = self.cal.lookup(rnom)
+      if regs is not None and regs.rnom == rnom:
+        return regs
+    return self.solve(rnom)
@@ -32,6 +32,13 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        # shadow holds what the display RAM has been sent, so show()
+        # only needs to send the window of bytes that has changed
+        self.shadow = bytearray(self.pages * self.width)
+        self.full = True  # next show() sends everything
+        self.frames = 0  # show() calls that sent data
+        self.bytes_last = 0  # bytes sent by the last show()
+        self.bytes_total = 0
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
@@ -85,20 +92,72 @@ class SSD1306(framebuf.FrameBuffer):
     def invert(self, invert):
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
-    def show(self):
-        x0 = 0
-        x1 = self.width - 1
+    def dirty_window(self):
+        """Returns (p0, p1, c0, c1), the smallest window of pages and
+        columns holding every byte that differs from the shadow copy,
+        or None if nothing has changed."""
+        if self.full:
+            return 0, self.pages - 1, 0, self.width - 1
+        buf = self.buffer
+        shadow = self.shadow
+        if buf == shadow:
+            return None
+        w = self.width
+        p0 = p1 = None
+        c0 = w
+        c1 = -1
+        for page in range(self.pages):
+            beg = page * w
+            end = beg + w
+            if buf[beg:end] == shadow[beg:end]:
+                continue
+            if p0 is None:
+                p0 = page
+            p1 = page
+            i = beg
+            while buf[i] == shadow[i]:
+                i += 1
+            j = end - 1
+            while buf[j] == shadow[j]:
+                j -= 1
+            c0 = min(c0, i - beg)
+            c1 = max(c1, j - beg)
+        return p0, p1, c0, c1
+
+    def show(self, full=False):
+        """Sends the changed window of the framebuffer to the display,
+        or all of it if full is set."""
+        self.full |= full
+        window = self.dirty_window()
+        if window is None:
+            self.bytes_last = 0
+            return
+        p0, p1, c0, c1 = window
+        x0 = c0
+        x1 = c1
         if self.width == 64:
             # displays with width of 64 pixels are shifted by 32
             x0 += 32
             x1 += 32
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        cmds = (SET_COL_ADDR, x0, x1, SET_PAGE_ADDR, p0, p1)
+        mv = memoryview(self.buffer)
+        w = self.width
+        chunks = [mv[p * w + c0 : p * w + c1 + 1] for p in range(p0, p1 + 1)]
+        self.bytes_last = self.write_window(cmds, chunks)
+        self.bytes_total += self.bytes_last
+        self.frames += 1
+        self.shadow[:] = self.buffer
+        self.full = False
+
+    def write_window(self, cmds, chunks):
+        """Sends window commands then data, returns bytes sent."""
+        for cmd in cmds:
+            self.write_cmd(cmd)
+        nbytes = 2 * len(cmds)
+        for chunk in chunks:
+            self.write_data(chunk)
+            nbytes += len(chunk) + 1
+        return nbytes
 
 
 class SSD1306_I2C(SSD1306):
@@ -107,6 +166,7 @@ class SSD1306_I2C(SSD1306):
         self.addr = addr
         self.temp = bytearray(2)
         self.write_list = [b"\x40", None]  # Co=0, D/C#=1
+        self.window_cmds = bytearray(13)  # six commands, data control byte
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
@@ -118,6 +178,21 @@ class SSD1306_I2C(SSD1306):
         self.write_list[1] = buf
         self.i2c.writevto(self.addr, self.write_list)
 
+    def write_window(self, cmds, chunks):
+        # one I2C transaction: each command byte is preceded by a
+        # control byte with Co=1, then a final data control byte and
+        # the data, straight from the framebuffer
+        wcmds = self.window_cmds
+        for i in range(len(cmds)):
+            wcmds[2 * i] = 0x80  # Co=1, D/C#=0
+            wcmds[2 * i + 1] = cmds[i]
+        wcmds[-1] = 0x40  # Co=0, D/C#=1
+        self.i2c.writevto(self.addr, [wcmds] + chunks)
+        nbytes = len(wcmds)
+        for chunk in chunks:
+            nbytes += len(chunk)
+        return nbytes
+
 
 class SSD1306_SPI(SSD1306):
     def __init__(self, width, height, spi, dc, res, cs, external_vcc=False):
@@ -153,3 +228,17 @@ class SSD1306_SPI(SSD1306):
         self.cs(0)
         self.spi.write(buf)
         self.cs(1)
+
+    def write_window(self, cmds, chunks):
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs(1)
+        self.dc(0)
+        self.cs(0)
+        self.spi.write(bytearray(cmds))
+        self.dc(1)
+        nbytes = len(cmds)
+        for chunk in chunks:
+            self.spi.write(chunk)
+            nbytes += len(chunk)
+        self.cs(1)
+        return nbytes
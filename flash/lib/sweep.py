@@ -0,0 +1,228 @@
+import gc
+gc.collect()
+from array import array
+gc.collect()
+from machine import Timer
+gc.collect()
+import utime
+gc.collect()
+from inverse import Registers
+gc.collect()
+
+# Timer-driven resistance sweeps, the S command, e.g. S1=13,275,1,5ms
+#
+# prepare() looks up the registers of every step and builds all the
+# chain frames ahead of time, in one preallocated buffer, together with
+# the memoryviews of each frame.  A machine.Timer callback then only
+# shifts out the frames of the next step, so the steps go out at the
+# timer's cadence rather than at the pace of USB and the host.
+#
+# Frames are checked after the sweep, as Digichain.send() does when
+# pipelined: each frame shifts the one before it back out into its
+# readback slot.  The time of every step is kept for jitter statistics.
+
+MAX_STEPS = 1024
+
+def spec(text):
+  """Value parser for sweeps: begin,end,step,period, ohms,
+  and the period in ms, or us with that suffix, e.g. 13,275,1,5ms"""
+  fields = text.split(',')
+  if len(fields) != 4:
+    raise ValueError(text)
+  period = fields[3]
+  scale = 1000
+  if period.endswith('US'):
+    period, scale = period[:-2], 1
+  elif period.endswith('MS'):
+    period = period[:-2]
+  rbeg, rend, rstep = [ float(f) for f in fields[:3] ]
+  period_us = int(float(period) * scale)
+  if rstep <= 0 or period_us < 100:
+    raise ValueError(text)
+  if min(rbeg, rend) < 0 or max(rbeg, rend) > 300:
+    raise ValueError(text)
+  if int(abs(rend - rbeg) / rstep + 1.5) > MAX_STEPS:
+    raise ValueError(text)
+  return rbeg, rend, rstep, period_us
+
+class Sweep:
+  def __init__(self, chain):
+    self.chain = chain
+    self.timer = Timer()
+    self.running = False
+    self.pending = False  # prepared, waiting for start()
+    self.finished = True  # finish() has accounted for the last sweep
+    self.pot = None
+    self.nsteps = 0
+    self.step = 0
+    self.period_us = 0
+    self.nerrors = 0
+
+  def prepare(self, pot, cal, rbeg, rend, rstep, period_us):
+    """Builds the frames of a sweep of pot from rbeg to rend ohms."""
+    self.stop()
+    if rend < rbeg:
+      rstep = -rstep
+    nsteps = int((rend - rbeg) / rstep + 1.5)
+    chain = self.chain
+    ipot = chain.digipots.index(pot)
+    nchans = pot.nchans
+    shift = 10 * (len(chain.digipots) - 1 - ipot)
+    # the settings of each step, to leave the pot on when stopped
+    self.rnom = array('f', [0.0] * nsteps)
+    self.ract = array('f', [0.0] * nsteps)
+    self.counts = bytearray(nchans * nsteps)
+    cmds = list(pot.cmds)
+    words = []
+    starts = array('H', [0])
+    for k in range(nsteps):
+      regs = cal.lookup(rbeg + k*rstep)
+      self.rnom[k] = regs.rnom
+      self.ract[k] = regs.ract
+      self.counts[k*nchans:(k+1)*nchans] = bytes(regs.regs)
+      for c in range(nchans):
+        cmd = (c << 8) + (regs.regs[c] & 0xff)
+        if cmd == cmds[c] and k > 0:
+          continue
+        cmds[c] = cmd
+        words.append(cmd << shift) # the other pots go in at start()
+      starts.append(len(words))
+    # one buffer for every frame, one for what each frame shifts out
+    nbytes = chain.nbytes
+    self.frames = bytearray(nbytes * len(words))
+    self.readback = bytearray(nbytes * len(words))
+    for f, word in enumerate(words):
+      self.frames[f*nbytes:(f+1)*nbytes] = word.to_bytes(nbytes, 'big')
+    words = None
+    gc.collect()
+    tx = memoryview(self.frames)
+    rx = memoryview(self.readback)
+    self.tx = [ tx[f*nbytes:(f+1)*nbytes] for f in range(starts[-1]) ]
+    self.rx = [ rx[f*nbytes:(f+1)*nbytes] for f in range(starts[-1]) ]
+    self.starts = starts
+    self.times = array('l', [0] * nsteps)
+    self.pot = pot
+    self.shift = shift
+    self.nsteps = nsteps
+    self.step = 0
+    self.period_us = period_us
+    self.nerrors = 0
+    self.pending = True
+    self.finished = False
+
+  def start(self):
+    """Starts a prepared sweep, merging into its frames the other
+    pots' commands as they are now, after any sent with it."""
+    if not self.pending:
+      return
+    self.pending = False
+    chain = self.chain
+    nbytes = chain.nbytes
+    others = []
+    for c in range(self.pot.nchans):
+      word = 0
+      for dp in chain.digipots:
+        word = word << 10
+        if dp is not self.pot:
+          word += dp.cmds[c] & 0x3ff
+      others.append(word)
+    cshift = self.shift + 8
+    for tx in self.tx:
+      word = int.from_bytes(tx, 'big')
+      word |= others[(word >> cshift) & 3]
+      tx[:] = word.to_bytes(nbytes, 'big')
+    self.running = True
+    self.timer.init(mode=Timer.PERIODIC, freq=1_000_000 / self.period_us,
+                    callback=self.tick)
+
+  def tick(self, timer):
+    """Timer callback: shifts out the frames of the next step."""
+    k = self.step
+    if k >= self.nsteps:
+      return
+    self.times[k] = utime.ticks_us()
+    spi = self.chain.spi
+    for f in range(self.starts[k], self.starts[k+1]):
+      spi.write_readinto(self.tx[f], self.rx[f])
+      self.chain.unselect()
+      self.chain.select()
+    self.step = k + 1
+    if self.step >= self.nsteps:
+      timer.deinit()
+      self.running = False
+
+  def stop(self):
+    """Stops a running sweep, leaving the pot on its latest step."""
+    self.pending = False
+    if self.running:
+      self.timer.deinit()
+      self.running = False
+    self.finish()
+
+  def finish(self):
+    """Once the sweep has stopped, checks its frames, and brings the
+    pot's settings in line with the latest step sent."""
+    if self.finished or self.running:
+      return
+    self.finished = True
+    chain = self.chain
+    nframes = self.starts[self.step]
+    if nframes:
+      # the last frame is shifted back out by a dummy one
+      loopback = chain.shift(chain.dummy)
+      for f in range(1, nframes + 1):
+        sent = int.from_bytes(self.tx[f-1], 'big')
+        if f < nframes:
+          back = int.from_bytes(self.rx[f], 'big') >> chain.nremainder
+        else:
+          back = loopback
+        if back != sent:
+          self.nerrors += 1
+      chain.nsent += nframes
+      chain.nxfers += nframes
+      chain.nerrors += self.nerrors
+    if self.step:
+      k = self.step - 1
+      nchans = self.pot.nchans
+      regs = Registers(self.rnom[k], self.ract[k],
+                       self.rnom[k] - self.ract[k],
+                       list(self.counts[k*nchans:(k+1)*nchans]))
+      self.pot.counts(regs.regs)
+      self.pot.cal = regs
+      # clean only if every frame made it
+      for c in range(self.pot.nchans):
+        self.pot.dirty[c] = self.nerrors > 0
+
+  def jitter(self):
+    """Returns (late, early, sd) of the step intervals against the
+    period, in microseconds."""
+    late = 0
+    early = 0
+    total = 0
+    total2 = 0
+    n = 0
+    for k in range(1, self.step):
+      dev = utime.ticks_diff(self.times[k], self.times[k-1]) - self.period_us
+      late = max(late, dev)
+      early = min(early, dev)
+      total += dev
+      total2 += dev*dev
+      n += 1
+    if n == 0:
+      return 0, 0, 0.0
+    mean = total / n
+    return late, early, max(0.0, total2 / n - mean*mean) ** 0.5
+
+  def status(self, pot):
+    """One reply line for pot, e.g. S1=done,263/263,5000us,+12/-8us,sd=3.1us,0
+    the steps sent, period, extremes and sd of the step jitter, errors."""
+    if self.pot is not pot:
+      return 'S'+pot.chipid+'=idle'
+    if self.running or self.pending:
+      state = 'running'
+    else:
+      state = 'done'
+    late, early, sd = self.jitter()
+    return 'S{}={},{}/{},{}us,{:+d}/{:+d}us,sd={:.1f}us,{}'.format(
+        self.pot.chipid, state, self.step, self.nsteps, self.period_us,
+        late, early, sd, self.nerrors)
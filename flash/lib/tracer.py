@@ -6,8 +6,34 @@ from machine import I2C, SPI, Pin, Signal
 gc.collect()
 import ssd1306
 gc.collect()
+import bigfont
+gc.collect()
 import utime
 gc.collect()
+import _thread
+gc.collect()
+
+# Single slot mailbox between the two cores, the latest item wins:
+# post() replaces anything not yet taken, counting it as dropped
+class Mailbox:
+  def __init__(self):
+    self.lock = _thread.allocate_lock()
+    self.item = None
+    self.nposted = 0
+    self.ndropped = 0
+
+  def post(self, item):
+    with self.lock:
+      if self.item is not None:
+        self.ndropped += 1
+      self.item = item
+      self.nposted += 1
+
+  def take(self):
+    with self.lock:
+      item = self.item
+      self.item = None
+    return item
 
 # Shunting Relays
 # K1 shorts Digipot R1, K2 shorts R2
@@ -36,7 +62,7 @@ class Relay:
 
 class TraceR:
 
-  def __init__(self):
+  def __init__(self, max_fps=20, font='data/font16.bin', dual_core=False):
 
     self.i2c = I2C(0, scl=Pin(1), sda=Pin(0))
     self.disp = ssd1306.SSD1306_I2C(64, 32, self.i2c)
@@ -52,58 +78,150 @@ class TraceR:
     self.disp_rows = [2, 15]
     self.disp_tabs = [2, 32]
 
+    # large font, if available, drawn one line per half of the display
+    # text pages of 8 pixels, as this display has four
+    self.font = bigfont.Font(font)
+    if not self.font.initialized:
+      self.font = None
+    self.font_pages = [0, 2]
+
+    # display_*_update() only note which screen is wanted,
+    # render() draws and sends it, at most max_fps times a second
+    self.screen = None
+    self.screen_dirty = False
+    self.frame_ms = 1000 // max_fps
+    self.last_frame = utime.ticks_add(utime.ticks_ms(), -self.frame_ms)
+    self.nrequests = 0 # display updates requested
+    self.nframes = 0 # frames rendered
+    self.render_us = 0 # time spent in render() on this core
+    self.render_us_max = 0
+
+    # in dual core mode, core 1 owns the I2C bus and the display:
+    # render() only posts the text to draw, see display_core()
+    self.dual_core = dual_core
+    self.mailbox = Mailbox()
+    self.core1_running = False
+
     # === Shunting Relays ===
     # K1 shorts Digipot R1, K2 shorts R2
     self.k1 = Relay(29, relayid='1')
     self.k2 = Relay(28, relayid='2')
     self.relays = [self.k1, self.k2]
 
+  def request(self, screen):
+    """Marks the display as needing screen drawn."""
+    self.screen = screen
+    self.screen_dirty = True
+    self.nrequests += 1
+
+  def render(self, force=False):
+    """Draws and sends the latest requested screen, if any, unless
+    the last frame went out less than frame_ms ago.
+    In dual core mode, hands the screen's text over to core 1."""
+    if not self.screen_dirty:
+      return False
+    now = utime.ticks_ms()
+    if not force and utime.ticks_diff(now, self.last_frame) < self.frame_ms:
+      return False
+    t0 = utime.ticks_us()
+    self.screen_dirty = False
+    rows = self.screen()
+    if self.core1_running:
+      self.mailbox.post(rows)
+    else:
+      self.draw_rows(*rows)
+      self.disp.show()
+    self.last_frame = now
+    self.nframes += 1
+    dt = utime.ticks_diff(utime.ticks_us(), t0)
+    self.render_us += dt
+    self.render_us_max = max(self.render_us_max, dt)
+    return True
+
+  def start_display_core(self):
+    """Starts core 1 drawing the display, if in dual core mode."""
+    if self.dual_core and not self.core1_running:
+      self.core1_running = True
+      _thread.start_new_thread(self.display_core, ())
+
+  def stop_display_core(self):
+    """Stops core 1, after it finishes any frame in progress."""
+    if self.core1_running:
+      self.core1_running = False
+      utime.sleep_ms(50)
+
+  def display_core(self):
+    """Runs on core 1: draws and sends whatever render() posts."""
+    while self.core1_running:
+      rows = self.mailbox.take()
+      if rows is None:
+        utime.sleep_ms(1)
+        continue
+      self.draw_rows(*rows)
+      self.disp.show()
+
   def display_resistances_update(self):
     """Update resistance values on screen."""
-    r1str = str(int(self.r1.Rcombine()[0]+0.5))
-    r2str = str(int(self.r2.Rcombine()[0]+0.5))
+    self.request(self.rows_resistances)
+
+  def display_counts_update(self):
+    """Update digipot counts values on screen."""
+    self.request(self.rows_counts)
+
+  def display_ohms_update(self):
+    """Update digipot ohms values on screen."""
+    self.request(self.rows_ohms)
+
+  def draw_rows(self, label1, r1str, label2, r2str):
+    """Draw two labelled values, in the large font if there is one."""
     self.disp.fill(0)
-    self.disp.text("R1=", self.disp_tabs[0], self.disp_rows[0])
+    if self.font is not None:
+      self.font.text(self.disp, label1+r1str, 0, self.font_pages[0])
+      self.font.text(self.disp, label2+r2str, 0, self.font_pages[1])
+      return
+    self.disp.text(label1, self.disp_tabs[0], self.disp_rows[0])
     self.disp.text(r1str, self.disp_tabs[1], self.disp_rows[0])
-    self.disp.text("R2=", self.disp_tabs[0], self.disp_rows[1])
+    self.disp.text(label2, self.disp_tabs[0], self.disp_rows[1])
     self.disp.text(r2str, self.disp_tabs[1], self.disp_rows[1])
-    self.disp.show()
+
+  def rows_resistances(self):
+    """Text of the resistance values screen."""
+    r1str = str(int(self.r1.Rcombine()[0]+0.5))
+    r2str = str(int(self.r2.Rcombine()[0]+0.5))
+    return ("R1=", r1str, "R2=", r2str)
   
-  def display_counts_update(self):
-    """Update digipot counts values on screen."""
+  def rows_counts(self):
+    """Text of the digipot counts screen."""
     # NOTE: current all counts are the same
     # so fetching val[0] is representative of the pot
     r1str = str(self.r1.vals[0])
     r2str = str(self.r2.vals[1])
     if self.k1.get(): r1str+='*'
     if self.k2.get(): r2str+='*'
-    self.disp.fill(0)
-    self.disp.text("X1=", self.disp_tabs[0], self.disp_rows[0])
-    self.disp.text(r1str, self.disp_tabs[1], self.disp_rows[0])
-    self.disp.text("X2=", self.disp_tabs[0], self.disp_rows[1])
-    self.disp.text(r2str, self.disp_tabs[1], self.disp_rows[1])
-    self.disp.show()
+    return ("X1=", r1str, "X2=", r2str)
 
-  def display_ohms_update(self):
-    """Update digipot counts values on screen."""
-    # NOTE: current all counts are the same
-    # so fetching val[0] is representative of the pot
-    if self.r1.cal is not None:
-      r1str = str(int(self.r1.cal.rnom))
-    else:
-      r1str = 'unk'
-    if self.r2.cal is not None:
-      r2str = str(int(self.r2.cal.rnom))
-    else:
-      r2str = 'unk'
-    if self.k1.get(): r1str+='*'
-    if self.k2.get(): r2str+='*'
-    self.disp.fill(0)
-    self.disp.text("R1=", self.disp_tabs[0], self.disp_rows[0])
-    self.disp.text(r1str, self.disp_tabs[1], self.disp_rows[0])
-    self.disp.text("R2=", self.disp_tabs[0], self.disp_rows[1])
-    self.disp.text(r2str, self.disp_tabs[1], self.disp_rows[1])
-    self.disp.show()
+  def fits(self, label, text):
+    """True if label and text fit on one row of the display."""
+    if self.font is not None:
+      return self.font.width(label+text) <= self.disp.width
+    return self.disp_tabs[1] + 8*len(text) <= self.disp.width
+
+  def ohms_text(self, label, pot, relay):
+    """The setpoint of pot, to one decimal unless it is whole ohms,
+    or rounded to whole ohms where the decimal does not fit."""
+    if pot.cal is None:
+      return 'unk'
+    mark = '*' if relay.get() else ''
+    rnom = pot.cal.rnom
+    text = '{:.1f}'.format(rnom)
+    if text.endswith('.0') or not self.fits(label, text+mark):
+      text = str(int(rnom+0.5))
+    return text+mark
+
+  def rows_ohms(self):
+    """Text of the digipot ohms screen."""
+    return ("R1=", self.ohms_text("R1=", self.r1, self.k1),
+            "R2=", self.ohms_text("R2=", self.r2, self.k2))
 
   def display_splash_screen(self, serno):
     """Welcome screen."""
@@ -0,0 +1,375 @@
+import gc
+gc.collect()
+import os
+gc.collect()
+import struct
+gc.collect()
+from array import array
+gc.collect()
+from machine import Timer
+gc.collect()
+import utime
+gc.collect()
+from inverse import Registers
+gc.collect()
+import binproto
+gc.collect()
+
+# Waveform playback: arbitrary resistance sequences, each step with its
+# own dwell time, uploaded in chunks over the binary protocol.
+#
+# Steps are compiled as they arrive into raw chain command words, one
+# frame per channel the step changes, in a ring of `capacity` step
+# slots.  The words hold only the waveform pot's commands, the other
+# pots' current commands are merged in as each frame goes out.
+# Step k of the waveform lives in slot k % capacity, so a host
+# can keep streaming steps while earlier ones play, as long as it stays
+# less than capacity steps ahead.  A waveform no longer than the ring
+# stays resident, can loop, and can be saved to flash.
+#
+# A periodic machine.Timer ticks every tick_us.  The callback counts
+# down the current step's dwell in ticks, then shifts out the next
+# step's frames through one preallocated buffer.  It only indexes
+# arrays and does small-integer arithmetic, so it allocates nothing.
+# Each frame shifts the one before it back out, and is checked then.
+#
+# register() serves a Wave on the waveform opcodes of binproto.py.
+
+MAGIC = b'TRCW'
+VERSION = 1
+HEADER = '<4sBBBHHI'  # magic, version, target, nchans,
+                      # capacity, tick_us, length
+STEP = '<fH'          # ohms, dwell in ticks
+
+def zeros(typecode, n):
+  """Preallocated array of n zeros."""
+  return array(typecode, bytearray(n * struct.calcsize(typecode)))
+
+IDLE = 0
+ARMED = 1   # waiting for the trigger
+PLAYING = 2
+DONE = 3
+
+class Wave:
+  def __init__(self, chain, capacity=256):
+    self.chain = chain
+    self.timer = Timer()
+    self.state = IDLE
+    self.finished = True
+    self.pot = None
+    self.nchans = chain.digipots[0].nchans
+    self.others = zeros('L', self.nchans) # other pots' part of each word
+    self.txbuf = bytearray(chain.nbytes)
+    self.rxbuf = bytearray(chain.nbytes)
+    self.allocate(capacity)
+    self.begin(None, None, 1000, 0)
+
+  def allocate(self, capacity):
+    """Sets up the ring for capacity steps.  Raises MemoryError if
+    they do not fit, leaving an empty ring."""
+    self.capacity = 0
+    self.words = self.nframes = self.dwell = None
+    self.counts = self.rnom = self.ract = None
+    gc.collect()
+    nchans = self.nchans
+    try:
+      self.words = zeros('L', capacity * nchans)
+      self.nframes = bytearray(capacity)
+      self.dwell = zeros('H', capacity)
+      self.counts = bytearray(capacity * nchans)
+      self.rnom = zeros('f', capacity)
+      self.ract = zeros('f', capacity)
+    except MemoryError:
+      self.allocate(0)
+      raise
+    self.capacity = capacity
+
+  def begin(self, pot, cal, tick_us, length, capacity=None):
+    """Starts a new waveform for pot, of length steps, or endless if 0."""
+    self.halt()
+    if capacity is not None and capacity != self.capacity:
+      self.pot = None # nothing to play if the ring does not fit
+      self.nloaded = 0
+      self.allocate(capacity)
+    self.pot = pot
+    self.cal = cal
+    if pot is not None:
+      digipots = self.chain.digipots
+      self.shift = 10 * (len(digipots) - 1 - digipots.index(pot))
+    self.tick_us = tick_us
+    self.length = length
+    self.nloaded = 0     # steps 0 to nloaded-1 are compiled
+    self.position = 0    # next step to play
+    self.countdown = 0   # ticks left of the current step
+    self.loops = 0       # times to play, 0 is forever
+    self.nloops = 0      # times played through
+    self.last = None     # word sent last, for the loopback check
+    self.nunderruns = 0
+    self.nerrors = 0
+    self.nsteps = 0
+    self.finished = True # finish() has accounted for the last playback
+    self.state = IDLE
+
+  def resident(self):
+    """True if the whole waveform is in the ring."""
+    return 0 < self.length <= self.capacity and self.nloaded == self.length
+
+  def load_steps(self, first, steps):
+    """Compiles steps, a list of (ohms, dwell), as steps first on.
+    Steps come in order, rewriting a step drops those after it.
+    Returns False, loading nothing, if they do not fit in the ring:
+    the step playing now and the ones after it are kept."""
+    if self.pot is None or first > self.nloaded:
+      raise ValueError(first)
+    end = first + len(steps)
+    if self.length and end > self.length:
+      raise ValueError(end)
+    if end > self.capacity + max(0, self.position - 1):
+      return False
+    nchans = self.nchans
+    for k, (ohms, dwell) in enumerate(steps, first):
+      slot = k % self.capacity
+      regs = self.cal.lookup(ohms)
+      prev = (k - 1) % self.capacity
+      base = slot * nchans
+      n = 0
+      for c in range(nchans):
+        count = regs.regs[c] & 0xff
+        # the first step sets every channel, as looping returns to it
+        if k > 0 and count == self.counts[prev*nchans + c]:
+          continue
+        self.words[base + n] = ((c << 8) + count) << self.shift
+        n += 1
+      for c in range(nchans):
+        self.counts[base + c] = regs.regs[c] & 0xff
+      self.nframes[slot] = n
+      self.dwell[slot] = max(1, dwell)
+      self.rnom[slot] = regs.rnom
+      self.ract[slot] = regs.ract
+    self.nloaded = end
+    return True
+
+  def play(self, loops=1, armed=False):
+    """Plays loops times, 0 is forever, now or on trigger()."""
+    if self.pot is None or self.nloaded == 0:
+      raise ValueError('empty')
+    self.halt()
+    for c in range(self.nchans):
+      word = 0
+      for dp in self.chain.digipots:
+        word = word << 10
+        if dp is not self.pot:
+          word += dp.cmds[c] & 0x3ff
+      self.others[c] = word
+    self.loops = loops
+    self.nloops = 0
+    self.position = 0
+    self.countdown = 0
+    self.last = None
+    self.finished = False
+    self.state = ARMED
+    if not armed:
+      self.trigger()
+
+  def trigger(self, pin=None):
+    """Starts an armed waveform, also a Pin.irq() handler."""
+    if self.state == ARMED:
+      self.state = PLAYING
+      self.countdown = 1
+      self.timer.init(mode=Timer.PERIODIC, freq=1_000_000 / self.tick_us,
+                      callback=self.tick)
+
+  def tick(self, timer):
+    """Timer callback, see the top of this file."""
+    self.countdown -= 1
+    if self.countdown > 0:
+      return
+    k = self.position
+    if self.length and k >= self.length:
+      self.nloops += 1
+      if (self.loops == 0 or self.nloops < self.loops) and self.resident():
+        k = 0
+      else:
+        self.state = DONE
+        timer.deinit()
+        return
+    if k >= self.nloaded:
+      # streaming and the host has fallen behind, hold this step
+      self.nunderruns += 1
+      self.countdown = 1
+      return
+    capacity = self.capacity
+    slot = k % capacity
+    base = slot * self.nchans
+    chain = self.chain
+    spi = chain.spi
+    txbuf = self.txbuf
+    rxbuf = self.rxbuf
+    nbytes = len(txbuf)
+    cshift = self.shift + 8
+    for f in range(base, base + self.nframes[slot]):
+      word = self.words[f]
+      word |= self.others[(word >> cshift) & 3]
+      for b in range(nbytes):
+        txbuf[b] = (word >> (8 * (nbytes - 1 - b))) & 0xff
+      spi.write_readinto(txbuf, rxbuf)
+      chain.unselect()
+      chain.select()
+      if self.last is not None:
+        back = 0
+        for b in range(nbytes):
+          back = (back << 8) | rxbuf[b]
+        if back >> chain.nremainder != self.last:
+          self.nerrors += 1
+      self.last = word
+    self.nsteps += 1
+    self.position = k + 1
+    self.countdown = self.dwell[slot]
+
+  def halt(self):
+    """Stops or disarms playback, then finish()es it."""
+    if self.state == PLAYING:
+      self.timer.deinit()
+    if self.state != DONE:
+      self.state = IDLE
+    self.finish()
+
+  def finish(self):
+    """Once playback has stopped, leaves the pot's settings on the
+    latest step played."""
+    if self.finished or self.state == PLAYING:
+      return
+    self.finished = True
+    k = self.position - 1
+    if k < 0 or self.pot is None:
+      return
+    slot = k % self.capacity
+    nchans = self.nchans
+    regs = Registers(self.rnom[slot], self.ract[slot],
+                     self.rnom[slot] - self.ract[slot],
+                     list(self.counts[slot*nchans:(slot+1)*nchans]))
+    self.pot.counts(regs.regs)
+    self.pot.cal = regs
+    # the last frame was never shifted back out, resend it all next time
+    for c in range(nchans):
+      self.pot.dirty[c] = True
+
+  def status(self):
+    """(state, position, nloaded, nloops, nunderruns, nerrors)"""
+    return (self.state, self.position, self.nloaded, self.nloops,
+            self.nunderruns, self.nerrors)
+
+  def report(self, pot):
+    """One reply line for pot, e.g. W1=playing,120/263,0,0,0
+    the steps played and loaded, loops played, underruns, errors."""
+    if self.pot is not pot:
+      return 'W'+pot.chipid+'=idle'
+    return 'W{}={},{}/{},{},{},{}'.format(
+        pot.chipid, binproto.WAVE_STATES[self.state], self.position,
+        self.nloaded, self.nloops, self.nunderruns, self.nerrors)
+
+  def save(self, fname):
+    """Writes a resident waveform to flash, as compiled."""
+    if not self.resident():
+      raise ValueError('not resident')
+    target = self.chain.digipots.index(self.pot) + 1
+    try:
+      with open(fname, 'wb') as fout:
+        fout.write(struct.pack(HEADER, MAGIC, VERSION, target, self.nchans,
+                               self.capacity, self.tick_us, self.length))
+        for buf in (self.words, self.nframes, self.dwell, self.counts,
+                    self.rnom, self.ract):
+          fout.write(buf)
+    except OSError:
+      # flash full, leave no truncated waveform behind
+      try:
+        os.remove(fname)
+      except OSError:
+        pass
+      raise
+
+  def load(self, fname, sides):
+    """Reads a waveform saved by save(), ready to play, sides maps
+    each target to its (pot, cal).  Returns the target."""
+    with open(fname, 'rb') as fin:
+      header = fin.read(struct.calcsize(HEADER))
+      magic, version, target, nchans, capacity, tick_us, length = \
+          struct.unpack(HEADER, header)
+      if magic != MAGIC or version != VERSION or nchans != self.nchans:
+        raise ValueError(fname)
+      if target not in sides or capacity > binproto.MAX_CAPACITY:
+        raise ValueError(fname)
+      pot, cal = sides[target]
+      self.begin(pot, cal, tick_us, length, capacity)
+      for buf in (self.words, self.nframes, self.dwell, self.counts,
+                  self.rnom, self.ract):
+        fin.readinto(buf)
+    self.nloaded = length
+    return target
+
+def register(proto, player, sides, before=None, path='data/wave{}.bin'):
+  """Serves player on proto's waveform opcodes.  sides maps each
+  target to its (pot, cal), before() runs ahead of new playback, e.g.
+  to stop a sweep, and saved waveforms go to path.format(slot)."""
+  ARGS = binproto.ARGS
+
+  def wave_begin(args):
+    target, capacity, tick_us, length = struct.unpack(
+        ARGS[binproto.OP_WAVE_BEGIN], args)
+    if target not in sides or tick_us < 100 or \
+       not 0 < capacity <= binproto.MAX_CAPACITY:
+      raise ValueError(target)
+    pot, cal = sides[target]
+    try:
+      player.begin(pot, cal, tick_us, length, capacity)
+    except MemoryError:
+      raise ValueError(capacity)
+    return binproto.ST_OK, b''
+
+  def wave_data(args):
+    first, steps = binproto.wave_steps(args)
+    if not player.load_steps(first, steps):
+      return binproto.ST_FULL, b''
+    return binproto.ST_OK, b''
+
+  def wave_play(args):
+    armed, loops = struct.unpack(ARGS[binproto.OP_WAVE_PLAY], args)
+    if before is not None:
+      before()
+    player.play(loops, armed)
+    return binproto.ST_OK, b''
+
+  def wave_trigger(args):
+    player.trigger()
+    return binproto.ST_OK, b''
+
+  def wave_stop(args):
+    player.halt()
+    return binproto.ST_OK, b''
+
+  def wave_state(args):
+    return binproto.ST_OK, struct.pack(binproto.WAVE_STATE, *player.status())
+
+  def wave_save(args):
+    slot, = struct.unpack(ARGS[binproto.OP_WAVE_SAVE], args)
+    try:
+      player.save(path.format(slot))
+    except OSError:
+      return binproto.ST_FULL, b''
+    return binproto.ST_OK, b''
+
+  def wave_load(args):
+    slot, = struct.unpack(ARGS[binproto.OP_WAVE_LOAD], args)
+    try:
+      player.load(path.format(slot), sides)
+    except (OSError, MemoryError):
+      raise ValueError(slot)
+    return binproto.ST_OK, b''
+
+  for opcode, handler in (
+      (binproto.OP_WAVE_BEGIN, wave_begin), (binproto.OP_WAVE_DATA, wave_data),
+      (binproto.OP_WAVE_PLAY, wave_play),
+      (binproto.OP_WAVE_TRIGGER, wave_trigger),
+      (binproto.OP_WAVE_STOP, wave_stop), (binproto.OP_WAVE_STATE, wave_state),
+      (binproto.OP_WAVE_SAVE, wave_save), (binproto.OP_WAVE_LOAD, wave_load)):
+    proto.register(opcode, handler)
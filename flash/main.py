@@ -5,36 +5,61 @@ import sys, gc
 gc.collect()
 import tracer
 gc.collect()
-import select
+import uasyncio
 gc.collect()
 import utime
 gc.collect()
+from inverse import Solver
+gc.collect()
+from commands import Parser, integer, decimal
+gc.collect()
+import binproto
+gc.collect()
+import sweep
+gc.collect()
+import wave
+gc.collect()
+import curve
+gc.collect()
+import conio
+gc.collect()
+from machine import Pin
+gc.collect()
+import micropython
+gc.collect()
 
-def chprintable(ch):
-  if ch == str(b'\x7f','ascii'): return False
-  if ch < ' ': return False
-  return True
+# draw the display on the second core, so that serial commands
+# and digipot updates never wait on the OLED's I2C transfers
+DISPLAY_CORE = False
 
-def show_help():
+# GPIO number of an external trigger for armed waveforms, falling
+# edge, or None for none (the binary protocol can trigger them too)
+WAVE_TRIGGER_PIN = None
+
+# echo typed characters back, E=0 turns it off for host programs
+ECHO = True
+
+# hooks for timed actions, run alongside the serial console:
+# (period_ms, action) pairs, action() must return promptly
+timed_actions = []
+
+async def every(period_ms, action):
+  """Calls action() every period_ms, until cancelled."""
+  while True:
+    action()
+    await uasyncio.sleep_ms(period_ms)
+
+def show_help(out):
   try:
     with open( 'help.txt', 'r') as fhelp:
       for line in fhelp:
-        print(line, end='')
+        out.write(line)
   except OSError:
     pass
 
-class Display_control:
-  def __init__(self, counts=False, relays=False, ohms=False, identity=False):
-    self.counts = counts
-    self.relays = relays
-    self.ohms = ohms
-    self.identity = identity
-
 def doit():
   print('TraceR Module Initializing...')
 
-  display = Display_control()
-
   calibrated = False
   serno = 'unk'
   # First thing is to check that there is a calibration,
@@ -58,19 +83,29 @@ def doit():
 
 
   # initialize the tracer module
-  tr = tracer.TraceR()
+  tr = tracer.TraceR(dual_core=DISPLAY_CORE)
+
+  # run the digipot chain at the fastest SPI clock that
+  # passes its loopback test, with a safety margin
+  baudrate, results = tr.chain.tune()
+  print('SPI baudrate', baudrate)
+
+  # resistance solvers, for settings between the calibrated whole ohms
+  inv1 = Solver(tr.r1.Rtotal, tr.r1.Rwiper, tr.r1.nchans, cal=cal1)
+  inv2 = Solver(tr.r2.Rtotal, tr.r2.Rwiper, tr.r2.nchans, cal=cal2)
 
   tr.display_splash_screen(serno)
   utime.sleep(3) # wait three seconds
+  tr.start_display_core()
 
   # initialize TraceR
   tr.k1.open()
   tr.k2.open()
   if calibrated:
-    regs = cal1.lookup(100)
+    regs = inv1.lookup(100)
     tr.r1.counts(regs.regs)
     tr.r1.cal = regs
-    regs = cal2.lookup(50)
+    regs = inv2.lookup(50)
     tr.r2.counts(regs.regs)
     tr.r2.cal = regs
     errs, checks = tr.chain.send()
@@ -80,245 +115,278 @@ def doit():
     tr.r2.counts(128)
     errs, checks = tr.chain.send()
     tr.display_counts_update()
+  tr.render(force=True)
+
+  # the command set, see help.txt, each command letter's handlers:
+  # set_*() stage new values, the parser's commit sends them all,
+  # show_*() return the reply lines and update the display
+  sides = {'1': (tr.r1, tr.k1, inv1), '2': (tr.r2, tr.k2, inv2)}
+
+  # S sweeps a resistor on a timer, see sweep.py
+  sweeper = sweep.Sweep(tr.chain)
+
+  # waveforms are uploaded and played over the binary protocol, see wave.py
+  player = wave.Wave(tr.chain)
+  if WAVE_TRIGGER_PIN is not None:
+    trigger = Pin(WAVE_TRIGGER_PIN, Pin.IN, Pin.PULL_UP)
+    trigger.irq(player.trigger, Pin.IRQ_FALLING)
+
+  def idle():
+    # a new digipot setting ends a running sweep or waveform, and
+    # finishes one that has ended, before anything else is sent;
+    # a sweep staged on the same command line starts at commit()
+    if not sweeper.pending:
+      sweeper.stop()
+    if not player.finished:
+      player.halt()
+
+  def set_counts(target, ival):
+    idle()
+    pot, relay, cal = sides[target]
+    pot.counts(ival)
+
+  def set_relay(target, ival):
+    pot, relay, cal = sides[target]
+    relay.set(ival)
+
+  def set_ohms(target, fval):
+    idle()
+    pot, relay, cal = sides[target]
+    regs = cal.lookup(fval)
+    pot.counts(regs.regs)
+    pot.cal = regs
+
+  def show_counts(target):
+    pot, relay, cal = sides[target]
+    tr.display_counts_update()
+    return ['X'+pot.chipid+'='+str(pot.vals[0])]
+
+  def show_relay(target):
+    pot, relay, cal = sides[target]
+    tr.display_counts_update()
+    return ['K'+relay.relayid+'='+relay.get_string()]
+
+  def show_ohms(target):
+    pot, relay, cal = sides[target]
+    tr.display_ohms_update()
+    if pot.cal is None:
+      return ['R'+pot.chipid+'='+'uncalibrated']
+    return ['R'+pot.chipid+'='+\
+        '{:.3f},{:+.3f}'.format(pot.cal.ract, pot.cal.rerr)]
+
+  # T emulates a thermistor or RTD on the sensor curve chosen with C,
+  # tables made by host/curvegen.py, see curve.py
+  curves = {'1': None, '2': None} # (slot, Curve) of each resistor
+  temps = {'1': None, '2': None}  # (Registers, temperature) set by T
+  failed = False # a set command that could not be staged, see commit()
+
+  def set_curve(target, slot):
+    nonlocal failed
+    table = curve.Curve('data/curve{}-r{}.bin'.format(slot, target))
+    if not table.initialized or table.serno != serno or \
+        table.resno != 'R'+target:
+      failed = True
+      return
+    curves[target] = (slot, table)
+
+  def show_curve(target):
+    if curves[target] is None:
+      return ['C'+target+'=none']
+    slot, table = curves[target]
+    return ['C{}={},{},{:.1f},{:.1f}'.format(target, slot, table.name,
+                                             table.tbeg, table.tend)]
 
+  def set_temp(target, fval):
+    nonlocal failed
+    if curves[target] is None or not curves[target][1].covers(fval):
+      failed = True
+      return
+    idle()
+    pot, relay, cal = sides[target]
+    slot, table = curves[target]
+    regs = table.lookup(fval)
+    pot.counts(regs.regs)
+    pot.cal = regs
+    temps[target] = (regs, table.temperature(fval))
+
+  def show_temp(target):
+    pot, relay, cal = sides[target]
+    tr.display_ohms_update()
+    # until the resistor is set some other way
+    if temps[target] is None or temps[target][0] is not pot.cal:
+      return ['T'+target+'=none']
+    regs, temp = temps[target]
+    return ['T{}={:.1f},{:.3f},{:+.3f}'.format(
+        target, temp, regs.ract, regs.rerr)]
+
+  def set_sweep(target, spec):
+    idle()
+    pot, relay, cal = sides[target]
+    sweeper.prepare(pot, cal, *spec)
+
+  def show_sweep(target):
+    pot, relay, cal = sides[target]
+    return [sweeper.status(pot)]
+
+  def show_wave(target):
+    pot, relay, cal = sides[target]
+    return [player.report(pot)]
+
+  def playback_done():
+    if not (sweeper.finished or sweeper.running or sweeper.pending):
+      sweeper.finish()
+      tr.display_ohms_update()
+    if player.state == wave.DONE and not player.finished:
+      player.finish()
+      tr.display_ohms_update()
+  timed_actions.append((20, playback_done))
+
+  def show_status(target):
+    replies = []
+    for side in sides:
+      replies += show_counts(side) + show_relay(side) + show_ohms(side)
+    return replies
+
+  def show_identity(target):
+    return ['ID='+serno]
+
+  def show_help_text(target):
+    show_help(out)
+    return []
+
+  # console output goes out in one write per command, and input is
+  # drained in bulk into a ring buffer, see conio.py
+  out = conio.Output()
+  out.echo = ECHO
+  lines = conio.Input(out=out)
+  def set_echo(target, ival):
+    out.echo = bool(ival)
+
+  def show_echo(target):
+    return ['E='+str(int(out.echo))]
+
+  # "B" switches the console to the binary protocol, see binproto.py
+  binary = False
+  def enter_binary(target):
+    nonlocal binary
+    binary = True
+    return ['BINARY']
+
+  def get_state():
+    state = []
+    for pot, relay, cal in sides.values():
+      if pot.cal is None:
+        ract, rerr = float('nan'), float('nan')
+      else:
+        ract, rerr = pot.cal.ract, pot.cal.rerr
+      state.append((pot.vals[0], int(relay.get()), ract, rerr))
+    return state
 
-  # start serial console
-  echo = True
   running = True
-  state_UNK = -1
-  state_CMD = 0
-  state_DIGI = 1
-  state_OPER = 2
-  state_GET_COUNTS = 3
-  state_SET_COUNTS = 4
-  state_GET_RELAY = 5
-  state_SET_RELAY = 6
-  state_GET_OHMS = 7
-  state_SET_OHMS = 8
-  state_IDENTITY = 9
-  state_QUIT = 99
-  state_index = 0
-
-  show_values = False
-  state = state_CMD
-  last_state = state_CMD
-  cmd = 'R'
-  STR_PROMPT='\n> '
-  STR_ERROR='!'
-  print(STR_PROMPT, end='')
-  sides=[]
-  while running:
-    while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:        
-      ch = sys.stdin.read(1).upper()
-      #if echo: print(state, ch,hex(ord(ch)))
-      if chprintable(ch): print(ch,end='')
-      if ch == 'Q': 
-        running = False
-        state = state_QUIT
-      # command parser
-      if state == state_CMD: # looking for command
-        if ch == 'X': 
-          cmd = 'X'
-          state = state_DIGI
-        elif ch == 'K': 
-          cmd = 'K'
-          state = state_DIGI
-        elif ch == 'R' and calibrated:
-          cmd = 'R'
-          state = state_DIGI
-        elif ch == 'H': 
-          show_help()
-          last_state = state_UNK
-        elif ch == 'I': 
-          cmd = 'I'
-          state = state_IDENTITY
-        elif ord(ch) == 0x0a: # show status
-          show_values = True
-          sides = [(tr.r1, tr.k1, cal1),
-                   (tr.r2, tr.k2, cal2)]
-          display.counts = True
-          display.relays = True
-          display.ohms = True
-          last_state = state_UNK
-        else:
-          print(STR_ERROR, end='')
-          print(STR_PROMPT, end='')
-
-      elif state == state_IDENTITY:
-        if ord(ch) == 0x0a:
-          show_values = True
-          display.identity = True
-          state=state_CMD # start all over
-        else:
-          print(STR_ERROR, end='')
-          state=state_CMD
-
-      elif state == state_DIGI: # looking for digipot number
-        state = state_CMD # assume failure...
-        state_index = 0
-        if ch == '1': 
-          sides = [(tr.r1, tr.k1, cal1)]
-          state = state_OPER
-        elif ch == '2': 
-          sides = [(tr.r2, tr.k2, cal2)]
-          state = state_OPER
-        else:
-          state = state_CMD
-          print(STR_ERROR, end='')
-
-      elif state == state_OPER:
-        if ch == '=': 
-          if cmd == 'X': state = state_SET_COUNTS
-          if cmd == 'K': state = state_SET_RELAY
-          if cmd == 'R': state = state_SET_OHMS
-        elif ch == '?':
-          if cmd == 'X': state = state_GET_COUNTS
-          if cmd == 'K': state = state_GET_RELAY
-          if cmd == 'R': state = state_GET_OHMS
-        elif ord(ch) == 0x0a:
-          if cmd == 'X':
-            show_values = True
-            display.counts = True
-            state=state_CMD # start all over
-          if cmd == 'K':
-            show_values = True
-            display.relays = True
-            state=state_CMD # start all over
-          if cmd == 'R':
-            show_values = True
-            display.ohms = True
-            state=state_CMD # start all over
-        else:
-          state = state_CMD
-          print(STR_ERROR, end='')
-
-      elif state == state_GET_COUNTS:
-        show_values = True
-        display.counts = True
-        state=state_CMD # start all over
-
-      elif state == state_GET_RELAY:
-        show_values = True
-        display.relays = True
-        state=state_CMD # start all over
-
-      elif state == state_GET_OHMS:
-        show_values = True
-        display.ohms = True
-        state=state_CMD # start all over
-
-      elif state == state_SET_COUNTS:
-        if state_index==0: val=''
-        if ord(ch) == 0x0a:
-          if state_index > 0:
-            ival = int(val)
-            for pot,relay,cal in sides: 
-              pot.counts(ival)
-            errs, checks = tr.chain.send()
-            show_values = True
-            display.counts = True
-            state=state_CMD # start all over
-          else:
-            state = state_CMD
-            print(STR_ERROR, end='')
-        else:
-          if ch.isdigit():
-            val += ch
-            state_index += 1
-            ival = int(val)
-            if ival < 0 or ival > 255:
-              state = state_CMD
-              print(STR_ERROR, end='')
-          else:
-            state = state_CMD
-            print(STR_ERROR, end='')
-
-      elif state == state_SET_OHMS:
-        if state_index==0: val=''
-        if ord(ch) == 0x0a:
-          if state_index > 0:
-            ival = int(val)
-            for pot, relay, cal in sides: 
-              regs = cal.lookup(ival)
-              pot.counts(regs.regs)
-              pot.cal = regs
-            errs, checks = tr.chain.send()
-            show_values = True
-            display.ohms = True
-            state=state_CMD # start all over
-          else:
-            state = state_CMD
-            print(STR_ERROR, end='')
-        else:
-          if ch.isdigit():
-            val += ch
-            state_index += 1
-            ival = int(val)
-            if ival < 0 or ival > 300:
-              state = state_CMD
-              print(STR_ERROR, end='')
-          else:
-            state = state_CMD
-            print(STR_ERROR, end='')
-      elif state == state_SET_RELAY:
-        if state_index==0: val=''
-        if ord(ch) == 0x0a:
-          if state_index > 0:
-            for pot, relay, cal in sides: 
-              relay.set(ival)
-            show_values = True
-            display.relays = True
-            state=state_CMD # start all over
+  def quit(target):
+    nonlocal running
+    running = False
+    return ['Goodbye.']
+
+  def commit():
+    nonlocal failed
+    errs, checks = tr.chain.send()
+    sweeper.start() # any sweep staged by this command line
+    errs = errs or failed
+    failed = False
+    return errs
+
+  parser = Parser(commit)
+  parser.register('X', show_counts, set_counts, integer(0, 255), '12')
+  parser.register('K', show_relay, set_relay, integer(0, 1), '12')
+  if calibrated:
+    parser.register('R', show_ohms, set_ohms, decimal(0, 300), '12')
+    parser.register('S', show_sweep, set_sweep, sweep.spec, '12')
+    parser.register('W', show_wave, targets='12')
+    parser.register('C', show_curve, set_curve, integer(0, 9), '12')
+    parser.register('T', show_temp, set_temp, decimal(-273, 1000), '12')
+  parser.register('E', show_echo, set_echo, integer(0, 1))
+  parser.register('I', show_identity)
+  parser.register('H', show_help_text)
+  parser.register('Q', quit)
+  parser.register('B', enter_binary)
+  parser.register('', show_status)
+
+  def binary_set(setter):
+    return lambda target, value: setter(str(target), value)
+
+  proto = binproto.Protocol(binary_set(set_ohms) if calibrated else None,
+                            binary_set(set_counts), binary_set(set_relay),
+                            get_state, commit,
+                            set_temp=binary_set(set_temp) if calibrated
+                            else None)
+  if calibrated:
+    wave.register(proto, player,
+                  {1: (tr.r1, inv1), 2: (tr.r2, inv2)}, sweeper.stop)
+
+  async def binary_console():
+    # raw bytes both ways, and 0x03 must not interrupt the program
+    micropython.kbd_intr(-1)
+    try:
+      proto.running = True
+      while proto.running:
+        if (await lines.readexactly(1))[0] != binproto.SYNC:
+          continue # resynchronize on the next frame
+        length = (await lines.readexactly(1))[0]
+        body = await lines.readexactly(length + binproto.CRC_SIZE)
+        sys.stdout.buffer.write(proto.receive(length, body))
+        if calibrated:
+          tr.display_ohms_update()
         else:
-          if ch.isdigit():
-            val += ch
-            state_index += 1
-            ival = int(val)
-            if ival < 0 or ival > 1:
-              state = state_CMD
-              print(STR_ERROR, end='')
-          else:
-            state = state_CMD
-            print(STR_ERROR, end='')
-      elif state == state_QUIT:
-        print('\nGoodbye.')
-        break
-
-      if show_values:
-        if display.identity:
-          print('\n', end='')
-          print('ID='+serno, end='')
-
-        for pot, relay, cal in sides:
-          if display.counts:
-            print('\n', end='')
-            count_status = 'X'+pot.chipid+'='+str(pot.vals[0])
-            print(count_status, end='')
-            tr.display_counts_update()
-          if display.relays:
-            print('\n', end='')
-            relay_status = 'K'+relay.relayid+'='+relay.get_string()
-            print(relay_status, end='')
-            tr.display_counts_update()
-          if display.ohms:
-            print('\n', end='')
-            if pot.cal is None:
-              ohms_status = 'R'+pot.chipid+'='+'uncalibrated'
-            else:
-              ohms_status = 'R'+pot.chipid+'='+str(pot.cal.ract)
-            print(ohms_status, end='')
-            tr.display_ohms_update()
-        display.counts = False
-        display.relays = False
-        display.ohms = False
-        display.identity = False
-        sides=[]
-        show_values=False
-
-      if last_state != state_CMD and state==state_CMD:
-        print(STR_PROMPT,end='')
-
-      last_state = state
+          tr.display_counts_update()
+    finally:
+      micropython.kbd_intr(3)
 
-doit()
+  # the serial console, display refresh and any timed actions
+  # each run as a task, uasyncio sleeps while none has work to do
+  async def console():
+    nonlocal binary
+    STR_PROMPT='\n> '
+    STR_ERROR='!'
+    out.write(STR_PROMPT)
+    while running:
+      line = lines.readline() # echoes it back
+      if line is None: # all input handled, send the output and wait
+        out.flush()
+        await lines.fill()
+        continue
+      try:
+        errs, replies = parser.execute(line) # rejects conio.OVERRUN
+      except ValueError:
+        errs, replies = True, []
+      if errs: out.write(STR_ERROR)
+      for reply in replies:
+        out.write('\n'+reply)
+      if binary:
+        out.write('\n')
+        out.flush()
+        await binary_console()
+        binary = False
+      if running:
+        out.write(STR_PROMPT)
+    out.flush()
 
+  async def refresh():
+    # replies are out before a frame is drawn, at most
+    # one frame per frame_ms, rate limited by TraceR
+    while True:
+      tr.render()
+      await uasyncio.sleep_ms(tr.frame_ms)
+
+  async def tasks():
+    background = [uasyncio.create_task(refresh())]
+    for period_ms, action in timed_actions:
+      background.append(uasyncio.create_task(every(period_ms, action)))
+    await console()
+    for task in background:
+      task.cancel()
+
+  uasyncio.run(tasks())
+  tr.stop_display_core()
+
+doit()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+""" Microbenchmarks of the firmware's hot paths, with a regression check.
+
+Runs flash/lib under CPython on the simulated board of host/hwsim, and
+times each path: calibration table loads and lookups, Digipot.counts()
+and ohms(), Digichain.send(), SSD1306.show(), the TraceR display
+updates and the command parser driving real handlers.  Besides the
+host time per call, each result carries the bus traffic the call
+caused on the simulated SPI and I2C buses: bytes, transactions and
+modelled wire time.  Bus figures are exact and machine independent,
+host times are only comparable on one machine and Python version.
+
+Results are written as JSON, and compared with a baseline
+(host/bench_baseline.json by default): any bus figure more than
+--threshold above its baseline fails the run with exit status 1.
+Host times vary from run to run by tens of percent, and from machine
+to machine by more, so they are only checked with --host-threshold,
+and only for the benchmarks that use no bus, which have nothing else
+to check.  Each run also times a fixed pure Python loop, and host
+times are compared in units of it, which takes out most of the
+difference between machines.
+
+    python3 host/bench_firmware.py                    # compare
+    python3 host/bench_firmware.py -o results.json    # and save them
+    python3 host/bench_firmware.py --update-baseline  # new baseline
+    python3 host/bench_firmware.py -k send            # some only
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import hwsim
+
+BASELINE = os.path.join(HERE, 'bench_baseline.json')
+METRICS = ('host_us', 'bytes', 'transactions', 'bus_us')
+CHECKED = ('bytes', 'transactions', 'bus_us')  # the exact ones
+
+BENCHMARKS = []
+
+
+def benchmark(number):
+    """Registers a benchmark: setup(ctx) returns call(i), which is
+    timed for number calls per run."""
+    def register(setup):
+        BENCHMARKS.append((setup.__name__, number, setup))
+        return setup
+    return register
+
+
+class Context:
+    """What the benchmarks share: the board and one TraceR."""
+
+    def __init__(self, board):
+        import tracer
+        from inverse import Inverse, Solver
+        self.board = board
+        self.tr = tracer.TraceR()
+        self.tr.chain.tune()
+        self.cal1 = Inverse('data/invert-sn0-r1-cal.bin')
+        self.cal2 = Inverse('data/invert-sn0-r2-cal.bin')
+        self.inv1 = Solver(self.tr.r1.Rtotal, self.tr.r1.Rwiper,
+                           self.tr.r1.nchans, cal=self.cal1)
+        self.inv2 = Solver(self.tr.r2.Rtotal, self.tr.r2.Rwiper,
+                           self.tr.r2.nchans, cal=self.cal2)
+
+
+@benchmark(20)
+def inverse_load_bin(ctx):
+    from inverse import Inverse
+    return lambda i: Inverse('data/invert-sn0-r1-cal.bin')
+
+
+@benchmark(5)
+def inverse_load_text(ctx):
+    from inverse import Inverse
+    return lambda i: Inverse('data/invert-sn0-r1-cal.dat')
+
+
+@benchmark(5000)
+def inverse_lookup(ctx):
+    return lambda i: ctx.cal1.lookup(13 + i % 263)
+
+
+@benchmark(500)
+def solver_lookup(ctx):
+    return lambda i: ctx.inv1.lookup(13.25 + i % 263)
+
+
+@benchmark(5000)
+def digipot_counts(ctx):
+    pot = ctx.tr.r1
+    values = [[i & 0xff] * pot.nchans for i in range(256)]
+    return lambda i: pot.counts(values[i & 0xff])
+
+
+@benchmark(5000)
+def digipot_ohms(ctx):
+    return lambda i: ctx.tr.r1.ohms()
+
+
+@benchmark(2000)
+def chain_send_clean(ctx):
+    ctx.tr.chain.send()
+    return lambda i: ctx.tr.chain.send()
+
+
+@benchmark(1000)
+def chain_send_one(ctx):
+    def call(i):
+        ctx.tr.r1.counts(i & 0xff, channels=[0])
+        ctx.tr.chain.send()
+    return call
+
+
+@benchmark(1000)
+def chain_send_both(ctx):
+    def call(i):
+        ctx.tr.r1.counts(i & 0xff)
+        ctx.tr.r2.counts(~i & 0xff)
+        ctx.tr.chain.send()
+    return call
+
+
+@benchmark(200)
+def ssd1306_show_full(ctx):
+    return lambda i: ctx.tr.disp.show(full=True)
+
+
+@benchmark(500)
+def ssd1306_show_changed(ctx):
+    disp = ctx.tr.disp
+    def call(i):
+        disp.fill_rect(40, 16, 16, 8, i & 1)
+        disp.show()
+    return call
+
+
+@benchmark(500)
+def display_counts_update(ctx):
+    tr = ctx.tr
+    def call(i):
+        tr.r1.counts(i & 0xff)
+        tr.display_counts_update()
+        tr.render(force=True)
+    return call
+
+
+@benchmark(500)
+def display_ohms_update(ctx):
+    tr = ctx.tr
+    rows = [ctx.cal1.lookup(13 + k) for k in range(263)]
+    def call(i):
+        tr.r1.cal = rows[i % 263]
+        tr.display_ohms_update()
+        tr.render(force=True)
+    return call
+
+
+@benchmark(500)
+def display_resistances_update(ctx):
+    tr = ctx.tr
+    def call(i):
+        tr.r1.counts(i & 0xff)
+        tr.display_resistances_update()
+        tr.render(force=True)
+    return call
+
+
+@benchmark(500)
+def parser_execute(ctx):
+    """Command lines through the Parser, with main.py's handlers for
+    X and R: stage, one chain send per line, reply lines."""
+    from commands import Parser, integer, decimal
+    tr = ctx.tr
+    sides = {'1': (tr.r1, ctx.inv1), '2': (tr.r2, ctx.inv2)}
+
+    def set_counts(target, ival):
+        sides[target][0].counts(ival)
+
+    def set_ohms(target, fval):
+        pot, cal = sides[target]
+        regs = cal.lookup(fval)
+        pot.counts(regs.regs)
+        pot.cal = regs
+
+    def show_counts(target):
+        pot = sides[target][0]
+        return ['X' + pot.chipid + '=' + str(pot.vals[0])]
+
+    def show_ohms(target):
+        pot = sides[target][0]
+        return ['R' + pot.chipid + '=' +
+                '{:.3f},{:+.3f}'.format(pot.cal.ract, pot.cal.rerr)]
+
+    def commit():
+        errs, checks = tr.chain.send()
+        return errs
+
+    parser = Parser(commit)
+    parser.register('X', show_counts, set_counts, integer(0, 255), '12')
+    parser.register('R', show_ohms, set_ohms, decimal(0, 300), '12')
+    lines = ['X1=10', 'R1=100;R2=50', 'X=12,240', 'R2=75', 'X1?;R1?']
+    return lambda i: parser.execute(lines[i % len(lines)])
+
+
+def run(ctx, name, number, setup, repeat):
+    """Best host time per call of repeat runs, and bus usage per call."""
+    call = setup(ctx)
+    call(0)  # warm up, and leave the chain and display settled
+    buses = ctx.board.profile.buses
+    best = None
+    for r in range(repeat):
+        before = {b: bus.snapshot() for b, bus in buses.items()}
+        gc.collect()
+        gc.disable()  # as timeit does, collections add noise
+        try:
+            t0 = time.perf_counter()
+            for i in range(number):
+                call(i)
+            dt = time.perf_counter() - t0
+        finally:
+            gc.enable()
+        used = {b: bus.snapshot() - before[b] for b, bus in buses.items()}
+        if best is None or dt < best:
+            best = dt
+    return {
+        'calls': number,
+        'host_us': round(best / number * 1e6, 3),
+        'bytes': round(sum(c.nbytes for c in used.values()) / number, 3),
+        'transactions': round(sum(c.ntransactions for c in used.values())
+                              / number, 3),
+        'bus_us': round(sum(c.time_us for c in used.values()) / number, 3),
+    }
+
+
+def reference(repeat, number=20000):
+    """Best host time in us of a fixed pure Python loop, integer and
+    list work like the firmware's, the unit host times are compared in."""
+    table = list(range(256))
+    best = None
+    for r in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = time.perf_counter()
+            total = 0
+            for i in range(number):
+                total += table[i & 0xff] << (i & 7)
+            dt = time.perf_counter() - t0
+        finally:
+            gc.enable()
+        if best is None or dt < best:
+            best = dt
+    return round(best * 1e6, 3)
+
+
+def compare(results, baseline, threshold, host_threshold=None, scale=1.0):
+    """Returns the lines of every bus figure more than threshold above
+    its baseline, as a fraction, and of every benchmark not in it.
+    With host_threshold, also of the host time of every benchmark that
+    uses no bus, more than host_threshold above its baseline scaled by
+    scale, this run's reference time over the baseline's."""
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            failures.append('{}: not in the baseline'.format(name))
+            continue
+        for metric in CHECKED:
+            was = base.get(metric, 0)
+            now = result[metric]
+            if now > max(was * (1 + threshold), was + 0.001):  # rounding
+                failures.append('{}: {} {:g} -> {:g} (+{:.0%})'.format(
+                    name, metric, was, now,
+                    (now - was) / was if was else float('inf')))
+        if host_threshold is None or any(base.get(m, 0) for m in CHECKED):
+            continue
+        was = base['host_us'] * scale
+        now = result['host_us']
+        if now > was * (1 + host_threshold):
+            failures.append('{}: host_us {:g} -> {:g}, scaled {:g} (+{:.0%})'
+                            .format(name, base['host_us'], now, was,
+                                    (now - was) / was))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-k', '--select', default='',
+                        help='only benchmarks whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='runs of each benchmark, the best counts')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed rise of bus figures, fraction')
+    parser.add_argument('--host-threshold', type=float,
+                        help='allowed rise of the host times of the '
+                        'benchmarks with no bus traffic, fraction, '
+                        'default not checked')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    args.baseline = os.path.abspath(args.baseline)
+    board = hwsim.install()
+    os.chdir(hwsim.FLASH)  # for data/, as on the device
+    results = {}
+    reference_us = reference(args.repeat)
+    print('reference loop {:.1f} us'.format(reference_us))
+    try:
+        ctx = Context(board)
+        print('{:28} {:>10} {:>8} {:>7} {:>9}'.format(
+            'benchmark', 'host us', 'bytes', 'xfers', 'bus us'))
+        for name, number, setup in BENCHMARKS:
+            if args.select not in name:
+                continue
+            result = run(ctx, name, number, setup, args.repeat)
+            results[name] = result
+            print('{:28} {:>10.2f} {:>8.1f} {:>7.2f} {:>9.1f}'.format(
+                name, result['host_us'], result['bytes'],
+                result['transactions'], result['bus_us']))
+    finally:
+        board.close()
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'reference_us': reference_us,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as fout:
+            json.dump(report, fout, indent=2)
+            fout.write('\n')
+        print('baseline written to', args.baseline)
+        return
+    try:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)
+    except OSError:
+        print('no baseline, run with --update-baseline')
+        return
+    scale = reference_us / baseline.get('reference_us', reference_us)
+    failures = compare(results, baseline['results'], args.threshold,
+                       args.host_threshold, scale)
+    for line in failures:
+        print('REGRESSION', line)
+    if failures:
+        sys.exit(1)
+    if args.host_threshold is None:
+        print('no regressions beyond {:.0%} on the buses'.format(
+            args.threshold))
+    else:
+        print('no regressions beyond {:.0%} on the buses, {:.0%} host time'
+              .format(args.threshold, args.host_threshold))
+
+
+if __name__ == '__main__':
+    main()
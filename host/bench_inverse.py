@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+""" Host-side benchmark of the calibration table in flash/lib/inverse.py.
+
+Compares the packed, directly indexed Inverse table against the original
+list-of-Registers layout (reproduced below as LegacyInverse), using the
+calibration files shipped in flash/data.  The packed table is loaded
+both from the text (.dat) file and from its compiled binary (.bin) form,
+see host/calcompile.py, and opened lazily as a LazyInverse.  Reports
+load time, lookup latency and heap retained by each table, as measured
+by tracemalloc.  The lazy lookups sweep every setpoint, so they all
+miss the row cache and measure the seek-and-read path.
+
+Finally a 0.1 ohm table is synthesized from the first file, to show
+how heap use scales with table density for the full and lazy loaders.
+
+    python3 host/bench_inverse.py [calfile.dat ...]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FLASH = os.path.join(HERE, '..', 'flash')
+sys.path.insert(0, os.path.join(FLASH, 'lib'))
+
+import inverse
+from inverse import Registers, Inverse, LazyInverse
+import calcompile
+
+
+class LegacyInverse:
+    """The original list-of-objects table with its linear-scan lookup."""
+
+    def __init__(self, fname):
+        self.regs = []
+        self.serno = self.resno = None
+        self.rbeg = self.rend = self.nres = None
+        with open(fname, 'r') as fin:
+            for line in fin:
+                row = line.strip().split('\t')
+                if row[0][0] == '#':
+                    continue
+                if self.serno is None:
+                    self.serno = row[0]
+                elif self.resno is None:
+                    self.resno = row[0]
+                elif self.rbeg is None:
+                    self.rbeg = float(row[0])
+                elif self.rend is None:
+                    self.rend = float(row[0])
+                elif self.nres is None:
+                    self.nres = int(row[0])
+                else:
+                    regs = [int(row[1]), int(row[2]), int(row[3]), int(row[4])]
+                    self.regs.append(Registers(float(row[0]), float(row[5]),
+                                               float(row[6]), regs))
+
+    def lookup(self, rnom):
+        irnom = int(rnom + 0.5)
+        if irnom < int(self.rbeg):
+            return self.regs[1]
+        if irnom > int(self.rend):
+            return self.regs[-1]
+        for regs in self.regs:
+            if irnom == int(regs.rnom):
+                return regs
+        return None
+
+
+def heap_of(factory):
+    """Returns (object, bytes retained) for a freshly built object."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = factory()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before
+
+
+def release(table):
+    """Closes the table file held open by a LazyInverse."""
+    if isinstance(table, LazyInverse):
+        table.close()
+
+
+def bench(fname, number=20):
+    binname = os.path.splitext(fname)[0] + '.bin'
+    if not os.path.exists(binname):
+        calcompile.compile_table(fname, binname)
+    results = {}
+    for name, cls, src in (('legacy', LegacyInverse, fname),
+                           ('text', Inverse, fname),
+                           ('binary', Inverse, binname),
+                           ('lazy', LazyInverse, binname)):
+        table, heap = heap_of(lambda: cls(src))
+        tload = min(timeit.repeat(lambda: release(cls(src)),
+                                  number=1, repeat=5))
+        setpoints = range(int(table.rbeg), int(table.rend) + 1)
+        tlook = min(timeit.repeat(lambda: [table.lookup(r) for r in setpoints],
+                                  number=number, repeat=5))
+        tlook /= number * len(setpoints)
+        results[name] = (table, heap, tload, tlook)
+
+    # all layouts must agree on every setpoint
+    legacy = results['legacy'][0]
+    for r in range(int(legacy.rbeg) - 5, int(legacy.rend) + 5):
+        a = legacy.lookup(r)
+        for name in ('text', 'binary', 'lazy'):
+            b = results[name][0].lookup(r)
+            assert a.regs == b.regs and abs(a.ract - b.ract) < 1e-3, r
+
+    release(results['lazy'][0])
+
+    print(os.path.basename(fname))
+    print('  {:8s} {:>10s} {:>10s} {:>12s}'.format(
+        'layout', 'heap, B', 'load, ms', 'lookup, us'))
+    for name, (table, heap, tload, tlook) in results.items():
+        print('  {:8s} {:10d} {:10.3f} {:12.3f}'.format(
+            name, heap, tload * 1e3, tlook * 1e6))
+
+
+def bench_dense(fname, rstep=0.1):
+    """Heap of full and lazy loads of a table resampled to rstep ohms."""
+    coarse = Inverse(fname)
+    dense = Inverse(rstep=rstep)
+    dense.serno, dense.resno = coarse.serno, coarse.resno
+    dense.rbeg, dense.rend = coarse.rbeg, coarse.rend
+    dense.allocate(dense.slot(dense.rend) + 1)
+    for k in range(dense.nres):
+        rnom = dense.rbeg + k * rstep
+        regs = coarse.lookup(rnom)
+        struct.pack_into(inverse.RECORD, dense.recs, inverse.RECORD_SIZE * k,
+                         rnom, regs.ract, regs.rerr, *regs.regs)
+    with tempfile.TemporaryDirectory() as tmp:
+        binname = os.path.join(tmp, 'dense.bin')
+        calcompile.write_bin(dense, binname)
+        print('{} resampled to {} ohm, {} records'.format(
+            os.path.basename(fname), rstep, dense.nres))
+        print('  {:8s} {:>10s}'.format('layout', 'heap, B'))
+        for name, cls in (('binary', Inverse), ('lazy', LazyInverse)):
+            table, heap = heap_of(lambda: cls(binname))
+            assert table.initialized
+            release(table)
+            print('  {:8s} {:10d}'.format(name, heap))
+
+
+if __name__ == '__main__':
+    fnames = sys.argv[1:] or [
+        os.path.join(FLASH, 'data', 'invert-sn0-r1-cal.dat'),
+        os.path.join(FLASH, 'data', 'invert-sn0-r2-cal.dat'),
+    ]
+    for fname in fnames:
+        bench(fname)
+    bench_dense(fnames[0])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+""" Host-side benchmark of the serial command parser, flash/lib/commands.py.
+
+Compares commands parsed per second by the table-driven Parser against
+the original per-character state machine from main.py, reproduced
+below as LegacyParser.  Both drive the same stub handlers, which only
+record the values, so the figures are for parsing and dispatch alone.
+The Parser is timed with one command per line, as the state machine
+takes them, and with whole lines of ';' separated commands.
+
+    python3 host/bench_parser.py [-n LINES]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'flash', 'lib'))
+
+from commands import Parser, integer, decimal
+
+LINES = ['X1=10', 'X2=200', 'K1=1', 'K2=0', 'R1=100', 'R2=50.5',
+         'X1?', 'R2?', 'K1', '']
+
+
+class Stubs:
+    """Handlers that only record what they were asked to do."""
+
+    def __init__(self):
+        self.values = {}
+        self.nshown = 0
+        self.ncommits = 0
+
+    def set(self, name):
+        def handler(target, value):
+            self.values[name + target] = value
+        return handler
+
+    def show(self, target):
+        self.nshown += 1
+        return []
+
+    def commit(self):
+        self.ncommits += 1
+        return False
+
+    def parser(self):
+        parser = Parser(self.commit)
+        parser.register('X', self.show, self.set('X'), integer(0, 255), '12')
+        parser.register('K', self.show, self.set('K'), integer(0, 1), '12')
+        parser.register('R', self.show, self.set('R'), decimal(0, 300), '12')
+        parser.register('', self.show)
+        return parser
+
+
+class LegacyParser:
+    """The original main.py state machine, fed one character at a time,
+    with its replies and display updates replaced by the stubs."""
+
+    CMD, DIGI, OPER = 0, 1, 2
+    GET_COUNTS, SET_COUNTS, GET_RELAY, SET_RELAY = 3, 4, 5, 6
+    GET_OHMS, SET_OHMS = 7, 8
+
+    def __init__(self, stubs):
+        self.stubs = stubs
+        self.set_counts = stubs.set('X')
+        self.set_relay = stubs.set('K')
+        self.set_ohms = stubs.set('R')
+        self.state = self.CMD
+        self.cmd = 'R'
+        self.side = None
+        self.val = ''
+        self.index = 0
+
+    def feed(self, ch):
+        ch = ch.upper()
+        state = self.state
+        if state == self.CMD:
+            if ch in ('X', 'K', 'R'):
+                self.cmd = ch
+                self.state = self.DIGI
+            elif ord(ch) == 0x0a:
+                self.stubs.show(None)
+        elif state == self.DIGI:
+            self.state = self.CMD
+            self.index = 0
+            if ch == '1' or ch == '2':
+                self.side = ch
+                self.state = self.OPER
+        elif state == self.OPER:
+            if ch == '=':
+                self.state = {'X': self.SET_COUNTS, 'K': self.SET_RELAY,
+                              'R': self.SET_OHMS}[self.cmd]
+            elif ch == '?':
+                self.state = {'X': self.GET_COUNTS, 'K': self.GET_RELAY,
+                              'R': self.GET_OHMS}[self.cmd]
+            elif ord(ch) == 0x0a:
+                self.stubs.show(self.side)
+                self.state = self.CMD
+            else:
+                self.state = self.CMD
+        elif state in (self.GET_COUNTS, self.GET_RELAY, self.GET_OHMS):
+            self.stubs.show(self.side)
+            self.state = self.CMD
+        elif state in (self.SET_COUNTS, self.SET_RELAY):
+            if self.index == 0:
+                self.val = ''
+            hi = 255 if state == self.SET_COUNTS else 1
+            setter = self.set_counts if state == self.SET_COUNTS \
+                else self.set_relay
+            if ord(ch) == 0x0a:
+                if self.index > 0:
+                    setter(self.side, int(self.val))
+                    self.stubs.commit()
+                    self.stubs.show(self.side)
+                self.state = self.CMD
+            elif ch.isdigit():
+                self.val += ch
+                self.index += 1
+                ival = int(self.val)
+                if ival < 0 or ival > hi:
+                    self.state = self.CMD
+            else:
+                self.state = self.CMD
+        elif state == self.SET_OHMS:
+            if self.index == 0:
+                self.val = ''
+            if ord(ch) == 0x0a:
+                if self.index > 0 and self.val != '.':
+                    self.set_ohms(self.side, float(self.val))
+                    self.stubs.commit()
+                    self.stubs.show(self.side)
+                self.state = self.CMD
+            elif ch.isdigit() or (ch == '.' and '.' not in self.val):
+                self.val += ch
+                self.index += 1
+                if self.val != '.' and float(self.val) > 300:
+                    self.state = self.CMD
+            else:
+                self.state = self.CMD
+
+
+def bench(label, func, ncommands, number):
+    dt = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print('{:24s} {:10.0f} commands/s'.format(label, ncommands / dt))
+    return dt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--lines', type=int, default=1000,
+                        help='lines per timing run')
+    args = parser.parse_args()
+    lines = [LINES[i % len(LINES)] for i in range(args.lines)]
+    text = ''.join(line + '\n' for line in lines)
+    multi = [';'.join(LINES[:6])] * (args.lines // 6)
+
+    legacy = LegacyParser(Stubs())
+    table = Stubs().parser()
+    bench('state machine', lambda: [legacy.feed(ch) for ch in text],
+          len(lines), 10)
+    bench('table, one per line',
+          lambda: [table.execute(line) for line in lines], len(lines), 10)
+    bench('table, six per line',
+          lambda: [table.execute(line) for line in multi], 6 * len(multi), 10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+""" Compiles tab-separated calibration tables (.dat) into the binary
+format loaded by flash/lib/inverse.py.
+
+The binary file is the table header followed by the packed records,
+exactly as Inverse holds them in RAM, so the device loads it with one
+readinto() and no parsing.  Output goes next to the input file with a
+.bin extension, unless -o is given (single input only).
+
+    python3 host/calcompile.py flash/data/invert-sn0-r1-cal.dat ...
+"""
+
+import argparse
+import binascii
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'flash', 'lib'))
+
+from inverse import Inverse
+
+
+def write_bin(inv, fname):
+    """Writes the binary form of a loaded Inverse table."""
+    crc = binascii.crc32(inv.recs) & 0xffffffff
+    with open(fname, 'wb') as fout:
+        fout.write(inv.header(crc))
+        fout.write(inv.recs)
+
+
+def compile_table(src, dst=None, rstep=1.0):
+    inv = Inverse(src, rstep=rstep)
+    if not inv.initialized:
+        raise SystemExit('cannot load calibration table: ' + src)
+    if dst is None:
+        dst = os.path.splitext(src)[0] + '.bin'
+    write_bin(inv, dst)
+    # read it back, both loaders must agree record for record
+    check = Inverse(dst)
+    if not check.initialized or check.recs != inv.recs:
+        raise SystemExit('verification failed: ' + dst)
+    print('{} -> {}  {} {}  {} records, {} bytes'.format(
+        src, dst, inv.serno, inv.resno, inv.nres, os.path.getsize(dst)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('src', nargs='+', help='text calibration table(s)')
+    parser.add_argument('-o', '--output', help='output file name')
+    parser.add_argument('-s', '--step', type=float, default=1.0,
+                        help='grid step of the input table, ohms')
+    args = parser.parse_args()
+    if args.output and len(args.src) > 1:
+        parser.error('-o only allowed with a single input')
+    for src in args.src:
+        compile_table(src, args.output, args.step)
+
+
+if __name__ == '__main__':
+    main()
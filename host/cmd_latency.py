@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+""" Measures TraceR command-to-ack latency over the USB serial port.
+
+Each command is written as one line, and the time is taken from the
+write until the next "> " prompt comes back, which main.py prints only
+once the command has been parsed, the digipots written and the reply
+sent.  Commands go back to back, so a display refresh still running
+when the next command arrives shows up as latency.
+
+Run once with DISPLAY_CORE = False and once with DISPLAY_CORE = True in
+flash/main.py, labelling each run, to compare drawing the display on
+core 0 against offloading it to core 1:
+
+    python3 host/cmd_latency.py /dev/ttyACM0 --label single
+    python3 host/cmd_latency.py /dev/ttyACM0 --label dual
+"""
+
+import argparse
+import statistics
+import time
+
+import serial
+
+PROMPT = b'\n> '
+COMMANDS = ['X1=10', 'X1=200', 'X2=64', 'X2=128', 'R1=100', 'R2=50.5']
+
+
+def sync(port, timeout=5.0):
+    """Discards anything pending and waits for a fresh prompt."""
+    port.reset_input_buffer()
+    port.write(b'\n')
+    read_until_prompt(port, timeout)
+
+
+def read_until_prompt(port, timeout=5.0):
+    """Returns the reply up to and including the prompt."""
+    reply = b''
+    deadline = time.perf_counter() + timeout
+    while not reply.endswith(PROMPT):
+        if time.perf_counter() > deadline:
+            raise TimeoutError('no prompt, got {!r}'.format(reply))
+        reply += port.read(max(1, port.in_waiting))
+    return reply
+
+
+def measure(port, commands, count):
+    """Sends count commands, cycling through commands.
+    Returns (latencies in ms, replies with an error mark)."""
+    latencies = []
+    errors = []
+    for i in range(count):
+        line = commands[i % len(commands)]
+        t0 = time.perf_counter()
+        port.write(line.encode() + b'\n')
+        reply = read_until_prompt(port)
+        latencies.append((time.perf_counter() - t0) * 1e3)
+        if b'!' in reply:
+            errors.append((line, reply))
+    return latencies, errors
+
+
+def report(label, latencies, elapsed):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    print('{}: {} commands, {:.1f} commands/s'.format(
+        label, len(latencies), len(latencies) / elapsed))
+    print('  latency ms  min {:.2f}  median {:.2f}  p95 {:.2f}  max {:.2f}'
+          .format(ordered[0], statistics.median(ordered), p95, ordered[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('port', help='serial port, e.g. /dev/ttyACM0')
+    parser.add_argument('--baud', type=int, default=115200,
+                        help='baud rate (ignored by USB CDC)')
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help='commands to send')
+    parser.add_argument('--commands', nargs='+', default=COMMANDS,
+                        help='commands to cycle through')
+    parser.add_argument('--label', default='run', help='name for this run')
+    args = parser.parse_args()
+
+    with serial.Serial(args.port, args.baud, timeout=0.1) as port:
+        sync(port)
+        t0 = time.perf_counter()
+        latencies, errors = measure(port, args.commands, args.count)
+        elapsed = time.perf_counter() - t0
+    report(args.label, latencies, elapsed)
+    for line, reply in errors:
+        print('  error: {} -> {!r}'.format(line, reply))
+
+
+if __name__ == '__main__':
+    main()
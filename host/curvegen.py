@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+""" Generates sensor curve tables, temperature to registers, for the T
+command of the TraceR (see flash/lib/curve.py).
+
+A curve gives the sensor's resistance at each temperature on a grid
+from --tbeg to --tend.  --scale maps it into the range the TraceR can
+set, 13 to 275 ohms, e.g. 0.01 emulates a 10k NTC behind a 100:1
+input.  Each resistance is then solved against the calibration table of
+the resistor, with the same inverse.Solver the TraceR uses for
+settings between its calibrated whole ohms, but given a generous time
+budget, since this runs once on the host.  Temperatures whose
+resistance falls outside the calibration table are trimmed from the
+ends of the grid.
+
+    python3 host/curvegen.py flash/data/invert-sn0-r1-cal.bin \\
+        --slot 0 --scale 0.01 ntc --r0 10000 --beta 3950
+    python3 host/curvegen.py flash/data/invert-sn0-r2-cal.bin \\
+        --slot 1 --tbeg -50 --tend 500 pt100
+
+Tables go to curve<slot>-r<n>.bin next to the calibration table, where
+"C1=<slot>" selects them for resistor n.
+"""
+
+import argparse
+import binascii
+import math
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'flash', 'lib'))
+
+from curve import Curve
+from inverse import Inverse, Solver
+
+KELVIN = 273.15
+
+
+def ntc_beta(r0, t0, beta):
+    """NTC thermistor, R = r0 exp(beta (1/T - 1/T0))."""
+    def ohms(t):
+        return r0 * math.exp(beta * (1 / (t + KELVIN) - 1 / (t0 + KELVIN)))
+    return ohms
+
+
+def steinhart_hart(a, b, c):
+    """NTC thermistor, 1/T = a + b ln(R) + c ln(R)^3, solved for R."""
+    def ohms(t):
+        x = (a - 1 / (t + KELVIN)) / c
+        y = math.sqrt((b / (3 * c)) ** 3 + x * x / 4)
+        return math.exp(math.copysign(abs(y - x / 2) ** (1 / 3), y - x / 2)
+                        - math.copysign(abs(y + x / 2) ** (1 / 3), y + x / 2))
+    return ohms
+
+
+def callendar_van_dusen(r0, a=3.9083e-3, b=-5.775e-7, c=-4.183e-12):
+    """Platinum RTD, IEC 60751 coefficients by default."""
+    def ohms(t):
+        r = 1 + a * t + b * t * t
+        if t < 0:
+            r += c * (t - 100) * t ** 3
+        return r0 * r
+    return ohms
+
+
+def build(cal, ohms, name, tbeg, tend, tstep, budget_us):
+    """Returns a Curve of cal's registers for ohms(t) on the grid."""
+    solver = Solver(cal=cal, budget_us=budget_us)
+    temps = [tbeg + k * tstep for k in range(int((tend - tbeg) / tstep + 1.5))]
+    fits = [cal.rbeg <= ohms(t) <= cal.rend for t in temps]
+    if not any(fits):
+        raise SystemExit('{} lies outside {:g} to {:g} ohms, '
+                         'try --scale'.format(name, cal.rbeg, cal.rend))
+    first = fits.index(True)
+    last = len(fits) - 1 - fits[::-1].index(True)
+    if not all(fits[first:last + 1]):
+        raise SystemExit(name + ' leaves the calibrated range mid-grid')
+    temps = temps[first:last + 1]
+    table = Curve()
+    table.serno = cal.serno
+    table.resno = cal.resno
+    table.name = name
+    table.tbeg = temps[0]
+    table.tend = temps[-1]
+    table.tstep = tstep
+    table.allocate(len(temps))
+    for k, t in enumerate(temps):
+        table.set_row(k, solver.solve(ohms(t)))
+    return table
+
+
+def write_curve(table, fname):
+    crc = binascii.crc32(table.recs) & 0xffffffff
+    with open(fname, 'wb') as fout:
+        fout.write(table.header(crc))
+        fout.write(table.recs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('cal', help='calibration table of the resistor')
+    parser.add_argument('--slot', type=int, default=0,
+                        help='curve number, 0 to 9, selected by C<n>=slot')
+    parser.add_argument('-o', '--output', help='output file name')
+    parser.add_argument('--name', help='curve name, 12 characters at most')
+    parser.add_argument('--tbeg', type=float, default=-40.0,
+                        help='lowest temperature, C')
+    parser.add_argument('--tend', type=float, default=150.0,
+                        help='highest temperature, C')
+    parser.add_argument('--tstep', type=float, default=0.1,
+                        help='temperature step, C')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplies the sensor resistance')
+    parser.add_argument('--budget', type=int, default=100000,
+                        help='solver time budget per point, us')
+    curves = parser.add_subparsers(dest='curve', required=True)
+    ntc = curves.add_parser('ntc', help='NTC, beta equation')
+    ntc.add_argument('--r0', type=float, default=10000.0,
+                     help='resistance at t0, ohms')
+    ntc.add_argument('--t0', type=float, default=25.0, help='C')
+    ntc.add_argument('--beta', type=float, default=3950.0, help='K')
+    sh = curves.add_parser('sh', help='NTC, Steinhart-Hart equation')
+    sh.add_argument('a', type=float)
+    sh.add_argument('b', type=float)
+    sh.add_argument('c', type=float)
+    rtd = curves.add_parser('pt100', help='platinum RTD, Callendar-Van Dusen')
+    rtd.add_argument('--r0', type=float, default=100.0,
+                     help='resistance at 0 C, ohms, 1000 for a PT1000')
+    args = parser.parse_args()
+
+    if args.curve == 'ntc':
+        ohms = ntc_beta(args.r0, args.t0, args.beta)
+        name = 'NTC{:g}'.format(args.r0)
+    elif args.curve == 'sh':
+        ohms = steinhart_hart(args.a, args.b, args.c)
+        name = 'NTC-SH'
+    else:
+        ohms = callendar_van_dusen(args.r0)
+        name = 'PT{:g}'.format(args.r0)
+    name = (args.name or name)[:12]
+    scaled = lambda t: ohms(t) * args.scale
+
+    cal = Inverse(args.cal)
+    if not cal.initialized:
+        raise SystemExit('cannot load calibration table: ' + args.cal)
+    table = build(cal, scaled, name, args.tbeg, args.tend, args.tstep,
+                  args.budget)
+    fname = args.output or os.path.join(
+        os.path.dirname(args.cal),
+        'curve{}-r{}.bin'.format(args.slot, cal.resno.lstrip('R')))
+    write_curve(table, fname)
+    # read it back, and report the worst error in ohms
+    check = Curve(fname)
+    if not check.initialized or check.recs != table.recs:
+        raise SystemExit('verification failed: ' + fname)
+    worst = max(abs(check.row(k).rerr) for k in range(check.npts))
+    print('{} -> {}  {} {:g} to {:g} C by {:g}, {} points, {} bytes, '
+          'worst error {:.3f} ohms'.format(
+              name, fname, cal.resno, check.tbeg, check.tend, check.tstep,
+              check.npts, os.path.getsize(fname), worst))
+
+
+if __name__ == '__main__':
+    main()
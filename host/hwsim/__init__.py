@@ -0,0 +1,28 @@
+""" CPython stand-ins for the MicroPython modules the flash/ firmware
+needs, and models of the TraceR hardware behind them, so firmware code
+runs and can be profiled on the host.
+
+    import hwsim
+    board = hwsim.install()     # machine, framebuf, utime, micropython,
+                                # uasyncio, uselect; flash/lib on sys.path
+    import tracer
+    tr = tracer.TraceR()
+    with board.profile.measure('send'):
+        tr.chain.send(force=True)
+    print(board.profile.report())
+    print(board.chain.wipers, board.oled.image())
+
+board.chain models the two AD8403s (digipots.py), board.oled the
+SSD1306 display RAM (oled.py) and board.console the USB serial console
+(usb.py).  Every SPI, I2C and USB transfer is counted on its bus, with
+the time it would take on the wire (bus.py).
+"""
+
+from .board import Board, Clock, FLASH, install
+from .bus import Bus, Counters, Profile
+from .digipots import AD8403Chain
+from .oled import SSD1306
+from .usb import USBConsole
+
+__all__ = ['AD8403Chain', 'Board', 'Bus', 'Clock', 'Counters', 'FLASH',
+           'Profile', 'SSD1306', 'USBConsole', 'install']
@@ -0,0 +1,123 @@
+""" Profiles the firmware's hot paths on the simulated TraceR.
+
+With --console, runs boot.py and main.py on the simulated USB console
+instead, typing command lines, each once the one before has been
+handled, or all in one go with --burst, REPEAT times over, and reports
+the host time and the USB writes, packets and bytes each line costs:
+a session of just "Q" is taken off a session of the lines and "Q", and
+the rest divided by the number of lines.
+
+    cd host && python3 -m hwsim [-n REPEAT] [--json]
+    cd host && python3 -m hwsim --console [LINE ...] [--burst]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from . import install, FLASH
+
+CONSOLE_LINES = ['X1=10', 'R1=100', 'R2=50.5;R1?', '', 'K1=1', 'X1?']
+
+
+def profile(board, repeat):
+    os.chdir(FLASH)  # for data/, as on the device
+    import tracer
+    from inverse import Inverse
+
+    measure = board.profile.measure
+    tr = tracer.TraceR()
+    cal = Inverse('data/invert-sn0-r1-cal.bin')
+    with measure('Digichain.tune'):
+        tr.chain.tune()
+    for k in range(repeat):
+        with measure('Digichain.send one chan'):
+            tr.r1.counts(k & 0xff, channels=[0])
+            tr.chain.send()
+        with measure('Digichain.send both pots'):
+            tr.r1.counts(k & 0xff)
+            tr.r2.counts(~k & 0xff)
+            tr.chain.send()
+        with measure('Digichain.send unchanged'):
+            tr.chain.send()
+        with measure('Inverse.lookup'):
+            regs = cal.lookup(13 + k % 263)
+        with measure('display counts frame'):
+            tr.display_counts_update()
+            tr.render(force=True)
+        with measure('display ohms frame'):
+            tr.r1.cal = regs
+            tr.display_ohms_update()
+            tr.render(force=True)
+        with measure('render, nothing new'):
+            tr.render(force=True)
+    return tr
+
+
+def session(board, lines, burst=False):
+    """Runs boot.py and main.py, typing lines then Q.  Returns the host
+    time in us and the USB (writes, packets, bytes) of the session."""
+    os.chdir(FLASH)
+    console = board.console
+    script = [line + '\n' for line in lines + ['Q']]
+    for data in [''.join(script)] if burst else script:
+        console.feed(data)
+    writes, before = console.nwrites, board.usb.snapshot()
+    scope = {'__name__': '__main__'}
+    t0 = time.perf_counter()
+    with console.attach():
+        for name in ('boot.py', 'main.py'):
+            with open(name) as fin:
+                exec(compile(fin.read(), name, 'exec'), scope)
+    wall_us = (time.perf_counter() - t0) * 1e6
+    used = board.usb.snapshot() - before
+    return (wall_us, console.nwrites - writes, used.ntransactions,
+            used.nbytes)
+
+
+def console_report(board, lines, repeat, burst):
+    session(board, [], burst)  # imports and compiles, not counted
+    base = session(board, [], burst)
+    full = session(board, lines * repeat, burst)
+    print('{} command lines{}, {} times: {}'.format(
+        len(lines), ' in one burst' if burst else '', repeat,
+        ', '.join(repr(line) for line in lines)))
+    lines = lines * repeat
+    print('{:>10} {:>8} {:>8} {:>8}  per line'.format(
+        'host us', 'writes', 'packets', 'bytes'))
+    print('{:>10.1f} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+        *((f - b) / len(lines) for f, b in zip(full, base))))
+    print(board.console.take().decode()[-200:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=100,
+                        help='times to run each operation')
+    parser.add_argument('--json', action='store_true',
+                        help='print the profile as JSON')
+    parser.add_argument('--console', nargs='*', metavar='LINE',
+                        help='USB cost of command lines typed at main.py')
+    parser.add_argument('--burst', action='store_true',
+                        help='send the --console lines all at once')
+    args = parser.parse_args()
+    board = install()
+    try:
+        if args.console is not None:
+            console_report(board, args.console or CONSOLE_LINES,
+                           args.repeat, args.burst)
+            return
+        profile(board, args.repeat)
+    finally:
+        board.close()
+    if args.json:
+        print(json.dumps(board.profile.as_dict(), indent=2))
+    else:
+        print(board.profile.report())
+        print('wipers', board.chain.wipers)
+        print(board.oled.image())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+""" The simulated Tiny 2040 and what is wired to it on the TraceR.
+
+Board holds the state behind the stand-in modules: pin levels and
+their listeners, the SPI and I2C buses with the devices on them, the
+USB serial console, and the clock.  install() makes a Board current
+and puts the stand-ins in sys.modules, so firmware imports them as
+machine, utime and so on.
+"""
+
+import os
+import sys
+import time
+
+from .bus import Bus, Profile
+from .digipots import AD8403Chain
+from .oled import SSD1306
+from .usb import USBConsole
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FLASH = os.path.normpath(os.path.join(HERE, '..', '..', 'flash'))
+
+# TraceR wiring, see flash/lib/ad8403.py and tracer.py
+PIN_CS = 5
+PIN_RST = 26
+PIN_SHDN = 27
+OLED_ADDR = 0x3c
+
+# USB full speed, and roughly the token, handshake and framing bits
+# around each bulk data packet
+USB_RATE = 12_000_000
+USB_OVERHEAD_BITS = 100
+
+current = None
+
+
+class Clock:
+    """ticks for utime.  Unless realtime, sleeps return at once and
+    only move the clock on, so firmware delays cost no host time."""
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.skipped_us = 0
+
+    def now_us(self):
+        return int(time.perf_counter() * 1e6) + self.skipped_us
+
+    def sleep_us(self, us):
+        if us <= 0:
+            return
+        if self.realtime:
+            time.sleep(us / 1e6)
+        else:
+            self.skipped_us += int(us)
+
+
+class Board:
+    def __init__(self, realtime=False, spi_rate=100_000, i2c_rate=400_000):
+        self.clock = Clock(realtime)
+        self.levels = {}
+        self.listeners = {}
+        self.irqs = {}
+        self.timers = []
+        # I2C bytes take 9 clocks with the acknowledge, each transaction
+        # adds start, the address byte and stop
+        self.spi = {0: Bus('spi0', spi_rate), 1: Bus('spi1', spi_rate)}
+        self.i2c = {0: Bus('i2c0', i2c_rate, 9, 11),
+                    1: Bus('i2c1', i2c_rate, 9, 11)}
+        self.spi_devices = {}
+        self.i2c_devices = {}
+        self.usb = Bus('usb', USB_RATE, 8, USB_OVERHEAD_BITS)
+        self.profile = Profile({'spi0': self.spi[0], 'i2c0': self.i2c[0],
+                                'usb': self.usb})
+
+        self.chain = AD8403Chain()
+        self.spi_devices[0] = self.chain
+        self.watch(PIN_CS, self.chain.cs)
+        self.watch(PIN_RST, self.chain.reset)
+        self.watch(PIN_SHDN, self.chain.shutdown)
+        self.oled = SSD1306()
+        self.i2c_devices[(0, OLED_ADDR)] = self.oled
+        self.console = USBConsole(self.usb)
+
+    def watch(self, pin, listener):
+        """Calls listener(level) whenever pin changes."""
+        self.listeners.setdefault(pin, []).append(listener)
+
+    def level(self, pin):
+        return self.levels.get(pin, 0)
+
+    def drive(self, pin, level):
+        """Sets pin, from firmware or from outside, e.g. a trigger."""
+        level = int(bool(level))
+        old = self.levels.get(pin)
+        self.levels[pin] = level
+        if old == level:
+            return
+        for listener in self.listeners.get(pin, ()):
+            listener(level)
+        irq = self.irqs.get(pin)
+        if irq is not None and old is not None:
+            handler, trigger, obj = irq
+            if trigger & (8 if level else 4):  # IRQ_RISING, IRQ_FALLING
+                handler(obj)
+
+    def close(self):
+        """Stops any running timers."""
+        for timer in self.timers:
+            timer.deinit()
+
+
+def install(board=None, lib=True):
+    """Makes board (a new one by default) current, and the stand-ins
+    importable as machine, framebuf, utime, micropython, uasyncio and
+    uselect.  board.console.attach() stands in for sys.stdin/stdout.
+    With lib, flash/lib goes on sys.path too.  Returns the board."""
+    global current
+    current = board if board is not None else Board()
+    from . import framebuf, machine, micropython, uasyncio, uselect, utime
+    sys.modules.update({'machine': machine, 'framebuf': framebuf,
+                        'utime': utime, 'micropython': micropython,
+                        'uasyncio': uasyncio, 'uselect': uselect})
+    libdir = os.path.join(FLASH, 'lib')
+    if lib and libdir not in sys.path:
+        sys.path.insert(0, libdir)
+    return current
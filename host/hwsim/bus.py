@@ -0,0 +1,138 @@
+""" Bus accounting: bytes, transactions and modelled wire time.
+
+Every stand-in bus (SPI, I2C, USB) owns a Bus, which each transfer adds to.
+The wire time is modelled from the clock rate, the bits each byte takes
+on the wire (9 for I2C, with its acknowledge bit) and a fixed overhead
+per transaction (address byte, start and stop conditions).  It is the
+time the bus would be busy on the Tiny 2040, independent of how fast
+the host runs the firmware code.
+
+Profile.measure() attributes the change in every bus's counters, and
+the host wall time, to a named operation:
+
+    with board.profile.measure('send'):
+        tr.chain.send()
+    print(board.profile.report())
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class Counters:
+    """Totals for one bus, or the difference of two snapshots."""
+
+    __slots__ = ('nbytes', 'ntransactions', 'time_us')
+
+    def __init__(self, nbytes=0, ntransactions=0, time_us=0.0):
+        self.nbytes = nbytes
+        self.ntransactions = ntransactions
+        self.time_us = time_us
+
+    def copy(self):
+        return Counters(self.nbytes, self.ntransactions, self.time_us)
+
+    def __sub__(self, other):
+        return Counters(self.nbytes - other.nbytes,
+                        self.ntransactions - other.ntransactions,
+                        self.time_us - other.time_us)
+
+    def __iadd__(self, other):
+        self.nbytes += other.nbytes
+        self.ntransactions += other.ntransactions
+        self.time_us += other.time_us
+        return self
+
+    def as_dict(self):
+        return {'bytes': self.nbytes, 'transactions': self.ntransactions,
+                'time_us': round(self.time_us, 3)}
+
+    def __repr__(self):
+        return 'Counters(bytes={}, transactions={}, time_us={:.1f})'.format(
+            self.nbytes, self.ntransactions, self.time_us)
+
+
+class Bus:
+    """One serial bus, clocked at rate bits per second."""
+
+    def __init__(self, name, rate, bits_per_byte=8, overhead_bits=0):
+        self.name = name
+        self.rate = rate
+        self.bits_per_byte = bits_per_byte
+        self.overhead_bits = overhead_bits
+        self.counters = Counters()
+
+    def transfer(self, nbytes):
+        """Accounts for one transaction of nbytes."""
+        bits = nbytes * self.bits_per_byte + self.overhead_bits
+        self.counters.nbytes += nbytes
+        self.counters.ntransactions += 1
+        self.counters.time_us += bits * 1e6 / self.rate
+
+    def snapshot(self):
+        return self.counters.copy()
+
+
+class Entry:
+    """Accumulated usage of one profiled operation."""
+
+    def __init__(self, buses):
+        self.calls = 0
+        self.wall_us = 0.0
+        self.buses = {name: Counters() for name in buses}
+
+    def as_dict(self):
+        return {'calls': self.calls, 'wall_us': round(self.wall_us, 3),
+                'buses': {name: c.as_dict() for name, c in self.buses.items()}}
+
+
+class Profile:
+    """Per operation usage of a set of buses, see measure()."""
+
+    def __init__(self, buses):
+        self.buses = buses  # name -> Bus
+        self.entries = {}
+
+    @contextmanager
+    def measure(self, label):
+        """Adds the bus usage and wall time of the block to label."""
+        before = {name: bus.snapshot() for name, bus in self.buses.items()}
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_us = (time.perf_counter() - t0) * 1e6
+            entry = self.entries.get(label)
+            if entry is None:
+                entry = self.entries[label] = Entry(self.buses)
+            entry.calls += 1
+            entry.wall_us += wall_us
+            for name, bus in self.buses.items():
+                entry.buses.setdefault(name, Counters())
+                entry.buses[name] += bus.snapshot() - before[name]
+
+    def clear(self):
+        self.entries = {}
+
+    def as_dict(self):
+        return {label: entry.as_dict()
+                for label, entry in self.entries.items()}
+
+    def report(self):
+        """A text table, per call averages of each operation."""
+        names = list(self.buses)
+        head = '{:<24} {:>6} {:>10}'.format('operation', 'calls', 'host us')
+        for name in names:
+            head += ' {:>8} {:>6} {:>9}'.format(name + ' B', 'xfers',
+                                               'bus us')
+        lines = [head]
+        for label, entry in self.entries.items():
+            n = entry.calls
+            line = '{:<24} {:>6} {:>10.1f}'.format(label, n,
+                                                   entry.wall_us / n)
+            for name in names:
+                c = entry.buses.get(name, Counters())
+                line += ' {:>8.1f} {:>6.1f} {:>9.1f}'.format(
+                    c.nbytes / n, c.ntransactions / n, c.time_us / n)
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,87 @@
+""" Behavioural model of AD8403 digital potentiometers in a daisy chain.
+
+Each AD8403 has a 10-bit serial register: two address bits choosing one
+of its four channels, then eight data bits, most significant first.
+Data clocks into the first chip's SDI and out of its SDO into the next
+chip, so the chain is one shift register of 10 bits per chip, and the
+last SDO is wired back to MISO.  Whatever a transfer shifts in pushes
+the previous contents out, which is how flash/lib/ad8403.py checks its
+frames.  While /CS is high the chips ignore the clock and SDO floats,
+so MISO reads the pull-up.  The rising edge of /CS latches each chip's
+register into the wiper of the channel it addresses.  /RS low sets
+every wiper to midscale, /SHDN low shuts the chips down.
+
+Chip 0 is the one farthest along the chain, its bits go out first, the
+order of Digichain.frame().  Above max_rate the model corrupts what it
+shifts back, so Digichain.tune() has a limit to find.
+"""
+
+MIDSCALE = 0x80
+
+
+class AD8403Chain:
+    def __init__(self, npots=2, nchans=4, rtotal=1000.0, rwiper=50.0,
+                 max_rate=10_000_000):
+        self.npots = npots
+        self.nchans = nchans
+        self.rtotal = rtotal
+        self.rwiper = rwiper
+        self.max_rate = max_rate
+        self.nbits = 10 * npots
+        self.mask = (1 << self.nbits) - 1
+        self.register = 0
+        self.wipers = [[MIDSCALE] * nchans for _ in range(npots)]
+        self.selected = False   # /CS low
+        self.shut_down = False
+        self.nlatches = 0       # /CS rising edges
+        self.nwrites = 0        # wiper registers written by them
+        self.nbits_shifted = 0
+
+    # pin listeners, given the new level of each line
+    def cs(self, level):
+        if self.selected and level:
+            self.latch()
+        self.selected = not level
+
+    def reset(self, level):
+        if not level:
+            for wipers in self.wipers:
+                wipers[:] = [MIDSCALE] * self.nchans
+
+    def shutdown(self, level):
+        self.shut_down = not level
+
+    def latch(self):
+        self.nlatches += 1
+        for pot in range(self.npots):
+            word = (self.register >> (10 * (self.npots - 1 - pot))) & 0x3ff
+            chan = (word >> 8) & 0x3
+            if chan < self.nchans:
+                self.wipers[pot][chan] = word & 0xff
+                self.nwrites += 1
+
+    def exchange(self, tx, rate):
+        """Shifts tx through the chain, returns what came out on MISO."""
+        if not self.selected:
+            return bytes([0xff] * len(tx))
+        rx = bytearray(len(tx))
+        reg = self.register
+        top = self.nbits - 1
+        for i, byte in enumerate(tx):
+            out = 0
+            for k in range(7, -1, -1):
+                out = (out << 1) | ((reg >> top) & 1)
+                reg = ((reg << 1) | ((byte >> k) & 1)) & self.mask
+            rx[i] = out
+        self.register = reg
+        self.nbits_shifted += 8 * len(tx)
+        if rate > self.max_rate and rx:
+            rx[0] ^= 0x10  # setup time violated on the way back
+        return bytes(rx)
+
+    def ohms(self, pot):
+        """Resistance of pot's channels in parallel, as Digipot.ohms()."""
+        g = 0.0
+        for count in self.wipers[pot]:
+            g += 1.0 / (self.rwiper + self.rtotal * count / 256)
+        return 1.0 / g
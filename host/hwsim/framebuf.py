@@ -0,0 +1,116 @@
+""" Stand-in for MicroPython's framebuf, MONO_VLSB only, the format of
+the SSD1306: each byte is a column of 8 pixels, bit 0 at the top.
+
+text() does not have MicroPython's font.  It draws each character as
+a fixed pattern of dots derived from its code, in the same 8x8 cell,
+so it sets a similar number of pixels in the same places, but the
+result is not readable.
+"""
+
+MONO_VLSB = 0
+RGB565 = 1
+GS4_HMSB = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+GS2_HMSB = 5
+GS8 = 6
+
+
+def _glyph(code):
+    if code == 0x20:
+        return 0
+    # a 7x7 dot pattern in the 8x8 cell, blank last row and column
+    return (code * 0x9e3779b97f4a7c15) & 0x7f7f7f7f7f7f7f
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format != MONO_VLSB:
+            raise ValueError('only MONO_VLSB is simulated')
+        self._buf = buffer
+        self._width = width
+        self._height = height
+        self._stride = width if stride is None else stride
+
+    def _index(self, x, y):
+        return (y >> 3) * self._stride + x
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return None
+        i = self._index(x, y)
+        mask = 1 << (y & 7)
+        if c is None:
+            return 1 if self._buf[i] & mask else 0
+        if c:
+            self._buf[i] |= mask
+        else:
+            self._buf[i] &= ~mask & 0xff
+
+    def fill(self, c):
+        n = ((self._height + 7) >> 3) * self._stride
+        self._buf[:n] = bytes([0xff if c else 0x00]) * n
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(0, y), min(self._height, y + h)):
+            for xx in range(max(0, x), min(self._width, x + w)):
+                self.pixel(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                return
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def text(self, s, x, y, c=1):
+        for k, ch in enumerate(s):
+            bits = _glyph(ord(ch))
+            for dx in range(8):
+                column = (bits >> (8 * dx)) & 0xff
+                for dy in range(8):
+                    if column >> dy & 1:
+                        self.pixel(x + 8 * k + dx, y + dy, c)
+
+    def scroll(self, xstep, ystep):
+        old = FrameBuffer(bytearray(self._buf), self._width, self._height,
+                          MONO_VLSB, self._stride)
+        for y in range(self._height):
+            for x in range(self._width):
+                sx = x - xstep
+                sy = y - ystep
+                if 0 <= sx < self._width and 0 <= sy < self._height:
+                    self.pixel(x, y, old.pixel(sx, sy))
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        for sy in range(fbuf._height):
+            for sx in range(fbuf._width):
+                c = fbuf.pixel(sx, sy)
+                if c != key:
+                    self.pixel(x + sx, y + sy, c)
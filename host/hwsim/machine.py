@@ -0,0 +1,247 @@
+""" Stand-in for MicroPython's machine module, on the current Board.
+
+Pins with the same id share their level, as on the device.  SPI and
+I2C transfers go to the devices attached to the bus and are accounted
+for on its Bus.  Timers run their callbacks on a host thread.
+"""
+
+import sys
+import threading
+import time
+import traceback
+
+from . import board as _board
+
+
+def _current():
+    if _board.current is None:
+        raise RuntimeError('hwsim.install() has not been called')
+    return _board.current
+
+
+def freq():
+    return 125_000_000
+
+
+def unique_id():
+    return b'\xe6\x60\x58\x38\x83\x1a\x2b\x30'
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def idle():
+    pass
+
+
+def lightsleep(ms=0):
+    _current().clock.sleep_us(ms * 1000)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.board = _current()
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if pull == Pin.PULL_UP and self.id not in self.board.levels:
+            self.board.drive(self.id, 1)
+        if value is not None:
+            self.board.drive(self.id, value)
+
+    def value(self, v=None):
+        if v is None:
+            return self.board.level(self.id)
+        self.board.drive(self.id, v)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def low(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def toggle(self):
+        self.value(1 - self.value())
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, **kwargs):
+        if handler is None:
+            self.board.irqs.pop(self.id, None)
+        else:
+            self.board.irqs[self.id] = (handler, trigger, self)
+
+    def __repr__(self):
+        return 'Pin({})'.format(self.id)
+
+
+class Signal:
+    def __init__(self, pin, invert=False):
+        self.pin = pin
+        self.invert = invert
+
+    def value(self, v=None):
+        if v is None:
+            return self.pin.value() ^ self.invert
+        self.pin.value(int(bool(v)) ^ self.invert)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, id, baudrate=1_000_000, **kwargs):
+        self.id = id
+        self.board = _current()
+        self.bus = self.board.spi[id]
+        self.init(baudrate=baudrate, **kwargs)
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate is not None:
+            self.baudrate = baudrate
+            self.bus.rate = baudrate
+
+    def deinit(self):
+        pass
+
+    def _exchange(self, tx):
+        self.bus.transfer(len(tx))
+        device = self.board.spi_devices.get(self.id)
+        if device is None:
+            return bytes([0xff] * len(tx))
+        return device.exchange(bytes(tx), self.baudrate)
+
+    def write(self, buf):
+        self._exchange(buf)
+
+    def read(self, nbytes, write=0x00):
+        return self._exchange(bytes([write] * nbytes))
+
+    def readinto(self, buf, write=0x00):
+        buf[:] = self._exchange(bytes([write] * len(buf)))
+
+    def write_readinto(self, write_buf, read_buf):
+        if len(write_buf) != len(read_buf):
+            raise ValueError('buffers must be the same length')
+        read_buf[:] = self._exchange(write_buf)
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400_000, **kwargs):
+        self.id = id
+        self.board = _current()
+        self.bus = self.board.i2c[id]
+        self.bus.rate = freq
+
+    def _device(self, addr):
+        device = self.board.i2c_devices.get((self.id, addr))
+        if device is None:
+            self.bus.transfer(0)  # the address byte is not acknowledged
+            raise OSError(5, 'EIO')
+        return device
+
+    def scan(self):
+        return sorted(addr for bus, addr in self.board.i2c_devices
+                      if bus == self.id)
+
+    def writeto(self, addr, buf, stop=True):
+        device = self._device(addr)
+        self.bus.transfer(len(buf))
+        device.write(bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        device = self._device(addr)
+        data = b''.join(bytes(buf) for buf in vector)
+        self.bus.transfer(len(data))
+        device.write(data)
+        return len(data)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        self._device(addr)
+        self.bus.transfer(nbytes)
+        return bytes(nbytes)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self.readfrom(addr, len(buf), stop)
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.board = _current()
+        self.board.timers.append(self)
+        self.thread = None
+        self.running = False
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, freq=None, period=None, callback=None,
+             tick_hz=1000):
+        self.deinit()
+        if freq is not None:
+            interval = 1.0 / freq
+        else:
+            interval = period / tick_hz
+        self.running = True
+        self.thread = threading.Thread(
+            target=self._run, args=(mode, interval, callback), daemon=True)
+        self.thread.start()
+
+    def _run(self, mode, interval, callback):
+        due = time.perf_counter()
+        while self.running:
+            due += interval
+            time.sleep(max(0.0, due - time.perf_counter()))
+            if not self.running:
+                return
+            try:
+                callback(self)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                self.running = False
+            if mode == Timer.ONE_SHOT:
+                self.running = False
+
+    def deinit(self):
+        self.running = False
+        thread = self.thread
+        self.thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
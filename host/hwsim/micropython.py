@@ -0,0 +1,40 @@
+""" Stand-in for MicroPython's micropython module. """
+
+
+def const(expr):
+    return expr
+
+
+def native(func):
+    return func
+
+
+viper = native
+
+
+def kbd_intr(chr):
+    """Ignored, the host's Ctrl-C handling is its own."""
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(func, arg):
+    func(arg)
+
+
+def opt_level(level=None):
+    return 0 if level is None else None
+
+
+def mem_info(verbose=False):
+    print('mem: not available in the simulator')
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
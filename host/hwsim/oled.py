@@ -0,0 +1,100 @@
+""" SSD1306 display RAM model, decoding the I2C stream of ssd1306.py.
+
+Each I2C write starts with control bytes: Co=1 means one command byte
+follows and then another control byte, Co=0 means the rest of the write
+is commands (D/C#=0) or display data (D/C#=1).  Commands are decoded
+with their argument bytes; column and page addressing and horizontal
+addressing mode are modelled, which is all ssd1306.py uses to write
+data.  The display RAM is the controller's 128 columns by 8 pages, the
+panel shows a window of it, see image().
+"""
+
+# command byte -> number of argument bytes that follow it
+ARGS = {0x20: 1, 0x21: 2, 0x22: 2, 0x81: 1, 0x8d: 1, 0xa8: 1, 0xd3: 1,
+        0xd5: 1, 0xd9: 1, 0xda: 1, 0xdb: 1}
+
+
+class SSD1306:
+    COLUMNS = 128
+    PAGES = 8
+
+    def __init__(self):
+        self.ram = bytearray(self.COLUMNS * self.PAGES)
+        self.columns = (0, self.COLUMNS - 1)
+        self.page_range = (0, self.PAGES - 1)
+        self.col = 0
+        self.page = 0
+        self.on = False
+        self.contrast = 0x7f
+        self.inverted = False
+        self.pending = None     # command waiting for its arguments
+        self.ncommands = 0
+        self.ndata = 0
+
+    def write(self, data):
+        """One I2C write transaction addressed to the display."""
+        i = 0
+        while i < len(data):
+            control = data[i]
+            i += 1
+            if control & 0x80:  # Co=1, a single byte then more control
+                if i < len(data):
+                    self.byte(control, data[i])
+                i += 1
+                continue
+            for byte in data[i:]:
+                self.byte(control, byte)
+            return
+
+    def byte(self, control, byte):
+        if control & 0x40:
+            self.data(byte)
+        else:
+            self.command(byte)
+
+    def command(self, byte):
+        self.ncommands += 1
+        if self.pending is not None:
+            self.pending[1].append(byte)
+            op, args = self.pending
+            if len(args) < ARGS[op]:
+                return
+            self.pending = None
+            if op == 0x21:
+                self.columns = (args[0] & 0x7f, args[1] & 0x7f)
+                self.col = self.columns[0]
+            elif op == 0x22:
+                self.page_range = (args[0] & 0x7, args[1] & 0x7)
+                self.page = self.page_range[0]
+            elif op == 0x81:
+                self.contrast = args[0]
+            return
+        if byte in ARGS:
+            self.pending = (byte, [])
+        elif byte in (0xae, 0xaf):
+            self.on = byte == 0xaf
+        elif byte in (0xa6, 0xa7):
+            self.inverted = byte == 0xa7
+
+    def data(self, byte):
+        self.ndata += 1
+        self.ram[self.page * self.COLUMNS + self.col] = byte
+        if self.col < self.columns[1]:
+            self.col += 1
+            return
+        self.col = self.columns[0]
+        if self.page < self.page_range[1]:
+            self.page += 1
+        else:
+            self.page = self.page_range[0]
+
+    def pixel(self, x, y):
+        return (self.ram[(y // 8) * self.COLUMNS + x] >> (y % 8)) & 1
+
+    def image(self, width=64, height=32, offset=32):
+        """The panel as text, one line per pixel row, '#' for lit.
+        The TraceR's 64x32 panel shows RAM columns 32 to 95."""
+        return '\n'.join(
+            ''.join('#' if self.pixel(offset + x, y) else '.'
+                    for x in range(width))
+            for y in range(height))
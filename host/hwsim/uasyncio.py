@@ -0,0 +1,33 @@
+""" Stand-in for MicroPython's uasyncio, on top of asyncio.
+
+StreamReader reads a file-like object, such as a StringIO of scripted
+console input, as uasyncio reads sys.stdin on the device.
+"""
+
+import asyncio
+from asyncio import (CancelledError, Event, Lock, TimeoutError, create_task,
+                     gather, get_event_loop, run, sleep, wait_for)
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+class StreamReader:
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def read(self, n=-1):
+        await asyncio.sleep(0)
+        return self.stream.read(n)
+
+    async def readexactly(self, n):
+        await asyncio.sleep(0)
+        data = self.stream.read(n)
+        if len(data) < n:
+            raise EOFError
+        return data
+
+    async def readline(self):
+        await asyncio.sleep(0)
+        return self.stream.readline()
@@ -0,0 +1,114 @@
+""" The Tiny 2040's USB CDC serial console, as sys.stdin and sys.stdout.
+
+Input is scripted: feed() queues what the host would send, and the
+firmware reads it as text, sys.stdin.read(), or raw bytes through
+sys.stdin.buffer.  Each feed() is one burst from the host: it arrives
+only once the firmware has read all of the one before, and tries to
+read more, as a host that waits for every reply would send it.
+Reading past the end of the script raises EOFError, there is nothing
+more to wait for.
+
+Output is kept, see take(), and accounted on the usb Bus the way the
+rp2 port sends it: each write call is pushed out at once, as bulk
+packets of up to 64 bytes, one transaction per packet.  Text writes
+are cooked as on the device, "\\n" goes out as "\\r\\n".
+"""
+
+import sys
+from collections import deque
+from contextlib import contextmanager
+
+PACKET = 64     # full speed bulk endpoint
+
+
+class RawStream:
+    """sys.stdin.buffer and sys.stdout.buffer, bytes uncooked."""
+
+    def __init__(self, console):
+        self.console = console
+
+    def any(self):
+        return self.console.any()
+
+    def read(self, n=-1):
+        return self.console.receive(n)
+
+    def readinto(self, buf, n=None):
+        n = len(buf) if n is None else n
+        data = self.console.receive(n)
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        data = bytes(data)
+        self.console.send(data)
+        return len(data)
+
+
+class USBConsole:
+    def __init__(self, bus):
+        self.bus = bus
+        self.input = bytearray()    # arrived, not read yet
+        self.script = deque()       # bursts still to come
+        self.output = bytearray()
+        self.buffer = RawStream(self)
+        self.nwrites = 0
+
+    def feed(self, data):
+        """Queues a burst of input, str or bytes, from the host."""
+        self.script.append(data.encode() if isinstance(data, str)
+                           else bytes(data))
+
+    def any(self):
+        """Bytes waiting to be read, for the uselect stand-in."""
+        return len(self.input)
+
+    def receive(self, n):
+        if not self.input:
+            if not self.script:
+                raise EOFError('end of the scripted console input')
+            self.input += self.script.popleft()
+        n = len(self.input) if n is None or n < 0 else n
+        data = bytes(self.input[:n])
+        del self.input[:n]
+        return data
+
+    def send(self, data):
+        if not data:
+            return
+        self.output += data
+        self.nwrites += 1
+        for first in range(0, len(data), PACKET):
+            self.bus.transfer(min(PACKET, len(data) - first))
+
+    def read(self, n=-1):
+        return self.receive(n).decode()
+
+    def readline(self):
+        if not self.input and self.script:
+            self.input += self.script.popleft()
+        end = self.input.find(b'\n')
+        return self.read(len(self.input) if end < 0 else end + 1)
+
+    def write(self, text):
+        self.send(text.replace('\n', '\r\n').encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Returns the output so far, as bytes, and forgets it."""
+        data = bytes(self.output)
+        self.output.clear()
+        return data
+
+    @contextmanager
+    def attach(self):
+        """Makes this console sys.stdin and sys.stdout for the block."""
+        saved = sys.stdin, sys.stdout
+        sys.stdin = sys.stdout = self
+        try:
+            yield self
+        finally:
+            sys.stdin, sys.stdout = saved
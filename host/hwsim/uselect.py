@@ -0,0 +1,48 @@
+""" Stand-in for MicroPython's uselect, polling the simulated console.
+
+An object is readable when its any() method, as on the USB console,
+returns nonzero.  Polls never wait: scripted input cannot arrive in the
+meantime, so a poll with a timeout returns what is ready at once.
+"""
+
+POLLIN = 0x0001
+POLLOUT = 0x0004
+POLLERR = 0x0008
+POLLHUP = 0x0010
+
+
+class Poll:
+    def __init__(self):
+        self.registered = []    # (obj, eventmask)
+
+    def register(self, obj, eventmask=POLLIN | POLLOUT):
+        self.unregister(obj)
+        self.registered.append((obj, eventmask))
+
+    def modify(self, obj, eventmask):
+        self.register(obj, eventmask)
+
+    def unregister(self, obj):
+        self.registered = [(o, m) for o, m in self.registered
+                           if o is not obj]
+
+    def poll(self, timeout=-1):
+        ready = []
+        for obj, eventmask in self.registered:
+            events = eventmask & POLLOUT
+            if eventmask & POLLIN and obj.any():
+                events |= POLLIN
+            if events:
+                ready.append((obj, events))
+        return ready
+
+    def ipoll(self, timeout=-1, flags=0):
+        return iter(self.poll(timeout))
+
+
+def poll():
+    return Poll()
+
+
+def select(rlist, wlist, xlist, timeout=None):
+    return [obj for obj in rlist if obj.any()], list(wlist), []
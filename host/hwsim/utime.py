@@ -0,0 +1,64 @@
+""" Stand-in for MicroPython's utime, on the current Board's clock.
+
+ticks wrap around at 2**30, as MicroPython's do, so firmware that
+compares them without ticks_diff() goes wrong here too.
+"""
+
+import time as _time
+
+from . import board as _board
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def _clock():
+    if _board.current is None:
+        raise RuntimeError('hwsim.install() has not been called')
+    return _board.current.clock
+
+
+def ticks_us():
+    return _clock().now_us() & TICKS_MAX
+
+
+def ticks_ms():
+    return (_clock().now_us() // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & TICKS_MAX
+    return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def sleep_us(us):
+    _clock().sleep_us(us)
+
+
+def sleep_ms(ms):
+    _clock().sleep_us(ms * 1000)
+
+
+def sleep(seconds):
+    _clock().sleep_us(seconds * 1_000_000)
+
+
+def time():
+    return int(_time.time())
+
+
+def time_ns():
+    return _time.time_ns()
+
+
+def localtime(secs=None):
+    return _time.localtime(secs)[:8]
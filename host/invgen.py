@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+""" Generates TraceR inverse calibration tables from per-channel curves.
+
+Each TraceR resistor is one AD8403 with its four channels wired in
+parallel, so a setting is a quadruple of wiper counts and the resistance
+is 1 / (g0[c0] + g1[c1] + g2[c2] + g3[c3]), where gN is the conductance
+of channel N versus counts.  For every nominal resistance on the grid
+rbeg, rbeg+step, ... rend this tool finds the quadruple that comes
+closest, and writes the table in the text format read by
+flash/lib/inverse.py (optionally compiled to .bin, see calcompile.py).
+
+Rather than enumerating all 256^4 quadruples, the search is a
+meet-in-the-middle over channel pairs: the 65536 pair sums of channels
+0+1 are matched against the sorted pair sums of channels 2+3 with a
+binary search, all vectorized with NumPy.  When both channels of a pair
+have the same curve (always the case for modelled curves), the pair is
+symmetric and only c0 <= c1 needs to be considered, halving that side.
+
+Curves come either from a measurement file, one per resistor:
+
+    SN0     # serial number
+    R1      # resistor number
+    # counts, R_ch1, R_ch2, R_ch3, R_ch4
+    0       50.12   50.31   49.87   50.02
+    ...     (256 rows, counts 0 to 255)
+
+or from the same linear model as Digipot.ohms() (--model RTOTAL,RWIPER).
+Many resistors are processed in parallel, one per CPU core.
+
+    python3 host/invgen.py curves/*.tsv -o flash/data --bin
+    python3 host/invgen.py --model 1054,50 --serno SN9 --resno R1 R2
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+NCHANS = 4
+NCOUNTS = 256
+RMIN = 1e-3  # floor on channel resistance, keeps conductances finite
+
+
+def model_curves(rtotal, rwiper):
+    """Channel resistance vs counts, as calculated by Digipot.ohms()."""
+    counts = np.arange(NCOUNTS, dtype=np.float64)
+    curve = rwiper + rtotal * counts / NCOUNTS
+    return np.tile(curve, (NCHANS, 1))
+
+
+def load_curves(fname):
+    """Reads a measured curve file, returns (serno, resno, curves)."""
+    header = []
+    rows = []
+    with open(fname, 'r') as fin:
+        for line in fin:
+            row = line.strip().split('\t')
+            if not row[0] or row[0][0] == '#':
+                continue
+            if len(header) < 2:
+                header.append(row[0])
+            else:
+                rows.append([float(v) for v in row[:NCHANS + 1]])
+    table = np.array(rows)
+    if table.shape != (NCOUNTS, NCHANS + 1):
+        raise ValueError('{}: expected {} rows of counts and {} channels'
+                         .format(fname, NCOUNTS, NCHANS))
+    curves = np.empty((NCHANS, NCOUNTS))
+    curves[:, table[:, 0].astype(int)] = table[:, 1:].T
+    return header[0], header[1], curves
+
+
+def pair_sums(ga, gb):
+    """Conductance sums of two channels over all count pairs.
+
+    Returns (gsum, ca, cb), only ca <= cb if the channels are identical."""
+    ca, cb = np.meshgrid(np.arange(NCOUNTS), np.arange(NCOUNTS),
+                         indexing='ij')
+    ca = ca.ravel()
+    cb = cb.ravel()
+    if np.array_equal(ga, gb):
+        keep = ca <= cb
+        ca = ca[keep]
+        cb = cb[keep]
+    return ga[ca] + gb[cb], ca, cb
+
+
+def solve(curves, targets, chunk=4):
+    """Best count quadruple for each target resistance.
+
+    Returns (counts, ract), counts is a (len(targets), 4) array."""
+    g = 1.0 / np.maximum(curves, RMIN)
+    ga, a0, a1 = pair_sums(g[0], g[1])
+    gb, b2, b3 = pair_sums(g[2], g[3])
+    order = np.argsort(gb)
+    gb, b2, b3 = gb[order], b2[order], b3[order]
+    # sorted queries make the binary searches cache friendly
+    order = np.argsort(ga)
+    ga, a0, a1 = ga[order], a0[order], a1[order]
+
+    ntargets = len(targets)
+    counts = np.empty((ntargets, NCHANS), dtype=np.uint8)
+    ract = np.empty(ntargets)
+    last = len(gb) - 1
+    for beg in range(0, ntargets, chunk):
+        t = targets[beg:beg + chunk, None]
+        # only pairs a that some pair b can bring to 1/t are worth
+        # searching, plus one either side for unreachable targets
+        a_lo = np.searchsorted(ga, 1.0 / t.max() - gb[-1]) - 1
+        a_hi = np.searchsorted(ga, 1.0 / t.min() - gb[0], 'right') + 1
+        a_lo = max(a_lo, 0)
+        gw = ga[a_lo:a_hi]
+        # for each pair a, the best pair b brackets 1/t - ga
+        k = np.searchsorted(gb, 1.0 / t - gw)
+        lo = np.clip(k - 1, 0, last)
+        hi = np.clip(k, 0, last)
+        err_lo = np.abs(1.0 / (gw + gb[lo]) - t)
+        err_hi = np.abs(1.0 / (gw + gb[hi]) - t)
+        kb = np.where(err_lo <= err_hi, lo, hi)
+        ka = np.argmin(np.minimum(err_lo, err_hi), axis=1)
+        kb = kb[np.arange(len(ka)), ka]
+        ka += a_lo
+        end = beg + len(ka)
+        counts[beg:end] = np.stack((a0[ka], a1[ka], b2[kb], b3[kb]), axis=1)
+        ract[beg:end] = 1.0 / (ga[ka] + gb[kb])
+    return counts, ract
+
+
+def grid(curves, rbeg=None, rend=None, step=1.0):
+    """Target grid, defaulting to the whole whole-ohm achievable range."""
+    g = 1.0 / np.maximum(curves, RMIN)
+    if rbeg is None:
+        rbeg = math.ceil(1.0 / g.max(axis=1).sum())
+    if rend is None:
+        rend = math.floor(1.0 / g.min(axis=1).sum())
+    nres = int(round((rend - rbeg) / step)) + 1
+    return rbeg + step * np.arange(nres)
+
+
+def write_table(fname, serno, resno, targets, counts, ract):
+    """Writes a table in the text format read by Inverse.load()."""
+    with open(fname, 'w') as fout:
+        fout.write('{}\t# serial number\n'.format(serno))
+        fout.write('{}\t# resistor number\n'.format(resno))
+        fout.write('{:g}\t# minimum resistance value\n'.format(targets[0]))
+        fout.write('{:g}\t# maximum resistance value\n'.format(targets[-1]))
+        fout.write('{}\t# number of resistances\n'.format(len(targets)))
+        fout.write('# Rnominal, Registers[1-4], Ractual, Rerror\n')
+        for rnom, regs, r in zip(targets, counts, ract):
+            fout.write('{:.1f}\t{}\t{}\t{}\t{}\t{:.3f}\t{:+.3f}\n'.format(
+                rnom, *regs, r, rnom - r))
+
+
+def generate(job):
+    """Builds one resistor's table, run in a worker process."""
+    t0 = time.perf_counter()
+    if job['src'] is not None:
+        serno, resno, curves = load_curves(job['src'])
+    else:
+        serno, resno = job['serno'], job['resno']
+        curves = model_curves(*job['model'])
+    targets = grid(curves, job['rbeg'], job['rend'], job['step'])
+    counts, ract = solve(curves, targets)
+    fname = os.path.join(job['outdir'], 'invert-{}-{}-cal.dat'.format(
+        serno.lower(), resno.lower()))
+    write_table(fname, serno, resno, targets, counts, ract)
+    if job['bin']:
+        import calcompile
+        calcompile.compile_table(fname, rstep=job['step'])
+    worst = np.abs(targets - ract).max()
+    return fname, len(targets), worst, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('curves', nargs='*', help='measured curve file(s)')
+    parser.add_argument('--model', help='modelled curves, RTOTAL,RWIPER')
+    parser.add_argument('--serno', default='SN0', help='model serial number')
+    parser.add_argument('--resno', nargs='+', default=['R1', 'R2'],
+                        help='model resistor number(s)')
+    parser.add_argument('--rbeg', type=float, help='minimum resistance')
+    parser.add_argument('--rend', type=float, help='maximum resistance')
+    parser.add_argument('--step', type=float, default=1.0,
+                        help='table step, ohms')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='output directory')
+    parser.add_argument('--bin', action='store_true',
+                        help='also compile each table to .bin')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes')
+    args = parser.parse_args()
+
+    common = dict(rbeg=args.rbeg, rend=args.rend, step=args.step,
+                  outdir=args.outdir, bin=args.bin)
+    jobs = [dict(common, src=src) for src in args.curves]
+    if args.model:
+        model = tuple(float(v) for v in args.model.split(','))
+        jobs += [dict(common, src=None, serno=args.serno, resno=resno,
+                      model=model) for resno in args.resno]
+    if not jobs:
+        parser.error('give curve files and/or --model')
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for fname, nres, worst, dt in pool.map(generate, jobs):
+            print('{}  {} rows, worst error {:.3f} ohm, {:.2f} s'.format(
+                fname, nres, worst, dt))
+    print('{} tables in {:.2f} s'.format(len(jobs), time.perf_counter() - t0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+""" Rasterizes a TrueType font into the glyph file used by
+flash/lib/bigfont.py.
+
+Each glyph is thresholded to one bit per pixel and stored as MONO_VLSB
+columns, page by page, the same layout as the SSD1306 framebuffer, so
+the device draws a glyph with one slice copy per page.  Glyphs are
+cropped to their lit pixels plus one blank spacing column.  The point
+size is the largest one whose glyphs all fit in the requested height
+and that draws a sample line, by default "R1=275*", within the 64
+pixel width of the display.
+
+File layout (little endian):
+    header  '<4sBBB'  magic b'TRCF', version, height (px), nglyphs
+    table   '<BBH'    per glyph: character code, width, bitmap offset
+    bitmaps           per glyph: height/8 pages of width bytes
+
+    python3 host/mkfont.py SourceCodePro-Bold.ttf -o flash/data/font16.bin
+"""
+
+import argparse
+import os
+import struct
+import sys
+
+from PIL import Image, ImageDraw, ImageFont
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'flash', 'lib'))
+
+import bigfont
+
+CHARS = '0123456789.=*+-RXunk '
+
+
+def fit_font(ttf, height, width, chars, fit, threshold):
+    """Largest size of ttf whose glyphs all fit in height pixels,
+    and that draws fit in at most width pixels.
+    Returns {character: (pages, width)}."""
+    for size in range(height * 2, 4, -1):
+        font = ImageFont.truetype(ttf, size)
+        boxes = [font.getbbox(ch) for ch in chars if not ch.isspace()]
+        top = min(box[1] for box in boxes)
+        bottom = max(box[3] for box in boxes)
+        if bottom - top > height:
+            continue
+        glyphs = {ch: rasterize(font, top, ch, height, threshold)
+                  for ch in chars}
+        if sum(glyphs[ch][1] for ch in fit if ch in glyphs) <= width:
+            return glyphs
+    raise SystemExit('no size of {} fits {!r} in {}x{} pixels'.format(
+        ttf, fit, width, height))
+
+
+def rasterize(font, top, ch, height, threshold):
+    """Returns the glyph's MONO_VLSB pages, and its width."""
+    if ch.isspace():
+        width = max(2, height // 4)
+        return bytes(width * height // 8), width
+    left, _, right, _ = font.getbbox(ch)
+    img = Image.new('L', (right - left, height), 0)
+    ImageDraw.Draw(img).text((-left, -top), ch, font=font, fill=255)
+    px = img.load()
+    columns = []
+    for x in range(img.width):
+        column = 0
+        for y in range(height):
+            if px[x, y] >= threshold:
+                column |= 1 << y
+        columns.append(column)
+    # trim unlit columns, then add one blank spacing column
+    while len(columns) > 1 and not columns[0]:
+        columns.pop(0)
+    while len(columns) > 1 and not columns[-1]:
+        columns.pop()
+    columns.append(0)
+    width = len(columns)
+    pages = bytearray(width * height // 8)
+    for page in range(height // 8):
+        for x, column in enumerate(columns):
+            pages[page * width + x] = column >> (8 * page) & 0xff
+    return bytes(pages), width
+
+
+def make_font(ttf, height=16, width=64, chars=CHARS, fit='R1=275*',
+              threshold=128):
+    """Returns the glyph file contents."""
+    if height % 8:
+        raise SystemExit('height must be a multiple of 8')
+    glyphs = fit_font(ttf, height, width, chars, fit, threshold)
+    table = b''
+    bitmaps = b''
+    for ch in chars:
+        pages, width = glyphs[ch]
+        table += struct.pack(bigfont.GLYPH, ord(ch), width, len(bitmaps))
+        bitmaps += pages
+    header = struct.pack(bigfont.HEADER, bigfont.MAGIC, bigfont.VERSION,
+                         height, len(chars))
+    return header + table + bitmaps
+
+
+def preview(fname, text):
+    """Prints text as drawn from a glyph file, for checking."""
+    font = bigfont.Font(fname)
+    for row in range(font.height):
+        line = ''
+        for ch in text:
+            width, offset = font.glyphs[ch]
+            page, bit = divmod(row, 8)
+            for x in range(width):
+                byte = font.bitmaps[offset + page * width + x]
+                line += '#' if byte >> bit & 1 else '.'
+        print(line)
+    print('{} pixels wide'.format(font.width(text)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('ttf', help='TrueType font file')
+    parser.add_argument('-o', '--output', required=True,
+                        help='glyph file to write')
+    parser.add_argument('--height', type=int, default=16,
+                        help='glyph height in pixels, multiple of 8')
+    parser.add_argument('--width', type=int, default=64,
+                        help='width in pixels available to --fit')
+    parser.add_argument('--fit', default='R1=275*',
+                        help='widest line of text the font must fit')
+    parser.add_argument('--chars', default=CHARS, help='characters to include')
+    parser.add_argument('--threshold', type=int, default=128,
+                        help='gray level that lights a pixel, 0-255')
+    parser.add_argument('--preview', default='R1=275*',
+                        help='text to preview after writing')
+    args = parser.parse_args()
+    data = make_font(args.ttf, args.height, args.width, args.chars,
+                     args.fit, args.threshold)
+    with open(args.output, 'wb') as fout:
+        fout.write(data)
+    print('{}: {} glyphs, {} bytes'.format(
+        args.output, len(args.chars), len(data)))
+    if args.preview:
+        preview(args.output, args.preview)
+
+
+if __name__ == '__main__':
+    main()
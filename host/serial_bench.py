@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+""" Latency and throughput benchmarks of the TraceR's USB serial link.
+
+The successor of test-echo.py.  Each mode sweeps its cases and reports
+p50, p95 and p99 latency, operations per second and bytes per second:
+
+    echo      round trips of each --sizes payload through echo.py's ECHO
+    sink      host to device throughput, echo.py's SINK, per --chunks size
+    source    device to host throughput, echo.py's SOURCE, per --chunks
+    commands  text command lines of main.py, per --mix, timed from the
+              write until the next prompt, with --no-echo after E=0
+    binary    setpoints in binary protocol frames of main.py, --batches
+              of them per frame, timed from the write until the reply
+
+echo, sink and source need flash/echo.py running on the device (import
+echo; echo.run() at the REPL), commands and binary need main.py.  With
+no --port, each mode runs against a simulator on a pty instead,
+tracerclient.sim's EchoSimulator or Simulator, so no hardware is needed.
+The exit status is 1 if any reply was wrong.
+
+    python3 host/serial_bench.py                         # all, simulated
+    python3 host/serial_bench.py echo sink source --port /dev/ttyACM0
+    python3 host/serial_bench.py commands binary --port /dev/ttyACM0
+    python3 host/serial_bench.py commands --mix ohms query -n 500
+"""
+
+import argparse
+import json
+import os
+import select
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'flash', 'lib'))
+
+import binproto
+from tracerclient.client import open_raw
+from tracerclient.sim import EchoSimulator, Simulator
+
+PROMPT = b'\n> '
+MODES = ('echo', 'sink', 'source', 'commands', 'binary')
+ECHO_MODES = ('echo', 'sink', 'source')
+
+# command lines of each --mix, cycled through
+MIXES = {
+    'counts': ['X1=10', 'X1=200', 'X2=64', 'X2=128'],
+    'ohms': ['R1=100', 'R2=50.5', 'R1=13.25', 'R2=275'],
+    'query': ['X1?', 'R2?', 'K1?', ''],
+    'multi': ['X1=10;X2=20;K1=0', 'R1=100;R2=200;R1?;R2?'],
+}
+
+
+class Link:
+    """Blocking reads and writes, with a timeout, on a raw port."""
+
+    def __init__(self, port, timeout=5.0):
+        self.fd = open_raw(port)
+        self.timeout = timeout
+        self.buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                select.select([], [self.fd], [], self.timeout)
+
+    def fill(self, deadline):
+        wait = deadline - time.perf_counter()
+        if wait <= 0 or not select.select([self.fd], [], [], wait)[0]:
+            raise TimeoutError('no reply, got {!r}'.format(
+                bytes(self.buffer[-40:])))
+        self.buffer += os.read(self.fd, 65536)
+
+    def take(self, n):
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def read(self, n):
+        deadline = time.perf_counter() + self.timeout
+        while len(self.buffer) < n:
+            self.fill(deadline)
+        return self.take(n)
+
+    def read_until(self, marker):
+        deadline = time.perf_counter() + self.timeout
+        while marker not in self.buffer:
+            self.fill(deadline)
+        return self.take(self.buffer.index(marker) + len(marker))
+
+    def flush_input(self, quiet=0.05):
+        """Discards everything until the device has been quiet."""
+        self.buffer.clear()
+        while select.select([self.fd], [], [], quiet)[0]:
+            os.read(self.fd, 65536)
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def result(mode, case, latencies, elapsed, nbytes, errors):
+    """One row of the report, latencies in seconds."""
+    ordered = sorted(latencies)
+    ms = [round(percentile(ordered, p) * 1e3, 3) for p in (50, 95, 99, 100)]
+    return {
+        'mode': mode, 'case': case, 'count': len(latencies),
+        'p50_ms': ms[0], 'p95_ms': ms[1], 'p99_ms': ms[2], 'max_ms': ms[3],
+        'per_s': round(len(latencies) / elapsed, 1),
+        'bytes_per_s': round(nbytes / elapsed),
+        'errors': errors,
+    }
+
+
+def sync_echo(link):
+    link.flush_input()
+    link.write(b'\n')  # answered by '! '
+    link.read_until(b'!')
+    link.read_until(b'\n')
+
+
+def payload(n, seed=0):
+    """n printable bytes, different for each seed."""
+    return bytes(0x21 + (seed + i) % 94 for i in range(n))
+
+
+def bench_echo(link, args):
+    sync_echo(link)
+    rows = []
+    for size in args.sizes:
+        link.write('ECHO {} {}\n'.format(size, args.count).encode())
+        latencies = []
+        errors = 0
+        t0 = time.perf_counter()
+        for i in range(args.count):
+            data = payload(size, i)
+            start = time.perf_counter()
+            link.write(data)
+            errors += link.read(size) != data
+            latencies.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - t0
+        errors += link.read_until(b'\n').split()[:2] != \
+            [b'ECHO', str(size).encode()]
+        rows.append(result('echo', '{} B'.format(size), latencies, elapsed,
+                           2 * size * args.count, errors))
+    return rows
+
+
+def bench_sink(link, args):
+    sync_echo(link)
+    data = payload(args.total)
+    rows = []
+    for chunk in args.chunks:
+        latencies = []
+        errors = 0
+        for i in range(args.transfers):
+            start = time.perf_counter()
+            link.write('SINK {} {}\n'.format(args.total, chunk).encode())
+            link.write(data)
+            errors += link.read_until(b'\n').split()[:2] != \
+                [b'SINK', str(args.total).encode()]
+            latencies.append(time.perf_counter() - start)
+        rows.append(result('sink', '{} B chunks'.format(chunk), latencies,
+                           sum(latencies), args.total * args.transfers,
+                           errors))
+    return rows
+
+
+def bench_source(link, args):
+    sync_echo(link)
+    rows = []
+    for chunk in args.chunks:
+        pattern = bytes(0x30 + i % 10 for i in range(chunk))
+        expected = b''.join(pattern[:min(chunk, args.total - first)]
+                            for first in range(0, args.total, chunk))
+        latencies = []
+        errors = 0
+        for i in range(args.transfers):
+            start = time.perf_counter()
+            link.write('SOURCE {} {}\n'.format(args.total, chunk).encode())
+            errors += link.read(args.total) != expected
+            latencies.append(time.perf_counter() - start)
+            errors += link.read_until(b'\n').split()[:2] != \
+                [b'SOURCE', str(args.total).encode()]
+        rows.append(result('source', '{} B chunks'.format(chunk), latencies,
+                           sum(latencies), args.total * args.transfers,
+                           errors))
+    return rows
+
+
+def sync_prompt(link):
+    link.flush_input()
+    link.write(b'\n')
+    link.read_until(PROMPT)
+
+
+def bench_commands(link, args):
+    sync_prompt(link)
+    if args.no_echo:
+        link.write(b'E=0\n')
+        link.read_until(PROMPT)
+    rows = []
+    for mix in args.mix:
+        lines = MIXES[mix]
+        latencies = []
+        errors = 0
+        nbytes = 0
+        t0 = time.perf_counter()
+        for i in range(args.count):
+            line = lines[i % len(lines)].encode() + b'\n'
+            start = time.perf_counter()
+            link.write(line)
+            reply = link.read_until(PROMPT)
+            latencies.append(time.perf_counter() - start)
+            errors += b'!' in reply
+            nbytes += len(line) + len(reply)
+        rows.append(result('commands', mix, latencies,
+                           time.perf_counter() - t0, nbytes, errors))
+    if args.no_echo:
+        link.write(b'E=1\n')
+        link.read_until(PROMPT)
+    return rows
+
+
+def exchange(link, frame):
+    """Sends one frame, returns (reply payload, bytes read)."""
+    link.write(frame)
+    nbytes = 2
+    while link.read(1)[0] != binproto.SYNC:
+        nbytes += 1
+    length = link.read(1)[0]
+    payload = binproto.check(length, link.read(length + binproto.CRC_SIZE))
+    if payload is None:
+        raise IOError('reply failed its crc check')
+    return binproto.reply(payload), nbytes + length + binproto.CRC_SIZE
+
+
+def bench_binary(link, args):
+    sync_prompt(link)
+    link.write(b'B\n')
+    link.read_until(b'BINARY')
+    link.read_until(b'\n')
+    setpoints = [13.0 + (k % 263) for k in range(args.count)]
+    rows = []
+    try:
+        for nbatch in args.batches:
+            latencies = []
+            errors = 0
+            nbytes = 0
+            t0 = time.perf_counter()
+            for k in range(0, args.count, nbatch):
+                if nbatch == 1:
+                    frame = binproto.request(binproto.OP_SET_OHMS, k & 0xff,
+                                             1, setpoints[k])
+                else:
+                    frame = binproto.batch(
+                        k & 0xff, [(binproto.OP_SET_OHMS, 1, ohms)
+                                   for ohms in setpoints[k:k + nbatch]])
+                start = time.perf_counter()
+                (opcode, seq, status, data), n = exchange(link, frame)
+                latencies.append(time.perf_counter() - start)
+                errors += status != binproto.ST_OK or seq != k & 0xff
+                nbytes += len(frame) + n
+            elapsed = time.perf_counter() - t0
+            row = result('binary', '{} per frame'.format(nbatch), latencies,
+                         elapsed, nbytes, errors)
+            row['setpoints_per_s'] = round(args.count / elapsed, 1)
+            rows.append(row)
+    finally:
+        exchange(link, binproto.request(binproto.OP_EXIT, 0))
+        link.read_until(PROMPT)
+    return rows
+
+
+BENCHES = {'echo': bench_echo, 'sink': bench_sink, 'source': bench_source,
+           'commands': bench_commands, 'binary': bench_binary}
+
+
+def run(mode, args):
+    """Runs one mode on args.port, or on a simulator if there is none."""
+    sim = None
+    port = args.port
+    if port is None:
+        device = EchoSimulator if mode in ECHO_MODES else Simulator
+        sim = device(args.delay)
+        port = sim.port
+    try:
+        with Link(port, args.timeout) as link:
+            return BENCHES[mode](link, args)
+    finally:
+        if sim is not None:
+            sim.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('modes', nargs='*',
+                        help='of {}, default all of them'.format(
+                            ', '.join(MODES)))
+    parser.add_argument('--port', help='serial port, default a simulator')
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help='round trips, commands or setpoints per case')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1, 16, 64, 256, 1024],
+                        help='echo payload sizes, bytes')
+    parser.add_argument('--chunks', type=int, nargs='+',
+                        default=[64, 512, 4096],
+                        help='sink and source chunk sizes, bytes')
+    parser.add_argument('--total', type=int, default=65536,
+                        help='bytes per sink or source transfer')
+    parser.add_argument('--transfers', type=int, default=5,
+                        help='sink or source transfers per case')
+    parser.add_argument('--mix', nargs='+', choices=sorted(MIXES),
+                        default=sorted(MIXES), help='command mixes')
+    parser.add_argument('--no-echo', action='store_true',
+                        help='turn the command echo off, E=0')
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 16],
+                        help='setpoints per binary frame')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='simulated reply delay, seconds')
+    parser.add_argument('--timeout', type=float, default=5.0,
+                        help='seconds to wait for a reply')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args()
+    # by hand, argparse rejects no modes at all with choices on 3.11
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error('unknown mode {!r}, choose from {}'.format(
+                mode, ', '.join(MODES)))
+    args.modes = args.modes or MODES
+
+    print('{:9} {:16} {:>6} {:>8} {:>8} {:>8} {:>9} {:>10} {:>4}'.format(
+        'mode', 'case', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'per s',
+        'kB/s', 'errs'))
+    rows = []
+    for mode in args.modes:
+        for row in run(mode, args):
+            rows.append(row)
+            print('{:9} {:16} {:>6} {:>8.3f} {:>8.3f} {:>8.3f} {:>9.1f} '
+                  '{:>10.1f} {:>4}'.format(
+                      row['mode'], row['case'], row['count'], row['p50_ms'],
+                      row['p95_ms'], row['p99_ms'], row['per_s'],
+                      row['bytes_per_s'] / 1e3, row['errors']))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({'port': args.port or 'simulator', 'results': rows},
+                      fout, indent=2)
+    if any(row['errors'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+""" Host client for the TraceR, see client.py, and a simulator, sim.py. """
+
+from .client import (AsyncTraceR, Command, State, TraceR, TraceRError,
+                     UnverifiedWrite, WaveState)
+
+__all__ = ['AsyncTraceR', 'Command', 'State', 'TraceR', 'TraceRError',
+           'UnverifiedWrite', 'WaveState']
@@ -0,0 +1,438 @@
+""" TraceR clients, over the binary protocol of flash/lib/binproto.py.
+
+AsyncTraceR keeps up to `window` requests in flight at once instead of
+waiting for each reply, and matches replies to requests by their
+sequence numbers.  TraceR is the same client with blocking calls, for
+scripts that do not use asyncio.
+
+    with TraceR('/dev/ttyACM0') as tr:
+        tr.sweep(1, range(13, 276))
+        print(tr.get_state())
+"""
+
+import asyncio
+import math
+import os
+import struct
+import termios
+import tty
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import binproto
+
+PROMPT = b'\n> '
+BINARY = b'BINARY'
+
+
+class TraceRError(Exception):
+    """A request the TraceR rejected, or a broken link."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class UnverifiedWrite(TraceRError):
+    """The digipot write failed its loopback check, even after retries."""
+
+
+STATUS_MESSAGES = {
+    binproto.ST_BAD_CRC: 'request failed its crc check',
+    binproto.ST_BAD_OPCODE: 'request not supported, or unit uncalibrated',
+    binproto.ST_BAD_ARGS: 'bad target or value',
+    binproto.ST_UNVERIFIED: 'digipot write not verified',
+    binproto.ST_FULL: 'waveform ring, or flash, full',
+}
+
+
+@dataclass(frozen=True)
+class State:
+    """One resistor, as reported by get_state()."""
+    counts: int
+    relay: bool               # True when shunted
+    ohms: Optional[float]     # achieved resistance, None if unknown
+    error: Optional[float]    # requested - achieved, None if unknown
+
+
+@dataclass(frozen=True)
+class WaveState:
+    """Waveform playback, as reported by wave_state()."""
+    state: str                # idle, armed, playing or done
+    position: int             # next step to play
+    loaded: int               # steps uploaded
+    loops: int                # times played through
+    underruns: int            # ticks spent waiting for uploads
+    errors: int               # frames that failed their loopback check
+
+
+@dataclass(frozen=True)
+class Command:
+    """One set command for batch()."""
+    opcode: int
+    target: int
+    value: float
+
+    @classmethod
+    def ohms(cls, target, ohms):
+        return cls(binproto.OP_SET_OHMS, target, float(ohms))
+
+    @classmethod
+    def counts(cls, target, counts):
+        return cls(binproto.OP_SET_COUNTS, target, int(counts))
+
+    @classmethod
+    def temp(cls, target, celsius):
+        return cls(binproto.OP_SET_TEMP, target, float(celsius))
+
+    @classmethod
+    def relay(cls, target, shunt):
+        return cls(binproto.OP_SET_RELAY, target, int(bool(shunt)))
+
+
+def open_raw(port):
+    """Opens a serial port or pty as a raw, non-blocking descriptor."""
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    except termios.error:
+        pass  # not a terminal, e.g. a socket or fifo
+    return fd
+
+
+class AsyncTraceR:
+    """asyncio client, create with `await AsyncTraceR.open(port)`."""
+
+    def __init__(self, fd, window=32):
+        if not 0 < window < 256:
+            raise ValueError('window must be 1 to 255, seq is one byte')
+        self.fd = fd
+        self.loop = asyncio.get_running_loop()
+        self.window = asyncio.Semaphore(window)
+        self.pending = {}
+        self.seq = 0
+        self.buffer = bytearray()
+        self.data = asyncio.Event()
+        self.closed = False
+        self.nrequests = 0
+        self.loop.add_reader(fd, self._readable)
+
+    @classmethod
+    async def open(cls, port, window=32, timeout=5.0):
+        """Opens port and switches the TraceR to the binary protocol."""
+        client = cls(open_raw(port), window)
+        try:
+            await client._enter(timeout)
+        except BaseException:
+            client._release()
+            raise
+        client.reader = asyncio.ensure_future(client._read_replies())
+        return client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _readable(self):
+        try:
+            chunk = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self.closed = True
+        self.buffer += chunk
+        self.data.set()
+
+    async def _read_until(self, marker, timeout):
+        async def wait():
+            while marker not in self.buffer:
+                if self.closed:
+                    raise TraceRError('port closed')
+                self.data.clear()
+                await self.data.wait()
+            end = self.buffer.index(marker) + len(marker)
+            text = bytes(self.buffer[:end])
+            del self.buffer[:end]
+            return text
+        return await asyncio.wait_for(wait(), timeout)
+
+    async def _read(self, n):
+        while len(self.buffer) < n:
+            if self.closed:
+                raise TraceRError('port closed')
+            self.data.clear()
+            await self.data.wait()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def _enter(self, timeout):
+        self._write(b'\n')
+        await self._read_until(PROMPT, timeout)
+        self._write(b'B\n')
+        await self._read_until(BINARY, timeout)
+        await self._read_until(b'\n', timeout)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self.fd, view)
+            except BlockingIOError:
+                n = 0
+            view = view[n:]
+
+    async def _read_replies(self):
+        try:
+            while True:
+                if (await self._read(1))[0] != binproto.SYNC:
+                    continue
+                length = (await self._read(1))[0]
+                body = await self._read(length + binproto.CRC_SIZE)
+                payload = binproto.check(length, body)
+                if payload is None or length < 3:
+                    continue  # the request will time out
+                opcode, seq, status, data = binproto.reply(payload)
+                if status == binproto.ST_BAD_CRC:
+                    continue  # seq is not the request's, it will time out
+                future = self.pending.pop(seq, None)
+                if future is not None and not future.done():
+                    future.set_result((status, data))
+        except TraceRError as err:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(err)
+            self.pending.clear()
+
+    async def request(self, build, timeout=5.0):
+        """Sends the frame build(seq) returns, waits for its reply.
+        Returns the reply data, raises TraceRError on a bad status."""
+        async with self.window:
+            seq = self.seq
+            self.seq = (self.seq + 1) & 0xff
+            future = self.loop.create_future()
+            self.pending[seq] = future
+            self._write(build(seq))
+            self.nrequests += 1
+            try:
+                status, data = await asyncio.wait_for(future, timeout)
+            finally:
+                self.pending.pop(seq, None)
+        if status == binproto.ST_UNVERIFIED:
+            raise UnverifiedWrite(STATUS_MESSAGES[status], status)
+        if status != binproto.ST_OK:
+            raise TraceRError(STATUS_MESSAGES.get(status, 'status {}'.format(
+                status)), status)
+        return data
+
+    async def set_ohms(self, target, ohms):
+        """Sets resistor target, 1 or 2, or 0 for both, to ohms."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_SET_OHMS, seq, target, float(ohms)))
+
+    async def set_counts(self, target, counts):
+        """Sets the digipot counts of resistor target."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_SET_COUNTS, seq, target, int(counts)))
+
+    async def set_temp(self, target, celsius):
+        """Sets resistor target to the temperature on its sensor curve,
+        selected at the prompt with C<n>=slot."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_SET_TEMP, seq, target, float(celsius)))
+
+    async def set_relay(self, target, shunt):
+        """Shunts (True) or opens (False) the relay of resistor target."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_SET_RELAY, seq, target, int(bool(shunt))))
+
+    async def batch(self, commands: Sequence[Command]):
+        """Applies several set commands in one digipot write."""
+        await self.request(lambda seq: binproto.batch(
+            seq, [(c.opcode, c.target, c.value) for c in commands]))
+
+    async def get_state(self) -> Tuple[State, ...]:
+        """The state of both resistors."""
+        data = await self.request(lambda seq: binproto.request(
+            binproto.OP_GET_STATE, seq))
+        return tuple(State(counts, bool(relay),
+                           None if math.isnan(ohms) else ohms,
+                           None if math.isnan(error) else error)
+                     for counts, relay, ohms, error in binproto.states(data))
+
+    async def sweep(self, target, setpoints: Iterable[float]) -> List[
+            Optional[TraceRError]]:
+        """Sets resistor target to each of setpoints in turn, with up
+        to window of them in flight.  Returns, per setpoint, None or
+        the TraceRError it raised."""
+        async def one(ohms):
+            try:
+                await self.set_ohms(target, ohms)
+            except TraceRError as err:
+                return err
+            return None
+        return await asyncio.gather(*[one(ohms) for ohms in setpoints])
+
+    async def wave_begin(self, target, capacity, tick_us, length):
+        """Starts a new waveform for resistor target, in a ring of
+        capacity steps, ticking every tick_us, of length steps, or
+        endless if 0."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_BEGIN, seq, target, capacity, tick_us, length))
+
+    async def wave_data(self, first, steps: Sequence[Tuple[float, int]]):
+        """Uploads steps, (ohms, dwell in ticks) pairs, from step first
+        on, at most binproto.WAVE_CHUNK of them."""
+        await self.request(lambda seq: binproto.wave_data(seq, first, steps))
+
+    async def wave_play(self, loops=1, armed=False):
+        """Plays the waveform loops times, 0 is forever, now or, if
+        armed, on its trigger."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_PLAY, seq, int(armed), loops))
+
+    async def wave_trigger(self):
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_TRIGGER, seq))
+
+    async def wave_stop(self):
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_STOP, seq))
+
+    async def wave_state(self) -> WaveState:
+        data = await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_STATE, seq))
+        state, *counts = struct.unpack(binproto.WAVE_STATE, data)
+        return WaveState(binproto.WAVE_STATES[state], *counts)
+
+    async def wave_save(self, slot):
+        """Saves the waveform to flash, it must fit in its ring."""
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_SAVE, seq, slot))
+
+    async def wave_load(self, slot):
+        await self.request(lambda seq: binproto.request(
+            binproto.OP_WAVE_LOAD, seq, slot))
+
+    async def play_wave(self, target, steps: Iterable[Tuple[float, int]],
+                        tick_us=1000, capacity=256, loops=1,
+                        armed=False) -> WaveState:
+        """Uploads steps, (ohms, dwell in ticks) pairs, and plays them
+        on resistor target.  The first capacity steps are sent before
+        playback starts, the rest stream in while it plays, as the ring
+        frees up.  Only waveforms that fit in the ring can loop.
+        Returns the state once every step is uploaded."""
+        steps = list(steps)
+        chunks = [(k, steps[k:k + binproto.WAVE_CHUNK])
+                  for k in range(0, len(steps), binproto.WAVE_CHUNK)]
+        await self.wave_begin(target, capacity, tick_us, len(steps))
+        npreload = 0
+        while (npreload < len(chunks) and
+               chunks[npreload][0] + len(chunks[npreload][1]) <= capacity):
+            npreload += 1
+        # in order, so pipelining them keeps first within what is loaded
+        await asyncio.gather(*[self.wave_data(first, chunk)
+                               for first, chunk in chunks[:npreload]])
+        await self.wave_play(loops, armed)
+        for first, chunk in chunks[npreload:]:
+            while True:
+                try:
+                    await self.wave_data(first, chunk)
+                    break
+                except TraceRError as err:
+                    if err.status != binproto.ST_FULL:
+                        raise
+                # wait for about half the chunk to play out
+                await asyncio.sleep(sum(dwell for _, dwell in chunk)
+                                    * tick_us / 2e6)
+        return await self.wave_state()
+
+    def _release(self):
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+    async def close(self, timeout=5.0):
+        """Returns the TraceR to the text prompt and closes the port."""
+        if self.fd is None:
+            return
+        try:
+            if not self.closed:
+                await self.request(lambda seq: binproto.request(
+                    binproto.OP_EXIT, seq), timeout)
+        finally:
+            self.reader.cancel()
+            self._release()
+            self.fd = None
+
+
+class TraceR:
+    """Blocking client, the same calls as AsyncTraceR."""
+
+    def __init__(self, port, window=32, timeout=5.0):
+        self.loop = asyncio.new_event_loop()
+        self.client = self._run(AsyncTraceR.open(port, window, timeout))
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def set_ohms(self, target, ohms):
+        self._run(self.client.set_ohms(target, ohms))
+
+    def set_counts(self, target, counts):
+        self._run(self.client.set_counts(target, counts))
+
+    def set_temp(self, target, celsius):
+        self._run(self.client.set_temp(target, celsius))
+
+    def set_relay(self, target, shunt):
+        self._run(self.client.set_relay(target, shunt))
+
+    def batch(self, commands):
+        self._run(self.client.batch(commands))
+
+    def get_state(self):
+        return self._run(self.client.get_state())
+
+    def sweep(self, target, setpoints):
+        return self._run(self.client.sweep(target, setpoints))
+
+    def play_wave(self, target, steps, tick_us=1000, capacity=256, loops=1,
+                  armed=False):
+        return self._run(self.client.play_wave(target, steps, tick_us,
+                                               capacity, loops, armed))
+
+    def wave_trigger(self):
+        self._run(self.client.wave_trigger())
+
+    def wave_stop(self):
+        self._run(self.client.wave_stop())
+
+    def wave_state(self):
+        return self._run(self.client.wave_state())
+
+    def wave_save(self, slot):
+        self._run(self.client.wave_save(slot))
+
+    def wave_load(self, slot):
+        self._run(self.client.wave_load(slot))
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        try:
+            self._run(self.client.close())
+        finally:
+            self.loop.close()
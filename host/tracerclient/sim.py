@@ -0,0 +1,433 @@
+""" A pty-backed TraceR stand-in, for exercising clients with no hardware.
+
+Simulator answers on a pseudo terminal the way main.py does on the USB
+serial port: a text prompt served by the same commands.Parser, with
+main.py's replies, and the "B" command into the binary protocol,
+served by the same binproto.Protocol as the firmware.  The
+resistors follow the linear digipot model of Digipot.ohms(), four
+channels in parallel, so set_ohms() lands on the nearest whole count.
+Waveforms play against the wall clock, with the ring and the errors
+of flash/lib/wave.py, though nothing is saved.  EchoSimulator stands in
+for flash/echo.py in the same way, for host/serial_bench.py.
+
+    python3 -m tracerclient.sim              # sweep the simulator
+    python3 -m tracerclient.sim /dev/ttyACM0 # or a real TraceR
+"""
+
+import abc
+import argparse
+import asyncio
+import os
+import queue
+import select
+import struct
+import threading
+import time
+import tty
+
+import binproto
+from commands import Parser, integer, decimal
+
+from .client import AsyncTraceR
+
+
+class Resistor:
+    """One simulated TraceR resistor, an AD8403 with parallel channels."""
+
+    def __init__(self, rtotal=1000.0, rwiper=50.0, nchans=4):
+        self.rtotal = rtotal
+        self.rwiper = rwiper
+        self.nchans = nchans
+        self.counts = 0x80
+        self.relay = False
+        self.rnom = None
+
+    def ohms(self):
+        return (self.rwiper + self.rtotal * self.counts / 256) / self.nchans
+
+    def set_ohms(self, rnom):
+        counts = round((rnom * self.nchans - self.rwiper) * 256 / self.rtotal)
+        self.counts = min(255, max(0, counts))
+        self.rnom = rnom
+
+    def set_counts(self, counts):
+        self.counts = counts
+        self.rnom = None
+
+    def state(self):
+        if self.rnom is None:
+            return (self.counts, int(self.relay), float('nan'), float('nan'))
+        ract = self.ohms()
+        return (self.counts, int(self.relay), ract, self.rnom - ract)
+
+
+class Waveform:
+    """A simulated wave.Wave, stepped through whenever it is asked."""
+
+    def __init__(self, resistors):
+        self.resistors = resistors
+        self.begin(1, 1, 1000, 0)
+
+    def begin(self, target, capacity, tick_us, length):
+        self.target = target
+        self.capacity = capacity
+        self.tick = tick_us / 1e6
+        self.length = length
+        self.steps = {}
+        self.nloaded = 0
+        self.position = 0
+        self.loops = 0
+        self.nloops = 0
+        self.nunderruns = 0
+        self.state = 0
+        self.due = 0.0
+
+    def resident(self):
+        return 0 < self.length <= self.capacity and \
+            self.nloaded == self.length
+
+    def advance(self):
+        now = time.monotonic()
+        while self.state == 2 and now >= self.due:
+            k = self.position
+            if self.length and k >= self.length:
+                self.nloops += 1
+                if (self.loops == 0 or self.nloops < self.loops) and \
+                        self.resident():
+                    k = 0
+                else:
+                    self.state = 3
+                    break
+            if k >= self.nloaded:
+                ticks = int((now - self.due) / self.tick) + 1
+                self.nunderruns += ticks
+                self.due += ticks * self.tick
+                break
+            ohms, dwell = self.steps[k % self.capacity]
+            self.resistors[self.target].set_ohms(ohms)
+            self.position = k + 1
+            self.due += max(1, dwell) * self.tick
+
+    def load(self, first, steps):
+        self.advance()
+        end = first + len(steps)
+        if first > self.nloaded or (self.length and end > self.length):
+            raise ValueError(first)
+        if end > self.capacity + max(0, self.position - 1):
+            return False
+        for k, step in enumerate(steps, first):
+            self.steps[k % self.capacity] = step
+        self.nloaded = end
+        return True
+
+    def play(self, armed, loops):
+        if self.nloaded == 0:
+            raise ValueError('empty')
+        self.loops = loops
+        self.nloops = 0
+        self.position = 0
+        self.state = 1
+        if not armed:
+            self.trigger()
+
+    def trigger(self):
+        if self.state == 1:
+            self.state = 2
+            self.due = time.monotonic()
+
+    def register(self, proto):
+        """Serves the waveform opcodes of proto, except save and load."""
+        def begin(args):
+            target, capacity, tick_us, length = struct.unpack(
+                binproto.ARGS[binproto.OP_WAVE_BEGIN], args)
+            if target not in self.resistors or \
+               not 0 < capacity <= binproto.MAX_CAPACITY:
+                raise ValueError(target)
+            self.begin(target, capacity, tick_us, length)
+            return binproto.ST_OK, b''
+
+        def data(args):
+            first, steps = binproto.wave_steps(args)
+            if not self.load(first, steps):
+                return binproto.ST_FULL, b''
+            return binproto.ST_OK, b''
+
+        def play(args):
+            self.play(*struct.unpack(binproto.ARGS[binproto.OP_WAVE_PLAY],
+                                     args))
+            return binproto.ST_OK, b''
+
+        def trigger(args):
+            self.trigger()
+            return binproto.ST_OK, b''
+
+        def stop(args):
+            self.advance()
+            if self.state != 3:
+                self.state = 0
+            return binproto.ST_OK, b''
+
+        def state(args):
+            self.advance()
+            return binproto.ST_OK, struct.pack(
+                binproto.WAVE_STATE, self.state, self.position, self.nloaded,
+                self.nloops, self.nunderruns, 0)
+
+        for opcode, handler in (
+                (binproto.OP_WAVE_BEGIN, begin), (binproto.OP_WAVE_DATA, data),
+                (binproto.OP_WAVE_PLAY, play),
+                (binproto.OP_WAVE_TRIGGER, trigger),
+                (binproto.OP_WAVE_STOP, stop),
+                (binproto.OP_WAVE_STATE, state)):
+            proto.register(opcode, handler)
+
+
+class PtyDevice(abc.ABC):
+    """A device served on a pty, see port, by serve() in a thread.
+
+    delay holds back everything written by that many seconds, to mimic
+    the USB latency of the real unit.  Like that latency, it overlaps
+    for requests sent without waiting for earlier replies."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.outgoing = queue.Queue()
+        self.threads = [threading.Thread(target=self.serve, daemon=True),
+                        threading.Thread(target=self.send, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.running = False
+        self.outgoing.put((0, None))
+        for thread in self.threads:
+            thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def read(self, n):
+        data = b''
+        while len(data) < n:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not self.running:
+                raise EOFError
+            if ready:
+                data += os.read(self.master, n - len(data))
+        return data
+
+    def write(self, data):
+        self.outgoing.put((time.monotonic() + self.delay, data))
+
+    def send(self):
+        while True:
+            due, data = self.outgoing.get()
+            if data is None:
+                return
+            time.sleep(max(0.0, due - time.monotonic()))
+            os.write(self.master, data)
+
+    @abc.abstractmethod
+    def serve(self):
+        """Answers the host through read() and write() until read()
+        raises EOFError, on close()."""
+
+
+class Simulator(PtyDevice):
+    """Serves one simulated TraceR on a pty, see port, in a thread.
+
+    The text console is main.py's: the same commands.Parser, with X, K,
+    R, E and B, and the empty line for status, and the same replies."""
+
+    def __init__(self, delay=0.0):
+        self.resistors = {1: Resistor(), 2: Resistor()}
+        self.proto = binproto.Protocol(
+            lambda t, v: self.resistors[t].set_ohms(v),
+            lambda t, v: self.resistors[t].set_counts(v),
+            lambda t, v: setattr(self.resistors[t], 'relay', bool(v)),
+            lambda: [self.resistors[t].state() for t in (1, 2)])
+        self.wave = Waveform(self.resistors)
+        self.wave.register(self.proto)
+        self.echo = True
+        self.binary = False
+        self.parser = self.commands()
+        super().__init__(delay)
+
+    def commands(self):
+        """The Parser of main.py's commands, on the simulated resistors."""
+        resistors = self.resistors
+
+        def set_counts(target, ival):
+            resistors[int(target)].set_counts(ival)
+
+        def set_relay(target, ival):
+            resistors[int(target)].relay = bool(ival)
+
+        def set_ohms(target, fval):
+            resistors[int(target)].set_ohms(fval)
+
+        def show_counts(target):
+            return ['X' + target + '=' + str(resistors[int(target)].counts)]
+
+        def show_relay(target):
+            relay = resistors[int(target)].relay
+            return ['K' + target + '=' + ('shunt' if relay else 'open')]
+
+        def show_ohms(target):
+            r = resistors[int(target)]
+            if r.rnom is None:
+                return ['R' + target + '=uncalibrated']
+            counts, relay, ract, rerr = r.state()
+            return ['R' + target + '={:.3f},{:+.3f}'.format(ract, rerr)]
+
+        def show_status(target):
+            replies = []
+            for side in '12':
+                replies += show_counts(side) + show_relay(side) + \
+                    show_ohms(side)
+            return replies
+
+        def set_echo(target, ival):
+            self.echo = bool(ival)
+
+        def show_echo(target):
+            return ['E=' + str(int(self.echo))]
+
+        def enter_binary(target):
+            self.binary = True
+            return ['BINARY']
+
+        parser = Parser(lambda: False)
+        parser.register('X', show_counts, set_counts, integer(0, 255), '12')
+        parser.register('K', show_relay, set_relay, integer(0, 1), '12')
+        parser.register('R', show_ohms, set_ohms, decimal(0, 300), '12')
+        parser.register('E', show_echo, set_echo, integer(0, 1))
+        parser.register('B', enter_binary)
+        parser.register('', show_status)
+        return parser
+
+    def serve(self):
+        try:
+            self.write(b'\r\n> ')
+            line = b''
+            while True:
+                ch = self.read(1)
+                if ch != b'\n':
+                    if b' ' <= ch < b'\x7f':
+                        if self.echo:
+                            self.write(ch.upper())
+                        line += ch.upper()
+                    continue
+                try:
+                    errs, replies = self.parser.execute(line.decode())
+                except ValueError:
+                    errs, replies = True, []
+                self.write(b'!' if errs else b'')
+                for reply in replies:
+                    self.write(b'\r\n' + reply.encode())
+                if self.binary:
+                    self.write(b'\r\n')
+                    self.serve_binary()
+                    self.binary = False
+                line = b''
+                self.write(b'\r\n> ')
+        except (EOFError, OSError):
+            pass
+
+    def serve_binary(self):
+        self.proto.running = True
+        while self.proto.running:
+            if self.read(1)[0] != binproto.SYNC:
+                continue
+            length = self.read(1)[0]
+            body = self.read(length + binproto.CRC_SIZE)
+            self.write(self.proto.receive(length, body))
+
+
+class EchoSimulator(PtyDevice):
+    """Serves flash/echo.py on a pty: "a", ECHO, SINK and SOURCE."""
+
+    def serve(self):
+        try:
+            self.write(b'running...\r\n')
+            line = b''
+            while True:
+                ch = self.read(1)
+                if ch == b'a' and not line:
+                    self.write(b'a' * 100 + b'\r\n')
+                elif ch == b'\n':
+                    self.command(line.decode().split())
+                    line = b''
+                elif ch >= b' ':
+                    line += ch
+        except (EOFError, OSError):
+            pass
+
+    def command(self, words):
+        try:
+            mode = words[0]
+            n, m = (int(word) for word in words[1:])
+            if mode not in ('ECHO', 'SINK', 'SOURCE') or min(n, m) < 1:
+                raise ValueError(mode)
+        except (ValueError, IndexError):
+            self.write(b'! ' + ' '.join(words).encode() + b'\r\n')
+            return
+        t0 = time.perf_counter()
+        if mode == 'ECHO':  # n bytes back, m times
+            for i in range(m):
+                self.write(self.read(n))
+        elif mode == 'SINK':  # n bytes in, m at a time
+            for first in range(0, n, m):
+                self.read(min(m, n - first))
+        else:
+            pattern = bytes(0x30 + i % 10 for i in range(m))
+            for first in range(0, n, m):
+                self.write(pattern[:min(m, n - first)])
+        us = int((time.perf_counter() - t0) * 1e6)
+        self.write('{} {} {}\r\n'.format(mode, n, us).encode())
+
+
+async def bench(port, count, window):
+    async with await AsyncTraceR.open(port, window) as tr:
+        setpoints = [13.0 + (k % 263) for k in range(count)]
+        t0 = time.perf_counter()
+        errors = await tr.sweep(1, setpoints)
+        elapsed = time.perf_counter() - t0
+        state = await tr.get_state()
+    nbad = sum(err is not None for err in errors)
+    print('{} setpoints, window {}: {:.3f} s, {:.0f} setpoints/min, '
+          '{} errors'.format(count, window, elapsed, count / elapsed * 60,
+                             nbad))
+    print('final state', state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('port', nargs='?',
+                        help='TraceR serial port, default a simulator')
+    parser.add_argument('-n', '--count', type=int, default=1000,
+                        help='setpoints to sweep')
+    parser.add_argument('--window', type=int, nargs='+', default=[1, 32],
+                        help='requests in flight, one run per value')
+    parser.add_argument('--delay', type=float, default=0.001,
+                        help='simulated reply delay, seconds')
+    args = parser.parse_args()
+    for window in args.window:
+        if args.port:
+            asyncio.run(bench(args.port, args.count, window))
+        else:
+            with Simulator(args.delay) as sim:
+                asyncio.run(bench(sim.port, args.count, window))
+
+
+if __name__ == '__main__':
+    main()
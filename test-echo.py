@@ -1,25 +1,53 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
+import sys
 import serial
-from time import sleep
+from time import sleep, perf_counter
 from datetime import datetime, timedelta
 
-""" This script works with echo.py on the Pico (and main.py which imports echo and calls run()).  It works on iMac02 running
-    python3.7, and the original Pico (late Jan 2021).
+""" Round trip benchmarks over the Pico's USB serial port.
+
+    echo    works with echo.py on the Pico (and main.py which imports
+            echo and calls run()).  It works on iMac02 running python3.7,
+            and the original Pico (late Jan 2021).
+    ascii   sweeps R1 through setpoints with the text commands of the
+            TraceR main.py, one command and prompt per setpoint
+    binary  the same sweep in the binary protocol, flash/lib/binproto.py,
+            one frame and acknowledgement per setpoint
+    batch   the same sweep in the binary protocol, batches of setpoints
+            per frame, each batch written to the digipots at once
+
+    python3 test-echo.py ascii binary batch --port /dev/ttyACM0
 """
 
-with serial.Serial( '/dev/tty.usbmodem0000000000001',
-                     baudrate = 115200,
-                     stopbits = serial.STOPBITS_ONE,
-                     bytesize = serial.EIGHTBITS,
-                     writeTimeout = 0,
-                     timeout = 10,
-                     rtscts = False,
-                     dsrdtr = False ) as ser:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'flash', 'lib'))
+import binproto
+
+PROMPT = b'\n> '
+
+def open_port(port):
+    return serial.Serial( port,
+                          baudrate = 115200,
+                          stopbits = serial.STOPBITS_ONE,
+                          bytesize = serial.EIGHTBITS,
+                          writeTimeout = 0,
+                          timeout = 10,
+                          rtscts = False,
+                          dsrdtr = False )
 
+def read_until(ser, marker):
+    answer = ser.read_until(marker)
+    if not answer.endswith(marker):
+        raise TimeoutError('expected {!r}, got {!r}'.format(marker, answer))
+    return answer
+
+def echo(ser, count):
     totalDiff = timedelta( seconds = 0.0 )
 
-    for i in range( 100 ):
+    for i in range( count ):
         startTime = datetime.now()
         ser.write( b'a' )
         answer = ser.readline()
@@ -28,5 +56,97 @@ with serial.Serial( '/dev/tty.usbmodem0000000000001',
         if (len( answer ) != 100):
             print( "Incomplete answer, len =", len(answer) )
         totalDiff += endTime - startTime
-        
-    print( f"Average rt time: {totalDiff / 100.0}" )        
+
+    print( f"Average rt time: {totalDiff / count}" )
+
+def sweep(count):
+    """The setpoints, ohms, rising then wrapping around."""
+    return [ 13.0 + (k % 263) for k in range(count) ]
+
+def ascii_sweep(ser, count):
+    ser.write( b'\n' )
+    read_until( ser, PROMPT )
+    start = perf_counter()
+    for ohms in sweep(count):
+        ser.write( 'R1={:g}\n'.format(ohms).encode() )
+        answer = read_until( ser, PROMPT )
+        if b'!' in answer:
+            print( "Error answer", answer )
+    return perf_counter() - start
+
+def exchange(ser, frame):
+    """Sends one frame, returns the reply (opcode, seq, status, data)."""
+    ser.write( frame )
+    while ser.read(1)[0] != binproto.SYNC:
+        pass
+    length = ser.read(1)[0]
+    payload = binproto.check( length, ser.read(length + binproto.CRC_SIZE) )
+    if payload is None:
+        raise IOError('reply failed its crc check')
+    return binproto.reply( payload )
+
+def enter_binary(ser):
+    ser.write( b'\n' )
+    read_until( ser, PROMPT )
+    ser.write( b'B\n' )
+    read_until( ser, b'BINARY' )
+    ser.readline()
+
+def leave_binary(ser):
+    exchange( ser, binproto.request(binproto.OP_EXIT, 0) )
+    read_until( ser, PROMPT )
+
+def binary_sweep(ser, count, nbatch=1):
+    enter_binary(ser)
+    setpoints = sweep(count)
+    start = perf_counter()
+    for k in range(0, count, nbatch):
+        if nbatch == 1:
+            frame = binproto.request( binproto.OP_SET_OHMS, k, 1,
+                                      setpoints[k] )
+        else:
+            frame = binproto.batch( k, [ (binproto.OP_SET_OHMS, 1, ohms)
+                                         for ohms in setpoints[k:k+nbatch] ] )
+        opcode, seq, status, data = exchange( ser, frame )
+        if status != binproto.ST_OK or seq != k & 0xff:
+            print( "Error reply", opcode, seq, status )
+    elapsed = perf_counter() - start
+    leave_binary(ser)
+    return elapsed
+
+MODES = ['echo', 'ascii', 'binary', 'batch']
+
+def main():
+    parser = argparse.ArgumentParser(description='Round trip benchmarks')
+    parser.add_argument('modes', nargs='*', default=[],
+                        help='of ' + ', '.join(MODES) + ', default echo')
+    parser.add_argument('--port', default='/dev/tty.usbmodem0000000000001')
+    parser.add_argument('-n', '--count', type=int, default=None,
+                        help='round trips, or setpoints for the sweeps')
+    parser.add_argument('--batch', type=int, default=16,
+                        help='setpoints per frame in batch mode')
+    args = parser.parse_args()
+    # by hand, argparse checks a list default against choices
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error( f"unknown mode {mode!r}, choose from "
+                          + ', '.join(MODES) )
+    args.modes = args.modes or ['echo']
+
+    with open_port(args.port) as ser:
+        for mode in args.modes:
+            if mode == 'echo':
+                echo( ser, args.count or 100 )
+                continue
+            count = args.count or 300
+            if mode == 'ascii':
+                elapsed = ascii_sweep( ser, count )
+            elif mode == 'binary':
+                elapsed = binary_sweep( ser, count )
+            else:
+                elapsed = binary_sweep( ser, count, args.batch )
+            print( f"{mode}: {count} setpoints in {elapsed:.3f} s, "
+                   f"{count / elapsed:.0f} setpoints/s" )
+
+if __name__ == '__main__':
+    main()